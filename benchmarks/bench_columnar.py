@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Extract the buckets of a large date_histogram/terms response, comparing
+a result() building lists of dicts with esqb.columnar.
+
+    $> python benchmarks/bench_columnar.py
+"""
+import timeit
+import tracemalloc
+
+from esqb import columnar
+from esqb.query import BaseQuery
+
+
+def make_response(days=1000, hosts=100):
+    return {'aggregations': {'by_day': {'buckets': [
+        {'key': 86400000 * day, 'doc_count': hosts,
+         'by_host': {'buckets': [
+             {'key': 'host-{}'.format(host), 'doc_count': 1,
+              'cpu': {'value': day * 0.5 + host}}
+             for host in range(hosts)]}}
+        for day in range(days)]}}}
+
+
+def as_rows(response):
+    query = BaseQuery()
+    return [{'day': day['key'], 'host': host['key'],
+             'doc_count': host['doc_count'],
+             'cpu': query.dotget(host, 'cpu.value')}
+            for day in query.dotget(response, 'aggregations.by_day.buckets')
+            for host in query.dotget(day, 'by_host.buckets')]
+
+
+def as_columns(response):
+    return columnar.bucket_columns(
+        response['aggregations'], 'by_day', 'by_host', values=['cpu.value'])
+
+
+def main(number=5):
+    response = make_response()
+    print('NumPy: {}'.format('yes' if columnar.numpy else 'no'))
+    for extract in (as_rows, as_columns):
+        elapsed = timeit.timeit(lambda: extract(response), number=number)
+        tracemalloc.start()
+        result = extract(response)
+        size, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del result
+        print('{}: {:.1f}ms, {:.1f}MB kept, {:.1f}MB peak'.format(
+            extract.__name__, elapsed / number * 1e3,
+            size / 2 ** 20, peak / 2 ** 20))
+
+
+if __name__ == '__main__':
+    main()
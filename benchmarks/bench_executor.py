@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Throughput and latency of AsyncExecutor against the local mock
+Elasticsearch server, for several connection pool sizes.
+
+    $> python benchmarks/bench_executor.py
+"""
+import asyncio
+import time
+
+from esqb.executor import AsyncExecutor
+from esqb.query import BaseQuery
+from esqb.testing import MockElasticsearch
+from esqb.variable import Variable
+
+
+class LastDocs(BaseQuery):
+    size = Variable('size', default=10, type=int)
+    sort = [{'timestamp': {'order': 'desc'}}]
+
+    def result(self, response):
+        return [r['_source'] for r in self.dotget(response, 'hits.hits')]
+
+
+async def run(url, connections, count):
+    executor = AsyncExecutor(url, index='logs', max_connections=connections)
+    latencies = []
+    query = LastDocs()
+
+    async def one(i):
+        start = time.perf_counter()
+        await executor.execute(query, {'size': i % 10})
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    elapsed = time.perf_counter() - start
+    await executor.close()
+    latencies.sort()
+    return (count / elapsed, latencies[len(latencies) // 2],
+            latencies[int(len(latencies) * 0.99)])
+
+
+def main(count=500, latency=0.002):
+    documents = {'logs': [{'n': i} for i in range(10)]}
+    with MockElasticsearch(documents, latency=latency) as es:
+        for connections in (1, 10, 50):
+            rate, p50, p99 = asyncio.run(run(es.url, connections, count))
+            print('{} connections: {:.0f} queries/s, p50 {:.1f}ms, '
+                  'p99 {:.1f}ms, {} TCP connections'.format(
+                      connections, rate, p50 * 1e3, p99 * 1e3,
+                      es.connections))
+            es.connections = 0
+
+
+if __name__ == '__main__':
+    main()
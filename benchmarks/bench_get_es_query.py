@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare BaseQuery.get_es_query against the previous implementation
+(deep copy of every query part followed by replace_variables) on deep
+aggregation trees.
+
+By default, get_es_query renders the compiled templates and then walks
+and copies the whole result, so that callers may modify it: only
+``shared=True`` skips that walk, returning a read-only result.
+
+    $> python benchmarks/bench_get_es_query.py
+"""
+import timeit
+from copy import deepcopy
+
+from esqb.query import BaseQuery
+from esqb.utils import replace_variables
+from esqb.variable import Variable
+
+interval = Variable('interval', 'day')
+ts = Variable('ts', 'now-1d')
+te = Variable('te', 'now')
+
+
+def aggregation_tree(depth, width):
+    """
+    Build a terms aggregation tree `depth` levels deep with `width`
+    sibling aggregations per level. Only the leaves use variables.
+    """
+    if depth == 0:
+        return {
+            'by_time': {
+                'date_histogram': {
+                    'field': 'timestamp',
+                    'interval': interval,
+                    'extended_bounds': {'min': ts, 'max': te},
+                }
+            }
+        }
+    return {
+        'level_{}_{}'.format(depth, i): {
+            'terms': {'field': 'field_{}'.format(i), 'size': 10},
+            'aggs': aggregation_tree(depth - 1, width),
+        }
+        for i in range(width)
+    }
+
+
+def legacy_get_es_query(q, data):
+    # Reading the parts through the instance would make it copy them
+    return {_q: replace_variables(deepcopy(q._get_part(_q)), data)
+            for _q in ('query', 'size', 'aggs', 'sort')}
+
+
+def main(number=200):
+    data = {'interval': 'hour', 'ts': '2017-01-01', 'te': '2017-02-01'}
+    for depth, width in ((2, 4), (4, 3), (6, 2)):
+        class Q(BaseQuery):
+            size = 0
+            query = {'bool': {'must': [{'term': {'name': 'esqb'}}]}}
+            aggs = aggregation_tree(depth, width)
+
+        q = Q()
+        assert q.get_es_query(data) == legacy_get_es_query(q, data)
+        legacy = timeit.timeit(lambda: legacy_get_es_query(q, data),
+                               number=number)
+        compiled = timeit.timeit(lambda: q.get_es_query(data), number=number)
+        shared = timeit.timeit(lambda: q.get_es_query(data, shared=True),
+                               number=number)
+        print('depth={} width={}: legacy {:.1f}us, compiled {:.1f}us '
+              '({:.1f}x), shared {:.1f}us ({:.1f}x)'.format(
+                  depth, width, legacy / number * 1e6,
+                  compiled / number * 1e6, legacy / compiled,
+                  shared / number * 1e6, legacy / shared))
+
+
+if __name__ == '__main__':
+    main()
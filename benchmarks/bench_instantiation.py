@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cost of creating a query instance (as views do once per request) and
+rendering it, compared with the previous eager deep copies of the
+class attributes in BaseQuery.__init__.
+
+    $> python benchmarks/bench_instantiation.py
+"""
+import timeit
+from copy import deepcopy
+
+from esqb.query import BaseQuery
+
+from bench_get_es_query import aggregation_tree
+
+
+def main(number=1000):
+    data = {'interval': 'hour', 'ts': '2017-01-01', 'te': '2017-02-01'}
+    for depth, width in ((2, 4), (4, 3), (6, 2)):
+        class Q(BaseQuery):
+            size = 0
+            query = {'bool': {'must': [{'term': {'name': 'esqb'}}]}}
+            aggs = aggregation_tree(depth, width)
+
+        def eager():
+            # What BaseQuery.__init__ used to do
+            q = Q()
+            for name in ('aggs', 'query', 'filters', 'sort'):
+                deepcopy(Q.__dict__.get(name, []))
+            return q
+
+        before = timeit.timeit(eager, number=number)
+        after = timeit.timeit(Q, number=number)
+        render = timeit.timeit(lambda: Q().get_es_query(data), number=number)
+        print('depth={} width={}: eager {:.2f}us, lazy {:.2f}us, '
+              'lazy+render {:.2f}us'.format(
+                  depth, width, before / number * 1e6,
+                  after / number * 1e6, render / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
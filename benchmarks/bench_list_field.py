@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Parse comma-separated ID lists with drf_support.ListField, comparing
+the bulk parser with item by item validation.
+
+    $> python benchmarks/bench_list_field.py
+"""
+import sys
+import timeit
+
+import django
+from django.conf import settings
+
+settings.configure()
+django.setup()
+
+from rest_framework import serializers  # noqa: E402
+
+from esqb import drf_support  # noqa: E402
+
+
+class PerItemIntegerField(serializers.IntegerField):
+    """Not eligible for bulk parsing"""
+
+
+def main(number=5):
+    for count in (10000, 100000):
+        data = [','.join(str(i) for i in range(count))]
+        for child, kwargs in ((PerItemIntegerField(), {}),
+                              (serializers.IntegerField(), {}),
+                              (serializers.IntegerField(),
+                               {'as_array': True})):
+            field = drf_support.ListField(child=child, **kwargs)
+            field.bind('ids', None)
+            elapsed = timeit.timeit(
+                lambda: field.run_validation(data), number=number)
+            value = field.run_validation(data)
+            print('{} ids, {}{}: {:.1f}ms, {:.0f}KB'.format(
+                count, child.__class__.__name__,
+                ' as_array' if kwargs else '',
+                elapsed / number * 1e3,
+                (sys.getsizeof(value) +
+                 (0 if kwargs else sum(map(sys.getsizeof, value)))) / 1024))
+
+
+if __name__ == '__main__':
+    main()
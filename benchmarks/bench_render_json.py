@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Throughput of BaseQuery.render_json against get_es_query followed by
+json.dumps.
+
+    $> python benchmarks/bench_render_json.py
+"""
+import json
+import timeit
+
+from esqb.query import BaseQuery
+
+from bench_get_es_query import aggregation_tree
+
+
+def main(number=200):
+    data = {'interval': 'hour', 'ts': '2017-01-01', 'te': '2017-02-01'}
+    for depth, width in ((2, 4), (4, 3), (6, 2)):
+        class Q(BaseQuery):
+            size = 0
+            query = {'bool': {'must': [{'term': {'name': 'esqb'}}]}}
+            aggs = aggregation_tree(depth, width)
+
+        q = Q()
+        assert json.loads(q.render_json(data)) == q.get_es_query(data)
+        dumps = timeit.timeit(
+            lambda: json.dumps(q.get_es_query(data)).encode('utf-8'),
+            number=number)
+        direct = timeit.timeit(lambda: q.render_json(data), number=number)
+        print('depth={} width={}: dict+dumps {:.0f} ops/s, '
+              'render_json {:.0f} ops/s ({:.1f}x)'.format(
+                  depth, width, number / dumps, number / direct,
+                  dumps / direct))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Compare the copying and the structural-sharing modes of
+esqb.utils.replace_variables: time and memory blocks allocated per call.
+
+    $> python benchmarks/bench_replace_variables.py
+"""
+import timeit
+import tracemalloc
+
+from esqb.utils import replace_variables
+
+from bench_get_es_query import aggregation_tree as variable_leaves
+
+
+def aggregation_tree(depth, width):
+    """
+    A large constant aggregation tree with a single variable branch.
+    """
+    tree = {
+        'constant_{}'.format(i): {
+            'terms': {'field': 'field_{}'.format(i)},
+            'aggs': variable_leaves(depth, width),
+        }
+        for i in range(width)
+    }
+    constant = replace_variables(tree, {})
+    constant['variable'] = variable_leaves(1, 1)
+    return constant
+
+
+def allocated_blocks(func):
+    tracemalloc.start()
+    try:
+        snapshot = tracemalloc.take_snapshot()
+        result = func()
+        diff = tracemalloc.take_snapshot().compare_to(snapshot, 'filename')
+    finally:
+        tracemalloc.stop()
+    del result
+    return sum(stat.count_diff for stat in diff if stat.count_diff > 0)
+
+
+def main(number=200):
+    data = {'interval': 'hour', 'ts': '2017-01-01', 'te': '2017-02-01'}
+    for depth, width in ((2, 4), (4, 3), (6, 2)):
+        doc = aggregation_tree(depth, width)
+        for share in (False, True):
+            elapsed = timeit.timeit(
+                lambda: replace_variables(doc, data, share=share),
+                number=number)
+            blocks = allocated_blocks(
+                lambda: replace_variables(doc, data, share=share))
+            print('depth={} width={} share={}: {:.1f}us, {} blocks'.format(
+                depth, width, share, elapsed / number * 1e6, blocks))
+
+
+if __name__ == '__main__':
+    main()
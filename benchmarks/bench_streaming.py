@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Read the hits of a large search response, comparing json.load with the
+incremental parser of esqb.streaming. Each run happens in its own
+process so that their peak RSS can be compared.
+
+    $> python benchmarks/bench_streaming.py [hits]
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from esqb import streaming
+
+
+def write_response(path, hits):
+    with open(path, 'w') as f:
+        f.write('{"took":1,"hits":{"total":{"value":%d},"hits":[' % hits)
+        for i in range(hits):
+            if i:
+                f.write(',')
+            json.dump({'_index': 'logs', '_id': str(i), '_source': {
+                'message': 'event number {} '.format(i) * 10,
+                'value': i * 0.5, 'tags': ['a', 'b', 'c']}}, f)
+        f.write(']}}')
+
+
+def max_rss():
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(method, path):
+    before = max_rss()
+    start = time.perf_counter()
+    total = 0
+    if method == 'json.load':
+        with open(path, 'rb') as f:
+            for hit in json.load(f)['hits']['hits']:
+                total += len(hit['_source']['message'])
+    else:
+        with open(path, 'rb') as f:
+            for hit in streaming.iter_items(f, 'hits.hits'):
+                total += len(hit['_source']['message'])
+    elapsed = time.perf_counter() - start
+    print('{}: {:.2f}s, peak RSS +{:.1f}MB'.format(
+        method, elapsed, (max_rss() - before) / 1024))
+
+
+def main(hits=200000):
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        write_response(path, hits)
+        print('{} hits, {:.1f}MB'.format(
+            hits, os.path.getsize(path) / 2 ** 20))
+        for method in ('json.load', 'streaming'):
+            subprocess.check_call(
+                [sys.executable, __file__, '--run', method, path])
+    finally:
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--run']:
+        run(*sys.argv[2:4])
+    else:
+        main(*map(int, sys.argv[1:]))
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Replay dashboard refreshes sending millisecond "now" times, and report
+the hit rate of the render cache with plain variables and with
+TimeVariables rounded to the minute.
+
+    $> python benchmarks/bench_time_rounding.py
+"""
+import random
+
+from esqb.cache import LRUCache
+from esqb.query import BaseQuery
+from esqb.variable import TimeVariable, Variable
+
+
+def make_query(ts, te):
+    class Dashboard(BaseQuery):
+        render_cache = LRUCache(1024)
+        size = 0
+        query = {'range': {'timestamp': {'gte': ts, 'lte': te}}}
+        aggs = {'by_minute': {'date_histogram': {
+            'field': 'timestamp', 'fixed_interval': '1m'}}}
+    return Dashboard()
+
+
+def main(clients=50, minutes=30, refresh=10):
+    random.seed(0)
+    requests = sorted(
+        start + refresh * 1000 * i + random.randrange(1000)
+        for start in (random.randrange(refresh * 1000)
+                      for _ in range(clients))
+        for i in range(minutes * 60 // refresh))
+    hour = 3600 * 1000
+    for name, query in (
+            ('Variable', make_query(Variable('ts'), Variable('te'))),
+            ('TimeVariable 1m', make_query(
+                TimeVariable('ts', round_to='1m'),
+                TimeVariable('te', round_to='1m', rounding='up')))):
+        for now in requests:
+            query.get_es_query({'ts': now - hour, 'te': now})
+        info = query.render_cache.info()
+        print('{}: {} requests, hit rate {:.1%}'.format(
+            name, len(requests), info.hits / (info.hits + info.misses)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic queries for the benchmarks, parameterized by the size of
+their aggregation tree, their number of variables and filters, and the
+length of the list given to their list variable.
+"""
+from esqb.query import BaseQuery
+from esqb.queryfilter import QueryFilter
+from esqb.variable import Variable
+
+
+class RangeFilter(QueryFilter):
+    """
+    Adds a range on a field between two variables to the query.
+    """
+
+    def __init__(self, index: int):
+        self.field = 'field_{}'.format(index)
+        self.variables = {
+            'gte': Variable('from_{}'.format(index), type=int,
+                            help_text='Lower bound of {}'.format(self.field)),
+            'lte': Variable('to_{}'.format(index), type=int,
+                            help_text='Upper bound of {}'.format(self.field)),
+        }
+
+    def apply(self, query, data):
+        query.setdefault('bool', {}).setdefault('filter', []).append(
+            {'range': {self.field: dict(self.variables)}})
+        return query
+
+
+def aggregation_tree(depth: int, width: int) -> dict:
+    """
+    A terms aggregation tree `depth` levels deep with `width` sibling
+    aggregations per level, and a date histogram at the leaves.
+    """
+    if depth == 0:
+        return {'by_time': {'date_histogram': {
+            'field': 'timestamp',
+            'fixed_interval': Variable('interval', '1h'),
+            'extended_bounds': {'min': Variable('ts', 'now-1d'),
+                                'max': Variable('te', 'now')}}}}
+    return {
+        'level_{}_{}'.format(depth, i): {
+            'terms': {'field': 'field_{}'.format(i), 'size': 10},
+            'aggs': aggregation_tree(depth - 1, width),
+        }
+        for i in range(width)
+    }
+
+
+def make_query_class(depth: int=3, width: int=3, variables: int=10,
+                     filters: int=2, list_size: int=0):
+    """
+    Returns a query class and the data to render it with.
+    """
+    terms = [{'term': {'field_{}'.format(i): Variable(
+        'var_{}'.format(i), type=int, help_text='Value {}'.format(i))}}
+        for i in range(variables)]
+    data = {'var_{}'.format(i): i for i in range(variables)}
+    if list_size:
+        terms.append({'terms': {'id': Variable(
+            'ids', type=list, help_text='Comma-separated ids')}})
+        data['ids'] = list(range(list_size))
+    for i in range(filters):
+        data['from_{}'.format(i)] = i
+        data['to_{}'.format(i)] = i + 100
+    data.update(interval='1h', ts='2024-01-01', te='2024-01-02')
+    query_filters = [RangeFilter(i) for i in range(filters)]
+
+    class Synthetic(BaseQuery):
+        """A synthetic query for the benchmarks."""
+        size = Variable('size', 10, type=int, help_text='Number of hits')
+        query = {'bool': {'filter': terms}}
+        aggs = aggregation_tree(depth, width)
+
+        def __init__(self):
+            super().__init__()
+            self.filters = query_filters
+
+    return Synthetic, data
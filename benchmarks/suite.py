@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite: operations per second, memory blocks allocated and
+peak memory of rendering, variable discovery, serializers and docs
+generation, on synthetic queries of several sizes.
+
+    $> python benchmarks/suite.py
+    $> python benchmarks/suite.py --save baseline.json
+    $> python benchmarks/suite.py --compare baseline.json
+
+With ``--compare``, the results are compared with a saved baseline and
+the exit status is 1 if any of them is worse by more than the
+threshold (10% by default), so that regressions are caught before
+upgrading.
+"""
+import argparse
+import gc
+import json
+import platform
+import sys
+import timeit
+import tracemalloc
+
+from esqb import docs_builder
+from esqb.utils import replace_variables
+
+from generators import make_query_class
+
+try:
+    import django
+    from django.conf import settings
+except ImportError:
+    drf_support = None
+else:
+    if not settings.configured:
+        settings.configure()
+        django.setup()
+    try:
+        from esqb import drf_support
+    except ImportError:
+        drf_support = None
+
+# name: (depth, width, variables, filters, list_size)
+SCENARIOS = {
+    'small': (2, 2, 5, 1, 10),
+    'medium': (3, 3, 20, 3, 1000),
+    'large': (5, 3, 50, 5, 100000),
+}
+
+
+def make_cases(scenario: str) -> dict:
+    """
+    Returns the benchmarked operations for a scenario, by name.
+    """
+    Query, data = make_query_class(*SCENARIOS[scenario])
+    q = Query()
+    cases = {
+        'get_es_query': lambda: q.get_es_query(data),
+        'render_json': lambda: q.render_json(data),
+        'instantiate_and_render': lambda: Query().get_es_query(data),
+        'find_variables': lambda: Query().find_all_variables(),
+        'replace_variables': lambda: replace_variables(Query.aggs, data),
+        'replace_variables_shared': lambda: replace_variables(
+            Query.aggs, data, share=True),
+        'generate_query_docs': lambda: docs_builder.generate_query_docs(
+            q, data),
+    }
+    if drf_support is not None:
+        def build_serializer():
+            drf_support.clear_serializer_cache()
+            return drf_support.get_query_serializer(q)
+
+        serializer_class = drf_support.get_query_serializer(q)
+        # As in a query string: lists are comma-separated
+        request = {k: [','.join(map(str, v))] if isinstance(v, list) else v
+                   for k, v in data.items()}
+
+        def validate():
+            serializer = serializer_class(data=request)
+            serializer.is_valid(raise_exception=True)
+            return serializer.validated_data
+
+        cases['build_serializer'] = build_serializer
+        cases['validate'] = validate
+    return cases
+
+
+def measure(func, min_time: float=0.2, repeat: int=5) -> dict:
+    """
+    Returns the operations per second of `func` (best of `repeat`
+    runs of at least `min_time` seconds), the memory blocks still
+    allocated by one call while its result is alive, and the peak
+    memory used by one call, in bytes.
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time / repeat:
+        number *= 2
+    best = min(timer.repeat(repeat, number)) / number
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        start = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1] - start
+        diff = tracemalloc.take_snapshot().compare_to(before, 'filename')
+    finally:
+        tracemalloc.stop()
+    del result
+    blocks = sum(stat.count_diff for stat in diff if stat.count_diff > 0)
+    return {'ops': 1 / best, 'blocks': blocks, 'peak': peak}
+
+
+def run(scenarios, only=None, min_time: float=0.2) -> dict:
+    results = {}
+    for scenario in scenarios:
+        for name, func in make_cases(scenario).items():
+            if only and not any(part in name for part in only):
+                continue
+            key = '{}[{}]'.format(name, scenario)
+            results[key] = result = measure(func, min_time)
+            print('{:<40} {:>12.1f} ops/s {:>9} blocks {:>10.1f} KiB peak'
+                  .format(key, result['ops'], result['blocks'],
+                          result['peak'] / 1024))
+            sys.stdout.flush()
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Print the changes from the baseline, and return the keys of the
+    results which got worse by more than `threshold`.
+    """
+    regressions = []
+    print()
+    print('{:<40} {:>9} {:>9} {:>9}'.format('vs baseline', 'ops', 'blocks',
+                                            'peak'))
+    for key, result in results.items():
+        old = baseline.get(key)
+        if old is None:
+            continue
+        ratios = [result['ops'] / old['ops']] + [
+            (result[name] + 1) / (old[name] + 1)
+            for name in ('blocks', 'peak')]
+        worse = ratios[0] < 1 - threshold or \
+            any(ratio > 1 + threshold for ratio in ratios[1:])
+        if worse:
+            regressions.append(key)
+        print('{:<40} {:>8.2f}x {:>8.2f}x {:>8.2f}x{}'.format(
+            key, *ratios, '  REGRESSION' if worse else ''))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--scenario', action='append',
+                        choices=sorted(SCENARIOS),
+                        help='scenarios to run (all by default)')
+    parser.add_argument('--only', action='append',
+                        help='only run the cases whose name contains this')
+    parser.add_argument('--min-time', type=float, default=0.2,
+                        help='minimum time of a timing run, in seconds')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare the results with a saved baseline')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change counted as a regression')
+    args = parser.parse_args(argv)
+
+    results = run(args.scenario or list(SCENARIOS), args.only, args.min_time)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(),
+                       'results': results}, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
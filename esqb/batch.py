@@ -0,0 +1,35 @@
+"""
+Helpers to render one query over many sets of data.
+"""
+from collections.abc import Mapping
+
+__all__ = ['iter_rows']
+
+
+def iter_rows(rows):
+    """
+    Iterate over the data dicts in `rows`.
+
+    `rows` is either an iterable of data dicts, or a mapping of
+    variable names to columns of values (lists, arrays, NumPy arrays...)
+    which must all have the same length.
+    """
+    if not isinstance(rows, Mapping):
+        return iter(rows)
+
+    names = list(rows)
+    columns = [_to_list(rows[name]) for name in names]
+    lengths = {len(column) for column in columns}
+    if len(lengths) > 1:
+        raise ValueError('All columns must have the same length')
+    return (dict(zip(names, values)) for values in zip(*columns))
+
+
+def _to_list(column) -> list:
+    """
+    Convert NumPy arrays (or anything with a ``tolist`` method) to
+    lists of native Python values, which are JSON serializable.
+    """
+    if hasattr(column, 'tolist'):
+        return column.tolist()
+    return list(column)
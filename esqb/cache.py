@@ -0,0 +1,87 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+__all__ = ['LRUCache', 'CacheInfo']
+
+CacheInfo = namedtuple(
+    'CacheInfo', 'hits misses evictions expirations maxsize currsize')
+
+_missing = object()
+
+
+class LRUCache(object):
+    """A thread-safe mapping with a bounded size which evicts the least
+    recently used entries first. Entries may optionally expire after
+    `ttl` seconds.
+
+    Hits, misses, evictions and expirations are counted and may be
+    retrieved with :meth:`info`.
+
+    """
+
+    def __init__(self, maxsize: int=128, ttl: float=None, timer=None):
+        if maxsize < 1:
+            raise ValueError('maxsize must be a positive number')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer or time.monotonic
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored for `key`, or `default` if it is not
+        cached (or expired).
+        """
+        with self._lock:
+            entry = self._data.get(key, _missing)
+            if entry is not _missing:
+                value, expires = entry
+                if expires is None or expires > self.timer():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """
+        Stores `value` for `key`, evicting the least recently used
+        entries if the cache is full.
+        """
+        expires = None if self.ttl is None else self.timer() + self.ttl
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Removes all the entries. Statistics are kept.
+        """
+        with self._lock:
+            self._data.clear()
+
+    def info(self) -> CacheInfo:
+        """
+        Returns the cache statistics.
+        """
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions,
+                             self.expirations, self.maxsize, len(self._data))
+
+    def values(self) -> list:
+        """
+        Returns a snapshot of the cached values, expired or not.
+        """
+        with self._lock:
+            return [value for value, _ in self._data.values()]
+
+    def __len__(self):
+        return len(self._data)
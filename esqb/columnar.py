@@ -0,0 +1,160 @@
+"""
+Extract columns of values from Elasticsearch responses in one pass,
+instead of building lists of buckets or hits::
+
+    columns = bucket_columns(response['aggregations'], 'by_day', 'by_host',
+                             values=['cpu.value'])
+    columns['by_day'], columns['by_host'], columns['doc_count'], ...
+
+Numeric columns are NumPy arrays when NumPy is installed, and
+:class:`array.array` otherwise (``'q'`` for integers, ``'d'`` for
+floats, with NaN for missing values). Other columns are lists.
+"""
+from array import array
+from functools import lru_cache
+
+from .utils import split_path
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = ['bucket_columns', 'compile_path', 'hits_columns']
+
+_missing = object()
+
+_NUMERIC_TYPES = frozenset((int, float, type(None)))
+
+
+@lru_cache(maxsize=1024)
+def compile_path(path: str, default=_missing):
+    """Returns a function getting the value at the dot-notation `path`
+    of a document, as ``BaseQuery.dotget`` does.
+
+    Numeric keys index lists (``'sort.0'``). Missing keys raise
+    KeyError unless a `default` is given.
+
+    """
+    keys = tuple(
+        (key, int(key) if key.isdigit() else None)
+        for key in split_path(path))
+
+    def get(doc):
+        try:
+            for key, index in keys:
+                doc = doc[index] if index is not None and \
+                    doc.__class__ is list else doc[key]
+        except (KeyError, IndexError, TypeError):
+            if default is _missing:
+                raise KeyError(path)
+            return default
+        return doc
+
+    return get
+
+
+def _to_column(values: list):
+    """
+    Returns `values` as compactly as their types allow.
+    """
+    types = set(map(type, values))
+    if not types or not types <= _NUMERIC_TYPES:
+        return values
+    if types == {int}:
+        try:
+            column = array('q', values)
+        except OverflowError:
+            # Integers beyond 64 bits
+            return values
+    else:
+        nan = float('nan')
+        column = array('d', [nan if v is None else v for v in values])
+    if numpy is not None:
+        return numpy.frombuffer(column, column.typecode)
+    return column
+
+
+def _get_buckets(aggregation: dict):
+    """
+    Generate the keys and buckets of an aggregation, whether its
+    buckets are a list or keyed by name.
+    """
+    buckets = aggregation['buckets']
+    if buckets.__class__ is dict:
+        yield from buckets.items()
+    else:
+        for bucket in buckets:
+            yield bucket['key'], bucket
+
+
+def bucket_columns(aggregations: dict, *names, values=(),
+                   key_as_string: bool=False) -> dict:
+    """Returns the buckets of the nested bucket aggregations `names`
+    as columns, one row for each innermost bucket.
+
+    `aggregations` holds the first aggregation (usually the
+    ``aggregations`` of a response) and each bucket holds the next
+    one. The result has a column with the keys of each aggregation,
+    named after it, a ``doc_count`` column for the innermost buckets
+    and a column for each dot-notation path in `values`, read from
+    the innermost buckets (None when missing).
+
+    With `key_as_string`, keys are taken from ``key_as_string`` when
+    buckets have it (dates, for instance).
+
+    """
+    if not names:
+        raise ValueError('At least one aggregation name is required')
+    key_columns = [[] for _ in names]
+    count_column = []
+    getters = [compile_path(path, None) for path in values]
+    value_columns = [[] for _ in values]
+    depth = len(names) - 1
+    keys = [None] * len(names)
+
+    def walk(container, level):
+        aggregation = container[names[level]]
+        if level < depth:
+            for key, bucket in _get_buckets(aggregation):
+                if key_as_string:
+                    key = bucket.get('key_as_string', key)
+                keys[level] = key
+                walk(bucket, level + 1)
+            return
+        # The innermost buckets are added to the columns all at once
+        buckets = aggregation['buckets']
+        if buckets.__class__ is dict:
+            key_columns[level].extend(buckets)
+            buckets = list(buckets.values())
+        elif key_as_string:
+            key_columns[level].extend(
+                bucket.get('key_as_string', bucket['key'])
+                for bucket in buckets)
+        else:
+            key_columns[level].extend([bucket['key'] for bucket in buckets])
+        for column, key in zip(key_columns, keys[:level]):
+            column.extend([key] * len(buckets))
+        count_column.extend([bucket.get('doc_count') for bucket in buckets])
+        for column, get in zip(value_columns, getters):
+            column.extend([get(bucket) for bucket in buckets])
+
+    walk(aggregations, 0)
+    columns = {name: _to_column(column)
+               for name, column in zip(names, key_columns)}
+    columns['doc_count'] = _to_column(count_column)
+    columns.update((path, _to_column(column))
+                   for path, column in zip(values, value_columns))
+    return columns
+
+
+def hits_columns(response: dict, fields) -> dict:
+    """
+    Returns the `fields` of the hits of a response as columns. Fields
+    are dot-notation paths in each hit (such as ``'_id'`` or
+    ``'_source.user.name'``); missing values are None.
+    """
+    getters = [compile_path(path, None) for path in fields]
+    hits = response['hits']['hits']
+    return {path: _to_column([get(hit) for hit in hits])
+            for path, get in zip(fields, getters)}
@@ -0,0 +1,287 @@
+"""
+Fetch large ``terms`` aggregations page by page, as ``composite``
+aggregations, so that Elasticsearch never builds all their buckets at
+once.
+
+Only top-level ``terms`` aggregations on a ``field`` or a ``script``
+are rewritten, and only when they are ordered by ``_count`` or
+``_key`` and their ``size`` is larger than a page (paging through all
+the terms of a field to find a top 10 would cost much more than the
+aggregation itself); others are left as they are. The buckets of every page are
+turned back into ``terms`` buckets, and whole responses are given the
+shape the original query would have received::
+
+    pager = CompositePager(query.get_es_query(data), page_size=1000)
+    body = pager.next_body()
+    while body is not None:
+        pager.collect(send(body))
+        body = pager.next_body()
+    response = pager.get_response()
+
+"""
+import json
+
+from . import encoding
+from .transport import Transport, TransportError
+
+__all__ = ['CompositePager', 'is_eligible', 'iter_buckets', 'search']
+
+# Options of terms aggregations which composite aggregations either
+# support or make irrelevant (such as shard_size), when paging.
+_IGNORED_OPTIONS = frozenset((
+    'size', 'order', 'min_doc_count', 'shard_size', 'execution_hint',
+    'collect_mode', 'show_term_doc_count_error'))
+
+_DEFAULT_ORDER = [('_count', 'desc'), ('_key', 'asc')]
+
+# Parts of the query which subsequent pages do not need
+_FIRST_PAGE_ONLY = ('aggs', 'size', 'from', 'sort', 'search_after')
+
+
+def _get_order(options: dict) -> list:
+    """
+    Returns the ``(field, direction)`` pairs of the order of a terms
+    aggregation, or None if buckets cannot be sorted by the client.
+    """
+    order = options.get('order')
+    if order is None:
+        return list(_DEFAULT_ORDER)
+    if isinstance(order, dict):
+        order = [order]
+    fields = []
+    for item in order:
+        if not isinstance(item, dict) or len(item) != 1:
+            return None
+        field, direction = next(iter(item.items()))
+        if field == '_term':
+            field = '_key'
+        if field not in ('_count', '_key') or \
+           direction not in ('asc', 'desc'):
+            return None
+        fields.append((field, direction))
+    if all(field != '_key' for field, _ in fields):
+        fields.append(('_key', 'asc'))
+    return fields
+
+
+def is_eligible(agg: dict, min_size: int=0) -> bool:
+    """
+    Whether a rendered aggregation may be fetched as a composite
+    aggregation: a terms aggregation of more than `min_size` buckets.
+    """
+    options = agg.get('terms')
+    if not isinstance(options, dict):
+        return False
+    if ('field' in options) == ('script' in options):
+        return False
+    try:
+        # Both usually come from str variables
+        if int(options.get('min_doc_count', 1)) < 1 or \
+           int(options.get('size', 10)) <= min_size:
+            return False
+    except (TypeError, ValueError):
+        return False
+    known = _IGNORED_OPTIONS | {'field', 'script', 'value_type'}
+    return known.issuperset(options) and _get_order(options) is not None
+
+
+class CompositePager(object):
+    """Pages through the eligible ``terms`` aggregations of a rendered
+    query.
+
+    :attr:`body` is the first search to send: the query itself, with
+    the eligible aggregations rewritten. Terms aggregations with a
+    ``size`` of at most `min_size` (`page_size` by default) are not
+    eligible. Each response is given to
+    :meth:`feed` (or :meth:`collect`), and :meth:`next_body` returns
+    the following search,
+    only asking for the aggregations which have buckets left, or None
+    when all of them have been fetched.
+
+    """
+
+    def __init__(self, es_query: dict, page_size: int=1000,
+                 min_size: int=None):
+        self.page_size = page_size
+        if min_size is None:
+            min_size = page_size
+        aggs = es_query.get('aggs') or {}
+        self.terms = {name: agg for name, agg in aggs.items()
+                      if is_eligible(agg, min_size)}
+        self.composites = {name: self._rewrite(name, agg)
+                           for name, agg in self.terms.items()}
+        self.body = dict(es_query)
+        self.body['aggs'] = {
+            name: self.composites.get(name, agg)
+            for name, agg in aggs.items()}
+        self._next = {k: v for k, v in es_query.items()
+                      if k not in _FIRST_PAGE_ONLY}
+        self._next['size'] = 0
+        self._next['track_total_hits'] = False
+        self._after = {}
+        self._buckets = {name: [] for name in self.terms}
+        self._first = None
+
+    def _rewrite(self, name: str, agg: dict) -> dict:
+        terms = agg['terms']
+        source = {k: v for k, v in terms.items()
+                  if k not in _IGNORED_OPTIONS}
+        composite = {'size': self.page_size,
+                     'sources': [{name: {'terms': source}}]}
+        rewritten = {'composite': composite}
+        rewritten.update((k, v) for k, v in agg.items() if k != 'terms')
+        return rewritten
+
+    def feed(self, response: dict) -> list:
+        """
+        Take a page of results and return its buckets, as ``(name,
+        bucket)`` pairs of terms aggregation names and buckets, in
+        key order.
+        """
+        names = list(self.terms if self._first is None else self._after)
+        if self._first is None:
+            self._first = response
+        aggregations = response.get('aggregations') or {}
+        buckets = []
+        for name in names:
+            page = aggregations.get(name) or {}
+            found = page.get('buckets') or []
+            min_doc_count = int(
+                self.terms[name]['terms'].get('min_doc_count', 1))
+            buckets.extend(
+                (name, _terms_bucket(name, bucket)) for bucket in found
+                if bucket['doc_count'] >= min_doc_count)
+            if len(found) < self.page_size or 'after_key' not in page:
+                self._after.pop(name, None)
+            else:
+                self._after[name] = page['after_key']
+        return buckets
+
+    def collect(self, response: dict):
+        """
+        Take a page of results, keeping its buckets for
+        :meth:`get_response`.
+        """
+        for name, bucket in self.feed(response):
+            self._buckets[name].append(bucket)
+
+    def next_body(self) -> dict:
+        """
+        Returns the search for the next page, or None if every bucket
+        has been fetched.
+        """
+        if self._first is None:
+            return self.body
+        if not self._after:
+            return None
+        body = dict(self._next)
+        body['aggs'] = {}
+        for name, after in self._after.items():
+            composite = dict(self.composites[name]['composite'], after=after)
+            body['aggs'][name] = dict(self.composites[name],
+                                      composite=composite)
+        return body
+
+    def get_response(self) -> dict:
+        """
+        Returns the first response with the collected buckets turned
+        into the terms aggregations the query asked for: sorted, cut
+        to their ``size`` and with ``sum_other_doc_count``.
+        """
+        response = dict(self._first)
+        aggregations = dict(response.get('aggregations') or {})
+        for name, agg in self.terms.items():
+            buckets = self._buckets[name]
+            for field, direction in reversed(_get_order(agg['terms'])):
+                buckets.sort(key=_bucket_key[field],
+                             reverse=direction == 'desc')
+            size = int(agg['terms'].get('size', 10))
+            result = {
+                'doc_count_error_upper_bound': 0,
+                'sum_other_doc_count': sum(
+                    bucket['doc_count'] for bucket in buckets[size:]),
+                'buckets': buckets[:size],
+            }
+            if 'meta' in aggregations.get(name, {}):
+                result['meta'] = aggregations[name]['meta']
+            aggregations[name] = result
+        response['aggregations'] = aggregations
+        return response
+
+
+_bucket_key = {
+    '_count': lambda bucket: bucket['doc_count'],
+    '_key': lambda bucket: bucket['key'],
+}
+
+
+def _terms_bucket(name: str, bucket: dict) -> dict:
+    """
+    Returns a composite bucket as the bucket of a terms aggregation.
+    """
+    bucket = dict(bucket)
+    key = bucket['key'][name]
+    if key is True or key is False:
+        bucket['key'] = int(key)
+        bucket['key_as_string'] = 'true' if key else 'false'
+    else:
+        bucket['key'] = key
+    return bucket
+
+
+def _search(transport, path: str, body: dict) -> dict:
+    status, response = transport.request('POST', path, encoding.dumps(body))
+    if status >= 400:
+        raise TransportError(status, response)
+    return json.loads(response)
+
+
+def iter_buckets(query, transport, data: dict, index=None,
+                 page_size: int=1000):
+    """
+    Generate the buckets of the eligible terms aggregations of `query`
+    with `data`, as ``(name, bucket)`` pairs, page by page in key
+    order (their ``size`` and ``order`` are not applied, and all the
+    terms aggregations are eligible whatever their ``size``).
+
+    `transport` is a :class:`esqb.transport.Transport` or the URL of
+    the node.
+    """
+    from .executor import search_path
+    owned = isinstance(transport, str)
+    if owned:
+        transport = Transport(transport)
+    pager = CompositePager(query.get_es_query(data), page_size, 0)
+    path = search_path(query.get_index(data) if index is None else index)
+    try:
+        body = pager.next_body()
+        while body is not None:
+            yield from pager.feed(_search(transport, path, body))
+            body = pager.next_body()
+    finally:
+        if owned:
+            transport.close()
+
+
+def search(query, transport, data: dict, index=None,
+           page_size: int=1000, min_size: int=None) -> dict:
+    """
+    Run `query` with `data`, paging through its eligible terms
+    aggregations (see :class:`CompositePager`), and return the
+    response the query would have got.
+    """
+    from .executor import search_path
+    owned = isinstance(transport, str)
+    if owned:
+        transport = Transport(transport)
+    pager = CompositePager(query.get_es_query(data), page_size, min_size)
+    path = search_path(query.get_index(data) if index is None else index)
+    try:
+        body = pager.next_body()
+        while body is not None:
+            pager.collect(_search(transport, path, body))
+            body = pager.next_body()
+    finally:
+        if owned:
+            transport.close()
+    return pager.get_response()
@@ -1,4 +1,8 @@
-import collections
+import collections.abc
+import math
+import sys
+from array import array
+from functools import partial
 
 from django.core.exceptions import ImproperlyConfigured
 try:
@@ -12,19 +16,26 @@ Continuing with an empty DJANGO_SETTINGS_MODULE
 """)
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'x')
     from rest_framework import serializers
+from django.core import validators as django_validators
+from rest_framework import fields, validators
 from rest_framework.utils import html
 
+from .cache import LRUCache
+
+# Synthetic serializer classes, see get_query_serializer
+_serializers = LRUCache(maxsize=1024)
+
 
 def get_variable_serializer_field(variable):
     """"
     Returns a serializer field for a variable.
 
     The variable MAY add parameters to the serializer via a
-    serializer_field_options property.
+    serializer_field_options property, which is not modified.
 
     """
     if hasattr(variable, 'serializer_field_options'):
-        sfo = variable.serializer_field_options or {}
+        sfo = dict(variable.serializer_field_options or {})
     else:
         sfo = {}
 
@@ -62,17 +73,98 @@ def get_query_serializer(query, hide=()):
     include them (either strings containing their names or the
     objects themselves) in the optional hide parameter.
 
+    Serializer classes are cached by query class, hidden variables
+    and the definition of the variables, so they are only built again
+    when any of them changes. See :func:`serializer_cache_info`.
+
     """
-    name = "Synthetic" + query.get_id()[0] + "Serializer"
-    params = {
-        var.name: get_variable_serializer_field(var)
+    variables = [
+        var
         for var in query.find_all_variables()
         if var not in hide and var.name not in hide
-    }
-    return type(name, (serializers.Serializer, ), params)
+    ]
+    key = (query.__class__, frozenset(hide),
+           tuple(_variable_signature(var) for var in variables))
+    serializer = _serializers.get(key)
+    if serializer is None:
+        name = "Synthetic" + query.get_id()[0] + "Serializer"
+        params = {
+            var.name: get_variable_serializer_field(var)
+            for var in variables
+        }
+        serializer = type(name, (serializers.Serializer, ), params)
+        _serializers.set(key, serializer)
+    return serializer
+
+
+def _variable_signature(variable) -> tuple:
+    """
+    Everything in a variable which changes its serializer field.
+    """
+    return (
+        variable.name,
+        variable.type,
+        variable.required,
+        repr(variable.default),
+        variable.help_text,
+        getattr(variable, 'serializer_field_class', None),
+        repr(sorted(
+            (getattr(variable, 'serializer_field_options', None) or {})
+            .items(),
+            key=repr)),
+    )
+
+
+def serializer_cache_info() -> dict:
+    """
+    Statistics of the cache of synthetic serializer classes: hits,
+    misses, evictions, number of classes and an approximation of the
+    memory they use, in bytes.
+    """
+    info = _serializers.info()._asdict()
+    info['memory'] = sum(
+        _approximate_size(serializer) for serializer in _serializers.values())
+    return info
+
+
+def clear_serializer_cache():
+    """
+    Forget all the synthetic serializer classes.
+    """
+    _serializers.clear()
+
+
+def _approximate_size(serializer) -> int:
+    fields = serializer._declared_fields.values()
+    return (sys.getsizeof(serializer) +
+            sys.getsizeof(serializer.__dict__) +
+            sum(sys.getsizeof(field) + sys.getsizeof(field.__dict__)
+                for field in fields))
 
 
 class ListField(serializers.ListField):
+    """
+    A ListField which receives its items as a comma-separated string.
+
+    Lists of integers, floats and strings (without further validation
+    options in the child field) are parsed and validated in bulk,
+    which is much faster for very long lists. Items failing to
+    validate are then reported one by one, as usual.
+
+    Besides the ListField arguments, it accepts:
+
+    - ``unique``: remove duplicated items, keeping the first ones.
+    - ``as_array``: return lists of integers or floats as an
+      :class:`array.array`, which uses much less memory.
+
+    ``max_length`` is checked before parsing any item.
+    """
+
+    def __init__(self, **kwargs):
+        self.unique = kwargs.pop('unique', False)
+        self.as_array = kwargs.pop('as_array', False)
+        super().__init__(**kwargs)
+
     def to_internal_value(self, data):
         """
         List of dicts of native values <- List of dicts of primitive datatypes.
@@ -81,12 +173,129 @@ class ListField(serializers.ListField):
         if html.is_html_input(_data):
             data = html.parse_html_list(_data)
         if isinstance(_data, type('')) or \
-           isinstance(_data, collections.Mapping) or \
+           isinstance(_data, collections.abc.Mapping) or \
            not hasattr(data, '__iter__'):
             self.fail('not_a_list', input_type=type(_data).__name__)
         if not self.allow_empty and len(_data) == 0:
             self.fail('empty')
-        return [self.child.run_validation(item) for item in _data]
+        if self.max_length is not None and len(_data) > self.max_length:
+            self.fail('max_length', max_length=self.max_length)
+
+        parse, typecode = self._get_bulk_parser()
+        values = parse(_data) if parse is not None else None
+        if values is None:
+            values = self._run_child_validation(_data)
+        if self.unique:
+            values = list(dict.fromkeys(values))
+        if self.as_array and typecode is not None:
+            try:
+                return array(typecode, values)
+            except OverflowError:
+                self._fail_out_of_range(values, typecode)
+        return values
+
+    def _fail_out_of_range(self, values: list, typecode: str):
+        """
+        Raise the errors of the integers which do not fit in an array
+        of `typecode`, by index.
+        """
+        limit = 1 << (8 * array(typecode).itemsize - 1)
+        message = 'Ensure this value is between {} and {}.'.format(
+            -limit, limit - 1)
+        raise serializers.ValidationError({
+            idx: [message] for idx, value in enumerate(values)
+            if not -limit <= value < limit})
+
+    def _run_child_validation(self, items) -> list:
+        """
+        Validate the items one by one, collecting the errors of each
+        of them by index.
+        """
+        values = []
+        errors = {}
+        for idx, item in enumerate(items):
+            try:
+                values.append(self.child.run_validation(item))
+            except serializers.ValidationError as e:
+                errors[idx] = e.detail
+        if errors:
+            raise serializers.ValidationError(errors)
+        return values
+
+    def _get_bulk_parser(self):
+        """
+        Returns a function parsing all the items at once (or
+        returning None if any of them is not valid), and the array
+        typecode of the values, for the child field.
+        """
+        child = self.child
+        if child.__class__ is _UnvalidatedField:
+            return list, None
+        if child.validators:
+            # Only the validators of every CharField, which the
+            # string parser checks, are supported.
+            if child.__class__ is not serializers.CharField or \
+               not all(validator.__class__ in _string_validators
+                       for validator in child.validators):
+                return None, None
+        if child.__class__ is serializers.IntegerField:
+            return _parse_integers, 'q'
+        elif child.__class__ is serializers.FloatField:
+            return _parse_floats, 'd'
+        elif child.__class__ is serializers.CharField:
+            return partial(
+                _parse_strings,
+                trim_whitespace=child.trim_whitespace,
+                allow_blank=child.allow_blank), None
+        return None, None
+
+
+_UnvalidatedField = getattr(fields, '_UnvalidatedField', None)
+
+# Validators of a CharField without further options
+_string_validators = {
+    getattr(django_validators, 'ProhibitNullCharactersValidator', None),
+    getattr(validators, 'ProhibitSurrogateCharactersValidator', None),
+}
+
+_MAX_STRING_LENGTH = getattr(
+    serializers.IntegerField, 'MAX_STRING_LENGTH', 1000)
+
+
+def _parse_integers(items: list):
+    if items and max(map(len, items)) > _MAX_STRING_LENGTH:
+        return None
+    try:
+        return list(map(int, items))
+    except ValueError:
+        return None
+
+
+def _parse_floats(items: list):
+    if items and max(map(len, items)) > _MAX_STRING_LENGTH:
+        return None
+    try:
+        values = list(map(float, items))
+    except ValueError:
+        return None
+    if not all(map(math.isfinite, values)):
+        return None
+    return values
+
+
+def _parse_strings(items: list, trim_whitespace: bool, allow_blank: bool):
+    values = list(map(str.strip, items)) if trim_whitespace else items
+    if not allow_blank and not all(values):
+        return None
+    joined = ''.join(values)
+    if '\x00' in joined:
+        return None
+    try:
+        joined.encode('utf-8')
+    except UnicodeEncodeError:
+        # Surrogate characters
+        return None
+    return values
 
 
 _default_variable_serializers = {
@@ -0,0 +1,92 @@
+"""
+JSON encoding of rendered queries.
+
+The standard library encoder is used unless another backend is
+selected with :func:`set_backend`. orjson_ is supported out of the box
+when it is installed::
+
+    from esqb import encoding
+    encoding.set_backend('orjson')
+
+.. _orjson: https://github.com/ijl/orjson
+"""
+import json
+from json.encoder import encode_basestring
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = ['dumps', 'encode_key', 'set_backend']
+
+
+def _json_dumps(obj) -> bytes:
+    # Variables usually hold strings or integers, which are encoded
+    # directly instead of going through a JSONEncoder.
+    if obj.__class__ is str:
+        return encode_basestring(obj).encode('utf-8')
+    elif obj.__class__ is int:
+        return int.__repr__(obj).encode('ascii')
+    return json.dumps(
+        obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _orjson_dumps(obj) -> bytes:
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+_backends = {
+    'json': _json_dumps,
+    'orjson': _orjson_dumps,
+}
+
+_backend = _json_dumps
+
+
+def dumps(obj) -> bytes:
+    """
+    Encode `obj` as compact JSON with the selected backend.
+    """
+    return _backend(obj)
+
+
+def set_backend(backend):
+    """
+    Select the JSON encoder used by :func:`dumps`.
+
+    `backend` is either the name of a known backend (``'json'`` or
+    ``'orjson'``) or a callable which receives an object and returns
+    its JSON encoding as bytes.
+    """
+    global _backend
+    if callable(backend):
+        _backend = backend
+        return
+    if backend not in _backends:
+        raise ValueError('Unknown JSON backend {}'.format(backend))
+    if backend == 'orjson' and orjson is None:
+        raise ImportError('orjson is not installed')
+    _backend = _backends[backend]
+
+
+def encode_key(key) -> bytes:
+    """
+    Encode a dictionary key the way json.dumps does, converting the
+    basic non-string types to strings.
+    """
+    if isinstance(key, str):
+        pass
+    elif key is True:
+        key = 'true'
+    elif key is False:
+        key = 'false'
+    elif key is None:
+        key = 'null'
+    elif isinstance(key, (int, float)):
+        key = json.dumps(key)
+    else:
+        raise TypeError(
+            'keys must be str, int, float, bool or None, not {}'.format(
+                key.__class__.__name__))
+    return _json_dumps(key)
@@ -0,0 +1,158 @@
+"""
+Run queries against Elasticsearch and interpret their responses with
+the ``result()`` method of the query, if it has one.
+"""
+import asyncio
+import json
+from urllib.parse import quote
+
+from . import encoding
+from .composite import CompositePager
+from .msearch import MultiSearch
+from .transport import AsyncTransport, TransportError
+
+__all__ = ['AsyncExecutor', 'get_result']
+
+
+def get_result(query, response: dict):
+    """
+    Returns ``query.result(response)``, or the response itself when
+    the query does not define a ``result()`` method.
+    """
+    result = getattr(query, 'result', None)
+    if result is None:
+        return response
+    return result(response)
+
+
+def search_path(index, preference: str=None) -> str:
+    """
+    Returns the path of the ``_search`` endpoint for `index` (a name,
+    a list of names or None for all the indices), with a
+    ``preference`` parameter if given.
+    """
+    query = '' if preference is None else \
+        '?preference=' + quote(preference, safe='')
+    if index is None:
+        return '/_search' + query
+    if not isinstance(index, str):
+        index = ','.join(index)
+    return '/{}/_search{}'.format(index, query)
+
+
+class AsyncExecutor(object):
+    """Renders queries, sends them to Elasticsearch and returns what
+    their ``result()`` method makes of the response::
+
+        executor = AsyncExecutor('http://localhost:9200', index='logs-*')
+        docs = await executor.execute(LastDocs(), {'ts': ..., 'te': ...})
+
+    `transport` is either an :class:`esqb.transport.AsyncTransport` or
+    the URL of the node; other keyword arguments (``max_connections``
+    and ``timeout``) are then given to the transport.
+
+    """
+
+    def __init__(self, transport='http://localhost:9200', index=None,
+                 **kwargs):
+        if isinstance(transport, str):
+            transport = AsyncTransport(transport, **kwargs)
+        self.transport = transport
+        self.index = index
+
+    async def search(self, query, data: dict, index=None,
+                     preference: str=None, body: bytes=None) -> dict:
+        """
+        Run the query with `data` and return the raw response.
+
+        Unless an `index` is given, the indices of the query (see
+        :meth:`esqb.query.BaseQuery.get_index`) are searched, or else
+        those of the executor. `preference` is sent as the
+        ``preference`` parameter of the search (see
+        :func:`esqb.fingerprint.fingerprint`). `body` is the query
+        rendered with `data` as JSON, if already known.
+
+        Queries with a ``composite_size`` have their large terms
+        aggregations fetched page by page, in several requests.
+        """
+        if index is None:
+            index = query.get_index(data)
+        if index is None:
+            index = self.index
+        path = search_path(index, preference)
+        if query.composite_size:
+            return await self._search_composite(query, data, path, body)
+        if body is None:
+            body = query.render_json(data)
+        return await self._post(path, body)
+
+    async def _search_composite(self, query, data: dict, path: str,
+                                body: bytes=None) -> dict:
+        es_query = query.get_es_query(data) if body is None else \
+            json.loads(body)
+        pager = CompositePager(es_query, query.composite_size)
+        body = pager.next_body()
+        while body is not None:
+            pager.collect(await self._post(path, encoding.dumps(body)))
+            body = pager.next_body()
+        return pager.get_response()
+
+    async def _post(self, path: str, body: bytes) -> dict:
+        status, response = await self.transport.request('POST', path, body)
+        if status >= 400:
+            raise TransportError(status, response)
+        return json.loads(response)
+
+    async def execute(self, query, data: dict, index=None,
+                      preference: str=None, body: bytes=None):
+        """
+        Run the query with `data` and return its result.
+        """
+        return get_result(query, await self.search(query, data, index,
+                                                   preference, body))
+
+    async def execute_many(self, requests, return_exceptions: bool=False):
+        """
+        Run concurrently several ``(query, data)`` pairs and return
+        their results, in the same order.
+
+        Concurrency is bounded by the connections of the transport.
+        """
+        return await asyncio.gather(
+            *(self.execute(query, data) for query, data in requests),
+            return_exceptions=return_exceptions)
+
+    async def msearch(self, requests, max_batch: int=100) -> list:
+        """
+        Run several ``(query, data)`` or ``(query, data, index)``
+        searches in ``_msearch`` requests of up to `max_batch`
+        searches, and return their results in the same order.
+
+        A failed search does not affect the others: its exception
+        (usually an :class:`esqb.msearch.SearchError`, or the error
+        raised while rendering it or sending its request) takes its
+        place in the results.
+        """
+        searches = MultiSearch(max_batch, self.index)
+        for request in requests:
+            searches.add(*request[:3])
+
+        async def run(items, body):
+            if not body:
+                return searches.dispatch(items, {'responses': []})
+            try:
+                status, response = await self.transport.request(
+                    'POST', '/_msearch', body, 'application/x-ndjson')
+                if status >= 400:
+                    raise TransportError(status, response)
+                response = json.loads(response)
+            except Exception as e:
+                response = e
+            return searches.dispatch(items, response)
+
+        chunks = await asyncio.gather(
+            *(run(items, body) for items, body in searches.iter_requests()))
+        return [result for chunk in chunks for result in chunk]
+
+    async def close(self):
+        await self.transport.close()
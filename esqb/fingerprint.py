@@ -0,0 +1,286 @@
+"""
+Fingerprints of rendered queries, and coalescing of identical searches
+running at the same time.
+
+When a dashboard is refreshed by many users at once, many threads (or
+tasks) send the very same search. With a :class:`SingleFlight` (or an
+:class:`AsyncSingleFlight`), only the first of them reaches
+Elasticsearch, and the others wait for it and share its result::
+
+    flights = SingleFlight()
+    docs = flights.execute(LastDocs(), data, transport, index='logs-*')
+
+Searches are identical when they have the same fingerprint: a hash of
+the query class, the indices and the canonical JSON body (with sorted
+keys). The fingerprint may also be sent as the ``preference`` of the
+search, so that identical searches hit the same shard copies and their
+request caches.
+
+Results may also be kept in a `cache` (an :class:`esqb.cache.LRUCache`,
+or an :class:`esqb.shared_cache.SharedCache` shared by the workers of
+a pre-fork server) by fingerprint, so that identical searches made
+later are not sent either.
+"""
+import asyncio
+import hashlib
+import json
+import threading
+import weakref
+from array import array
+
+from .executor import get_result, search_path
+from .transport import Transport, TransportError
+
+__all__ = ['AsyncSingleFlight', 'SingleFlight', 'canonical_json',
+           'fingerprint']
+
+_query_ids = weakref.WeakKeyDictionary()
+_missing = object()
+
+
+def _default(obj):
+    if isinstance(obj, (array, tuple, set, frozenset)):
+        return list(obj)
+    raise TypeError('Object of type {} is not JSON serializable'.format(
+        obj.__class__.__name__))
+
+
+def canonical_json(es_query) -> bytes:
+    """
+    Returns the JSON encoding of a rendered query with sorted keys, so
+    that equal queries have the same encoding.
+    """
+    return json.dumps(es_query, sort_keys=True, separators=(',', ':'),
+                      ensure_ascii=False, default=_default).encode('utf-8')
+
+
+def _get_query_id(query) -> bytes:
+    """
+    Returns the id of the class of a query: its module (see
+    :meth:`esqb.query.BaseQuery.get_id`) and its name.
+    """
+    cls = query.__class__
+    query_id = _query_ids.get(cls)
+    if query_id is None:
+        try:
+            module = query.get_id()[1]
+        except (AttributeError, KeyError, TypeError):
+            module = cls.__module__
+        query_id = _query_ids[cls] = '{}:{}'.format(
+            module, cls.__qualname__).encode('utf-8')
+    return query_id
+
+
+def fingerprint(query, data: dict=None, index=None, body: bytes=None) -> str:
+    """Returns the fingerprint of `query` rendered with `data` and sent
+    to `index`, as 32 hexadecimal digits.
+
+    `body` is the canonical JSON body of the query (see
+    :func:`canonical_json`), if already known.
+
+    """
+    if body is None:
+        body = canonical_json(query.get_es_query(data or {}, shared=True))
+    if index is not None and not isinstance(index, str):
+        index = ','.join(index)
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(_get_query_id(query))
+    digest.update(b'\0')
+    digest.update((index or '').encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(body)
+    return digest.hexdigest()
+
+
+class _Call(object):
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Runs only one of the concurrent calls with the same key, in
+    threads; the other callers wait for it and get the same result
+    (or exception).
+
+    Results are shared between the callers, so they must be treated
+    as read-only. :attr:`calls` counts the calls actually run, and
+    :attr:`coalesced` those which waited for another one instead.
+
+    The results of :meth:`execute` are kept in `cache` if given.
+
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def do(self, key, func, *args):
+        """
+        Returns ``func(*args)``, or the result of the call with the
+        same `key` in progress.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = func(*args)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def execute(self, query, data: dict, transport, index=None,
+                preference: bool=False):
+        """Run `query` with `data` through a synchronous `transport`
+        (see :class:`esqb.transport.Transport`, or the URL of the
+        node) and return its result
+        (see :func:`esqb.executor.get_result`), sharing it with the
+        identical searches running at the same time.
+
+        The indices searched are `index`, or those of the query. With
+        `preference`, the fingerprint is sent as the ``preference`` of
+        the search.
+
+        """
+        if index is None:
+            index = query.get_index(data)
+        body = canonical_json(query.get_es_query(data, shared=True))
+        key = fingerprint(query, index=index, body=body)
+        cache = self.cache
+        if cache is not None:
+            result = cache.get(key, _missing)
+            if result is not _missing:
+                return result
+        path = search_path(index, key if preference else None)
+        return self.do(key, _search, query, transport, path, body, cache,
+                       key)
+
+
+def _search(query, transport, path: str, body: bytes, cache, key: str):
+    owned = isinstance(transport, str)
+    if owned:
+        transport = Transport(transport)
+    try:
+        status, response = transport.request('POST', path, body)
+    finally:
+        if owned:
+            transport.close()
+    if status >= 400:
+        raise TransportError(status, response)
+    result = get_result(query, json.loads(response))
+    if cache is not None:
+        cache.set(key, result)
+    return result
+
+
+class AsyncSingleFlight(object):
+    """Runs only one of the concurrent coroutines with the same key;
+    the other tasks wait for it and get the same result (or
+    exception). It must only be used from one event loop.
+
+    Results are shared between the callers, so they must be treated
+    as read-only. The coroutine runs in a task of its own, so that
+    cancelling any of its callers, including the first one, does not
+    cancel it for the others: it is only cancelled once all of them
+    are.
+
+    The results of :meth:`execute` are kept in `cache` if given.
+
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        # Key: [task, number of callers waiting for it]
+        self._flights = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, func, *args):
+        """
+        Returns ``await func(*args)``, or the result of the call with
+        the same `key` in progress.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(func(*args))
+            flight = self._flights[key] = [task, 0]
+            task.add_done_callback(
+                lambda task: self._forget(key, task))
+            self.calls += 1
+        else:
+            task = flight[0]
+            self.coalesced += 1
+        flight[1] += 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            flight[1] -= 1
+            if not flight[1] and not task.done():
+                # Nobody is waiting for it anymore
+                self._forget(key, task)
+                task.cancel()
+
+    def _forget(self, key, task):
+        flight = self._flights.get(key)
+        if flight is not None and flight[0] is task:
+            del self._flights[key]
+        if task.done() and not task.cancelled():
+            # Nobody may be waiting for it
+            task.exception()
+
+    async def execute(self, executor, query, data: dict, index=None,
+                      preference: bool=False):
+        """Run `query` with `data` through an
+        :class:`esqb.executor.AsyncExecutor` and return its result,
+        sharing it with the identical searches running at the same
+        time.
+
+        With `preference`, the fingerprint is sent as the
+        ``preference`` of the search.
+
+        """
+        if index is None:
+            index = query.get_index(data)
+        if index is None:
+            index = executor.index
+        # Rendered once, for the fingerprint and the search
+        body = canonical_json(query.get_es_query(data, shared=True))
+        key = fingerprint(query, index=index, body=body)
+        preference = key if preference else None
+        cache = self.cache
+        if cache is None:
+            return await self.do(key, executor.execute, query, data, index,
+                                 preference, body)
+        result = cache.get(key, _missing)
+        if result is not _missing:
+            return result
+
+        async def search():
+            result = await executor.execute(query, data, index, preference,
+                                            body)
+            cache.set(key, result)
+            return result
+
+        return await self.do(key, search)
@@ -0,0 +1,455 @@
+"""
+Estimates of the cost of rendered queries, and limits rejecting them
+or rewriting them before they reach Elasticsearch::
+
+    class Histogram(BaseQuery):
+        limits = Limits(max_buckets=10000, rewrite=True)
+
+A one-minute histogram over a year then gets a coarser interval, and a
+``terms`` aggregation of a million buckets a smaller ``size``, instead
+of overloading the data nodes.
+
+Estimates are upper bounds computed from the aggregations tree: the
+``size`` of bucket aggregations, the number of intervals of histograms
+over the range the query selects on their field, multiplied by the
+number of buckets of their parents, and the ``size`` of the hits.
+"""
+import time
+
+from . import timeutils
+from .utils import copy_tree
+
+__all__ = ['Estimate', 'Limits', 'QueryLimitExceeded', 'estimate']
+
+# Approximate sizes in the JSON response, in bytes
+HIT_BYTES = 1024
+BUCKET_BYTES = 64
+VALUE_BYTES = 32
+_BASE_BYTES = 256
+
+# Bucket aggregations with a number of buckets, and its default
+_SIZED = {
+    'terms': ('size', 10),
+    'multi_terms': ('size', 10),
+    'significant_terms': ('size', 10),
+    'significant_text': ('size', 10),
+    'composite': ('size', 10),
+    'geohash_grid': ('size', 10000),
+    'geotile_grid': ('size', 10000),
+    'geohex_grid': ('size', 10000),
+    'auto_date_histogram': ('buckets', 10),
+    'variable_width_histogram': ('buckets', 10),
+}
+_SINGLE_BUCKET = {
+    'filter', 'global', 'missing', 'nested', 'reverse_nested', 'sampler',
+    'diversified_sampler', 'random_sampler', 'children', 'parent',
+}
+_RANGES = {'range', 'date_range', 'ip_range', 'geo_distance'}
+# Bucket aggregations whose number of buckets is not known beforehand
+_UNKNOWN = {'rare_terms', 'categorize_text', 'frequent_item_sets'}
+
+# Approximate lengths of calendar intervals, in milliseconds
+_DAY = timeutils.UNITS['d']
+_CALENDAR = {'month': 30 * _DAY, '1M': 30 * _DAY, 'quarter': 91 * _DAY,
+             '1q': 91 * _DAY, 'year': 365 * _DAY, '1y': 365 * _DAY}
+
+# Coarser intervals to rewrite histograms with
+_FIXED_STEPS = ('1s', '5s', '10s', '30s', '1m', '5m', '10m', '30m', '1h',
+                '3h', '12h', '1d', '7d', '30d', '365d')
+_CALENDAR_STEPS = ('1m', '1h', '1d', '1w', '1M', '1q', '1y')
+
+
+class QueryLimitExceeded(Exception):
+    """
+    A query is over the limits of its :class:`Limits`, and cannot be
+    (or must not be) rewritten under them.
+    """
+
+    def __init__(self, reasons: list, estimate):
+        super().__init__('; '.join(reasons))
+        self.reasons = reasons
+        self.estimate = estimate
+
+
+class _Node(object):
+    """
+    A bucket aggregation found while estimating.
+    """
+
+    def __init__(self, path: str, kind: str, body: dict, count: int,
+                 total: int):
+        self.path = path
+        self.kind = kind
+        self.body = body
+        self.count = count
+        self.total = total
+
+
+class Estimate(object):
+    """The estimated cost of a rendered query.
+
+    :attr:`buckets` is the total number of buckets of its aggregations
+    (as counted against ``search.max_buckets``), :attr:`aggs` the
+    number of buckets by aggregation path (such as
+    ``'by_host>by_time'``), :attr:`hits` the number of hits, including
+    those of ``top_hits`` aggregations, :attr:`values` the number of
+    metric values and :attr:`response_bytes` the approximate size of
+    the response. :attr:`unknown` lists the aggregations whose number
+    of buckets could not be estimated (and was counted as one).
+
+    """
+
+    def __init__(self):
+        self.buckets = 0
+        self.hits = 0
+        self.values = 0
+        self.aggs = {}
+        self.unknown = []
+        self._nodes = []
+        self._top_hits = []
+
+    @property
+    def response_bytes(self) -> int:
+        return _BASE_BYTES + self.buckets * BUCKET_BYTES + \
+            self.values * VALUE_BYTES + self.hits * HIT_BYTES
+
+    def as_dict(self) -> dict:
+        """
+        Returns the estimates as a dict, to be exported as metrics.
+        """
+        return {'buckets': self.buckets, 'hits': self.hits,
+                'values': self.values,
+                'response_bytes': self.response_bytes,
+                'aggs': dict(self.aggs), 'unknown': list(self.unknown)}
+
+    def __repr__(self):
+        return '<Estimate buckets={} hits={} response_bytes={}>'.format(
+            self.buckets, self.hits, self.response_bytes)
+
+
+def _get_size(body: dict, key: str='size', default: int=10) -> int:
+    """
+    Returns a size of a query or an aggregation, which variables may
+    have given as a string.
+    """
+    size = body.get(key)
+    return default if size is None else int(size)
+
+
+def estimate(es_query: dict, now: int=None) -> Estimate:
+    """
+    Returns the :class:`Estimate` of a rendered query. Date math in
+    ranges is resolved with `now`, in epoch milliseconds (the current
+    time by default).
+    """
+    if now is None:
+        now = int(time.time() * 1000)
+    result = Estimate()
+    result.hits = _get_size(es_query)
+    _walk(es_query.get('aggs') or es_query.get('aggregations') or {},
+          es_query.get('query') or {}, 1, '', now, result)
+    return result
+
+
+def _walk(aggs: dict, query: dict, parents: int, prefix: str, now: int,
+          result: Estimate):
+    for name, agg in aggs.items():
+        kind, body = next(((k, v) for k, v in agg.items()
+                           if k not in ('aggs', 'aggregations', 'meta')),
+                          (None, {}))
+        path = prefix + name
+        if kind == 'top_hits':
+            size = _get_size(body, default=3)
+            result.hits += parents * size
+            result._top_hits.append(_Node(path, kind, body, size,
+                                          parents * size))
+            continue
+        count = _count_buckets(kind, body, query, now)
+        if count is None:
+            result.values += parents
+            continue
+        if count < 0:
+            result.unknown.append(path)
+            count = 1
+        total = parents * count
+        result.buckets += total
+        result.aggs[path] = total
+        result._nodes.append(_Node(path, kind, body, count, total))
+        _walk(agg.get('aggs') or agg.get('aggregations') or {}, query,
+              total, path + '>', now, result)
+
+
+def _count_buckets(kind: str, body: dict, query: dict, now: int) -> int:
+    """
+    Returns the number of buckets of an aggregation, -1 if it cannot be
+    estimated, or None for other aggregations than bucket ones.
+    """
+    if kind in _SIZED:
+        key, default = _SIZED[kind]
+        return _get_size(body, key, default)
+    if kind in _SINGLE_BUCKET:
+        return 1
+    if kind in _RANGES:
+        return len(body.get('ranges', ()))
+    if kind == 'filters':
+        filters = body.get('filters', ())
+        return len(filters) + bool(body.get('other_bucket') or
+                                   body.get('other_bucket_key'))
+    if kind == 'adjacency_matrix':
+        filters = len(body.get('filters', ()))
+        return filters * (filters + 1) // 2
+    if kind in ('histogram', 'date_histogram'):
+        return _count_intervals(kind, body, query, now)
+    if kind in _UNKNOWN:
+        return -1
+    return None
+
+
+def _get_interval(kind: str, body: dict):
+    """
+    Returns the key, the value and the length of the interval of a
+    histogram, or None.
+    """
+    if kind == 'histogram':
+        interval = body.get('interval')
+        if isinstance(interval, (int, float)) and interval > 0:
+            return 'interval', interval, interval
+        return None
+    for key in ('fixed_interval', 'calendar_interval', 'interval'):
+        if key in body:
+            value = body[key]
+            length = _CALENDAR.get(value) or timeutils.parse_interval(value)
+            if length:
+                return key, value, length
+    return None
+
+
+def _count_intervals(kind: str, body: dict, query: dict, now: int) -> int:
+    interval = _get_interval(kind, body)
+    if interval is None:
+        return -1
+    length = interval[2]
+    low, high = _field_bounds(query, body.get('field'), kind, now)
+    extended = body.get('extended_bounds') or {}
+    hard = body.get('hard_bounds') or {}
+    low = _extend(low, _to_number(extended.get('min'), kind, now), min)
+    high = _extend(high, _to_number(extended.get('max'), kind, now), max)
+    low = _extend(low, _to_number(hard.get('min'), kind, now), max)
+    high = _extend(high, _to_number(hard.get('max'), kind, now), min)
+    if kind == 'date_histogram' and low is not None and high is None:
+        high = now
+    if low is None or high is None:
+        return -1
+    if high < low:
+        return 0
+    return int(high // length - low // length) + 1
+
+
+def _extend(value, other, choose):
+    if other is None:
+        return value
+    if value is None:
+        return other
+    return choose(value, other)
+
+
+def _to_number(value, kind: str, now: int, up: bool=False):
+    """
+    Returns a bound as a number (epoch milliseconds for dates), or None.
+    """
+    if value is None or isinstance(value, bool):
+        return None
+    if kind == 'date_histogram':
+        try:
+            if timeutils.is_date_math(value):
+                return timeutils.resolve_date_math(value, now, up)
+            return timeutils.to_millis(value)
+        except (TypeError, ValueError):
+            return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _field_bounds(query: dict, field: str, kind: str, now: int) -> tuple:
+    """
+    Returns the lowest and highest values of `field` that the query
+    matches (None when not bounded), following the ranges which all
+    the matching documents must satisfy.
+    """
+    low = high = None
+    if not isinstance(query, dict) or field is None:
+        return low, high
+    bounds = (query.get('range') or {}).get(field)
+    if isinstance(bounds, dict):
+        for op in ('gt', 'gte', 'from'):
+            low = _extend(low, _to_number(bounds.get(op), kind, now), max)
+        for op in ('lt', 'lte', 'to'):
+            high = _extend(high, _to_number(bounds.get(op), kind, now, True),
+                           min)
+    bool_query = query.get('bool')
+    if isinstance(bool_query, dict):
+        for occur in ('must', 'filter'):
+            clauses = bool_query.get(occur) or []
+            if isinstance(clauses, dict):
+                clauses = [clauses]
+            for clause in clauses:
+                clause_low, clause_high = _field_bounds(clause, field, kind,
+                                                        now)
+                low = _extend(low, clause_low, max)
+                high = _extend(high, clause_high, min)
+    return low, high
+
+
+class Limits(object):
+    """The limits of the cost of a query (see :class:`Estimate`).
+
+    `max_buckets` bounds the total number of buckets, `max_hits` the
+    number of hits, `max_response_bytes` the approximate size of the
+    response and `max_terms_size` the ``size`` of each ``terms``-like
+    aggregation; None disables a limit.
+
+    Queries over the limits raise :class:`QueryLimitExceeded`, unless
+    `rewrite` is set: the largest aggregations are then reduced
+    (histograms get a coarser interval, other aggregations a smaller
+    ``size``) and the hits cut until the query is within the limits.
+
+    `on_estimate` is called with the :class:`Estimate` of every query
+    checked (after its rewriting), to export it as metrics. Date math
+    is resolved with the time given by `timer`, in seconds.
+
+    """
+
+    def __init__(self, max_buckets: int=None, max_hits: int=None,
+                 max_response_bytes: int=None, max_terms_size: int=None,
+                 rewrite: bool=False, on_estimate=None, timer=None):
+        self.max_buckets = max_buckets
+        self.max_hits = max_hits
+        self.max_response_bytes = max_response_bytes
+        self.max_terms_size = max_terms_size
+        self.rewrite = rewrite
+        self.on_estimate = on_estimate
+        self.timer = timer or time.time
+
+    def estimate(self, es_query: dict) -> Estimate:
+        """
+        Returns the :class:`Estimate` of a rendered query.
+        """
+        return estimate(es_query, int(self.timer() * 1000))
+
+    def check(self, result: Estimate) -> list:
+        """
+        Returns the reasons why an estimate is over the limits.
+        """
+        reasons = []
+        if self.max_terms_size is not None:
+            reasons.extend(
+                '{} has a size of {} (max {})'.format(
+                    node.path, node.count, self.max_terms_size)
+                for node in result._nodes
+                if node.kind in _SIZED and node.count > self.max_terms_size)
+        for name, limit in (('buckets', self.max_buckets),
+                            ('hits', self.max_hits),
+                            ('response_bytes', self.max_response_bytes)):
+            value = getattr(result, name)
+            if limit is not None and value > limit:
+                reasons.append('{} {} over the limit of {}'.format(
+                    value, name.replace('_', ' '), limit))
+        return reasons
+
+    def apply(self, es_query: dict) -> dict:
+        """
+        Returns `es_query`, rewritten to be within the limits if
+        needed and allowed, or raises :class:`QueryLimitExceeded`. The
+        query given is not modified.
+        """
+        result = self.estimate(es_query)
+        reasons = self.check(result)
+        if reasons and self.rewrite:
+            es_query = copy_tree(es_query)
+            result = self.estimate(es_query)
+            while reasons and self._reduce(es_query, result):
+                result = self.estimate(es_query)
+                reasons = self.check(result)
+        if self.on_estimate is not None:
+            self.on_estimate(result)
+        if reasons:
+            raise QueryLimitExceeded(reasons, result)
+        return es_query
+
+    def _reduce(self, es_query: dict, result: Estimate) -> bool:
+        """
+        Reduces the largest part of the query over the limits, in
+        place. Returns False if nothing can be reduced.
+        """
+        if self.max_terms_size is not None:
+            over = [node for node in result._nodes if node.kind in _SIZED
+                    and node.count > self.max_terms_size]
+            for node in over:
+                node.body[_SIZED[node.kind][0]] = self.max_terms_size
+            if over:
+                return True
+        if self.max_buckets is not None and \
+           result.buckets > self.max_buckets:
+            return _reduce_buckets(result)
+        if self.max_hits is not None and result.hits > self.max_hits:
+            return _reduce_hits(es_query, result)
+        # The response is too large: reduce its largest part first
+        if result.hits * HIT_BYTES > result.buckets * BUCKET_BYTES + \
+           result.values * VALUE_BYTES:
+            return _reduce_hits(es_query, result) or \
+                _reduce_buckets(result)
+        return _reduce_buckets(result) or _reduce_hits(es_query, result)
+
+
+def _reduce_buckets(result: Estimate) -> bool:
+    for node in sorted(result._nodes, key=lambda node: -node.total):
+        if node.kind in ('histogram', 'date_histogram'):
+            if _coarsen(node.kind, node.body):
+                return True
+        elif node.kind in _SIZED and node.count > 1:
+            node.body[_SIZED[node.kind][0]] = node.count // 2
+            return True
+    return False
+
+
+def _reduce_hits(es_query: dict, result: Estimate) -> bool:
+    size = _get_size(es_query)
+    largest = max(result._top_hits, key=lambda node: node.total,
+                  default=None)
+    if largest is not None and largest.count and largest.total > size:
+        largest.body['size'] = largest.count // 2
+        return True
+    if size:
+        es_query['size'] = size // 2
+        return True
+    return False
+
+
+def _coarsen(kind: str, body: dict) -> bool:
+    """
+    Sets the next coarser interval of a histogram. Returns False if
+    there is none.
+    """
+    interval = _get_interval(kind, body)
+    if interval is None:
+        return False
+    key, value, length = interval
+    if kind == 'histogram':
+        # The next of 1, 2, 5, 10, 20, 50...
+        step = 1
+        while step <= length:
+            for factor in (2, 2.5, 2):
+                step *= factor
+                if step > length:
+                    break
+        body[key] = int(step) if step >= 1 else step
+        return True
+    steps = _CALENDAR_STEPS if key == 'calendar_interval' or \
+        value in _CALENDAR else _FIXED_STEPS
+    for step in steps:
+        if (_CALENDAR.get(step) or timeutils.parse_interval(step)) > length:
+            body[key] = step
+            return True
+    return False
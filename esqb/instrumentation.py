@@ -0,0 +1,275 @@
+"""
+Timings of the phases of query rendering, to find out where the time
+goes when rendering gets slow::
+
+    with instrument() as recorder:
+        LastDocs().get_es_query(data)
+    recorder.as_dict()
+    # {'app.queries.LastDocs': {'get_es_query': {'': {...}},
+    #                           'filter': {'time_range_filter': {...}},
+    #                           ...}}
+
+Durations (and, optionally, the number of memory blocks allocated) are
+recorded by query class, phase and label into histograms, which can be
+exported as plain dicts or in the Prometheus text format.
+
+The phases are:
+
+* ``get_es_query`` and ``render_json``: the whole rendering;
+* ``plan``: choosing which query parts filters modify;
+* ``find_variables``: walking the query and its filters for their
+  variables (only when they changed);
+* ``copy``: private copies of query parts, labelled by part;
+* ``filter``: the calls to each filter, labelled by filter class;
+* ``render`` and ``replace_variables``: filling the variables of each
+  part, from its template or after filtering it, labelled by part;
+* ``builder``: the calls to the builder of each variable, labelled by
+  variable name;
+* ``optimize`` and ``limits``: see :mod:`esqb.optimizer` and
+  :mod:`esqb.guardrails`.
+
+Nothing is recorded, and rendering only pays for a check, while no
+recorder is enabled. Any object with an ``allocations`` attribute and
+a ``record(query_id, phase, label, seconds, blocks)`` method may be
+used as a recorder, to feed another metrics system.
+"""
+import sys
+import threading
+import weakref
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+__all__ = ['Histogram', 'Recorder', 'disable', 'enable', 'instrument',
+           'query_id', 'timed']
+
+#: The enabled recorder, or None
+recorder = None
+
+# Upper bounds of the buckets of the histograms
+SECONDS_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+BLOCKS_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                  10000, 100000)
+
+_local = threading.local()
+_query_ids = weakref.WeakKeyDictionary()
+
+
+def query_id(query) -> str:
+    """
+    Returns the name under which the timings of a query are recorded:
+    the qualified name of its class.
+    """
+    cls = query.__class__
+    name = _query_ids.get(cls)
+    if name is None:
+        name = _query_ids[cls] = '{}.{}'.format(cls.__module__,
+                                                cls.__qualname__)
+    return name
+
+
+def timed(query, phase: str, label, func, *args):
+    """
+    Returns ``func(*args)``, recording its duration for `query` (or
+    for the query being rendered, if None) with the enabled recorder.
+    """
+    current = recorder
+    if current is None:
+        return func(*args)
+    previous = getattr(_local, 'query_id', '')
+    name = previous if query is None else query_id(query)
+    _local.query_id = name
+    allocations = current.allocations
+    blocks = sys.getallocatedblocks() if allocations else 0
+    start = perf_counter()
+    try:
+        return func(*args)
+    finally:
+        seconds = perf_counter() - start
+        if allocations:
+            blocks = sys.getallocatedblocks() - blocks
+        _local.query_id = previous
+        current.record(name, phase, label, seconds, blocks)
+
+
+def enable(new_recorder=None):
+    """
+    Start recording with `new_recorder` (a new :class:`Recorder` by
+    default), and return it.
+    """
+    global recorder
+    if new_recorder is None:
+        new_recorder = Recorder()
+    recorder = new_recorder
+    return new_recorder
+
+
+def disable():
+    """
+    Stop recording.
+    """
+    global recorder
+    recorder = None
+
+
+@contextmanager
+def instrument(new_recorder=None):
+    """
+    Context manager recording with `new_recorder` (a new
+    :class:`Recorder` by default) in its block, and giving it.
+    """
+    global recorder
+    previous = recorder
+    try:
+        yield enable(new_recorder)
+    finally:
+        recorder = previous
+
+
+class Histogram(object):
+    """
+    Counts of observed values by bucket (`buckets` are their upper
+    bounds), with their sum.
+    """
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float):
+        """
+        Returns the upper bound of the bucket holding the `q` quantile
+        (infinity for the last one), or None if nothing was observed.
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float('inf')
+
+    def cumulative(self) -> list:
+        """
+        Returns the (upper bound, cumulative count) pairs of the
+        buckets, ending with infinity.
+        """
+        pairs = []
+        seen = 0
+        for bound, count in zip(self.buckets + (float('inf'), ),
+                                self.counts):
+            seen += count
+            pairs.append((bound, seen))
+        return pairs
+
+    def as_dict(self) -> dict:
+        return {'count': self.count, 'sum': self.sum,
+                'p50': self.quantile(0.5), 'p99': self.quantile(0.99),
+                'buckets': self.cumulative()}
+
+
+class Recorder(object):
+    """Histograms of durations and allocated memory blocks, by query,
+    phase and label.
+
+    Allocations are counted with :func:`sys.getallocatedblocks` unless
+    `allocations` is False. The count is the change in the number of
+    blocks allocated by the whole process during the phase, so it is
+    only meaningful without other busy threads.
+
+    """
+
+    def __init__(self, allocations: bool=True,
+                 seconds_buckets: tuple=SECONDS_BUCKETS,
+                 blocks_buckets: tuple=BLOCKS_BUCKETS):
+        self.allocations = allocations
+        self.seconds_buckets = seconds_buckets
+        self.blocks_buckets = blocks_buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def record(self, query_id: str, phase: str, label, seconds: float,
+               blocks: int):
+        key = (query_id, phase, label or '')
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = (
+                    Histogram(self.seconds_buckets),
+                    Histogram(self.blocks_buckets))
+            series[0].observe(seconds)
+            if self.allocations:
+                series[1].observe(max(blocks, 0))
+
+    def reset(self):
+        with self._lock:
+            self._series = {}
+
+    def as_dict(self) -> dict:
+        """
+        Returns the statistics by query, phase and label (an empty
+        string for phases without a label).
+        """
+        result = {}
+        with self._lock:
+            series = list(self._series.items())
+        for (query, phase, label), (seconds, blocks) in series:
+            stats = {'seconds': seconds.as_dict()}
+            if self.allocations:
+                stats['blocks'] = blocks.as_dict()
+            result.setdefault(query, {}).setdefault(phase, {})[label] = stats
+        return result
+
+    def to_prometheus(self, prefix: str='esqb') -> str:
+        """
+        Returns the histograms in the Prometheus text exposition
+        format, as ``<prefix>_phase_seconds`` and
+        ``<prefix>_phase_allocated_blocks`` metrics.
+        """
+        with self._lock:
+            series = sorted(self._series.items())
+        lines = []
+        metrics = [('phase_seconds', 0,
+                    'Time spent in each phase of query rendering.')]
+        if self.allocations:
+            metrics.append(('phase_allocated_blocks', 1,
+                            'Memory blocks allocated by each phase of '
+                            'query rendering.'))
+        for metric, position, text in metrics:
+            name = '{}_{}'.format(prefix, metric)
+            lines.append('# HELP {} {}'.format(name, text))
+            lines.append('# TYPE {} histogram'.format(name))
+            for (query, phase, label), histograms in series:
+                histogram = histograms[position]
+                labels = 'query="{}",phase="{}",label="{}"'.format(
+                    _escape(query), _escape(phase), _escape(label))
+                for bound, count in histogram.cumulative():
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(
+                        name, labels, _format_bound(bound), count))
+                lines.append('{}_sum{{{}}} {}'.format(
+                    name, labels, histogram.sum))
+                lines.append('{}_count{{{}}} {}'.format(
+                    name, labels, histogram.count))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _format_bound(bound) -> str:
+    if bound == float('inf'):
+        return '+Inf'
+    return repr(float(bound))
@@ -0,0 +1,148 @@
+"""
+Support for the Elasticsearch ``_msearch`` API, which runs several
+searches in a single request. Its body is made of pairs of lines (in
+NDJSON): a header with the index and search options, and the query.
+"""
+from . import encoding
+
+__all__ = ['MultiSearch', 'SearchError', 'iter_msearch_body']
+
+
+def iter_msearch_body(items):
+    """
+    Generate the ``_msearch`` body for `items`, a sequence of
+    ``(header, body)`` pairs.
+
+    Headers are dicts (None for an empty header) and bodies are
+    either dicts or already encoded JSON bytes. The body is generated
+    as chunks of bytes, one per line.
+    """
+    last_header = header_line = None
+    for header, body in items:
+        if header is None:
+            header_line = b'{}\n'
+        elif header is not last_header:
+            # The same header is usually given for all the items
+            header_line = encoding.dumps(header) + b'\n'
+        last_header = header
+        yield header_line
+        if body.__class__ is not bytes:
+            body = encoding.dumps(body)
+        yield body + b'\n'
+
+
+class SearchError(Exception):
+    """
+    One of the searches of an ``_msearch`` request failed.
+    """
+
+    def __init__(self, status: int, error):
+        super().__init__(status, error)
+        self.status = status
+        self.error = error
+
+
+class MultiSearch(object):
+    """Collects searches of (possibly different) queries to run them in
+    as few ``_msearch`` requests as possible::
+
+        searches = MultiSearch()
+        searches.add(LastDocs(), {'ts': ..., 'te': ...})
+        searches.add(SimpleQuery(), {}, index='other')
+        for items, body in searches.iter_requests():
+            response = send(body)  # POST /_msearch
+            results = searches.dispatch(items, response)
+
+    Requests hold at most `max_batch` searches. :meth:`dispatch`
+    routes each response to the ``result()`` method of its query.
+    Searches which cannot be rendered, failed searches or requests,
+    and ``result()`` methods raising an exception do not affect the
+    other searches: the exception takes their place in the results.
+
+    Searches are sent to their own index, or else to the indices of
+    their query (see :meth:`esqb.query.BaseQuery.get_index`), or else
+    to `index`.
+
+    """
+
+    def __init__(self, max_batch: int=100, index=None):
+        self.max_batch = max_batch
+        self.index = index
+        self.items = []
+
+    def add(self, query, data: dict, index=None) -> int:
+        """
+        Add a search and return its position in the results.
+        """
+        if index is not None and not isinstance(index, str):
+            index = ','.join(index)
+        self.items.append((query, data, index))
+        return len(self.items) - 1
+
+    def __len__(self):
+        return len(self.items)
+
+    def iter_requests(self):
+        """Generate the items and the ``_msearch`` body of each request.
+
+        Searches which cannot be rendered are left out of the body,
+        and their item holds the exception as a fourth element. The
+        body is empty if none of them could be rendered: instead of
+        sending it, give ``{'responses': []}`` to :meth:`dispatch`.
+
+        """
+        for start in range(0, len(self.items), self.max_batch):
+            items = []
+            searches = []
+            for item in self.items[start:start + self.max_batch]:
+                query, data, index = item
+                try:
+                    if index is None:
+                        index = query.get_index(data)
+                    if index is None:
+                        index = self.index
+                    if index is not None and not isinstance(index, str):
+                        index = ','.join(index)
+                    searches.append((
+                        {'index': index} if index is not None else None,
+                        query.render_json(data)))
+                except Exception as e:
+                    item = (query, data, index, e)
+                items.append(item)
+            yield items, b''.join(iter_msearch_body(searches))
+
+    def dispatch(self, items, response) -> list:
+        """
+        Returns the results of `items` given the ``_msearch``
+        `response` of their request, or the exception its request
+        raised, which then takes the place of all its results.
+        """
+        from .executor import get_result
+        sent = sum(1 for item in items if len(item) == 3)
+        if isinstance(response, BaseException):
+            responses = [response] * sent
+        else:
+            responses = response.get('responses', [])
+            if len(responses) != sent:
+                responses = [ValueError('Expected {} responses, got {}'
+                                        .format(sent, len(responses)))] * sent
+        responses = iter(responses)
+        results = []
+        for item in items:
+            if len(item) > 3:
+                results.append(item[3])
+                continue
+            query = item[0]
+            item_response = next(responses)
+            if isinstance(item_response, BaseException):
+                results.append(item_response)
+                continue
+            if 'error' in item_response:
+                results.append(SearchError(
+                    item_response.get('status', 500), item_response['error']))
+                continue
+            try:
+                results.append(get_result(query, item_response))
+            except Exception as e:
+                results.append(e)
+        return results
@@ -0,0 +1,253 @@
+"""
+Rewrites of rendered queries which keep their results but are cheaper
+for Elasticsearch to run:
+
+* When scores are not used (``size`` is 0, or the query is sorted and
+  not by ``_score``), ``must`` clauses are moved to ``filter``, where
+  they are not scored and may be cached.
+* Ranges on the same field in a filter context are intersected into a
+  single range.
+* ``bool`` queries nested in a clause of the same kind are merged into
+  their parent, and ``bool`` queries with a single clause are replaced
+  by it, when that does not change scores.
+* Empty ``query``, ``aggs`` and ``sort`` parts are dropped.
+
+Queries enable it by setting ``optimize = True``. The rendered query
+is never modified in place: new dicts are built where needed.
+"""
+from . import timeutils
+
+__all__ = ['optimize', 'uses_scores']
+
+_OCCURS = ('must', 'filter', 'should', 'must_not')
+_LOWER = ('gt', 'gte')
+_UPPER = ('lt', 'lte')
+_OPTIONS = ('format', 'time_zone')
+
+
+def uses_scores(es_query: dict) -> bool:
+    """
+    Whether the scores of the hits matter for the response.
+    """
+    if es_query.get('min_score') is not None or \
+       es_query.get('track_scores') or es_query.get('rescore') or \
+       _mentions_scores(es_query.get('aggs')):
+        return True
+    if es_query.get('size', 10) == 0:
+        return False
+    sort = es_query.get('sort')
+    if not sort:
+        return True
+    if not isinstance(sort, list):
+        sort = [sort]
+    return any(field == '_score' or
+               isinstance(field, dict) and '_score' in field
+               for field in sort)
+
+
+def _mentions_scores(tree) -> bool:
+    """
+    Whether aggregations may use scores: ``top_hits`` sort hits by
+    score by default, and scripts may read ``_score``.
+    """
+    if isinstance(tree, dict):
+        return 'top_hits' in tree or \
+            any(_mentions_scores(value) for value in tree.values())
+    if isinstance(tree, list):
+        return any(_mentions_scores(value) for value in tree)
+    return isinstance(tree, str) and '_score' in tree
+
+
+def optimize(es_query: dict) -> dict:
+    """
+    Returns an optimized version of a rendered query (a dict with
+    ``query``, ``size``, ``aggs``, ``sort``...).
+    """
+    optimized = {k: v for k, v in es_query.items()
+                 if k not in ('query', 'aggs', 'sort') or v}
+    if optimized.get('query'):
+        optimized['query'] = optimize_query(
+            optimized['query'], scoring=uses_scores(es_query))
+    return optimized
+
+
+def optimize_query(query: dict, scoring: bool=True) -> dict:
+    """
+    Returns an optimized version of a query clause. Unless `scoring`
+    is set, its score is not used.
+    """
+    if not isinstance(query, dict) or list(query) != ['bool'] or \
+       not isinstance(query['bool'], dict):
+        return query
+    options = dict(query['bool'])
+    clauses = {}
+    for occur in _OCCURS:
+        if occur in options:
+            value = options.pop(occur)
+            clauses[occur] = value if isinstance(value, list) else [value]
+
+    if not scoring and clauses.get('must'):
+        clauses['filter'] = clauses.get('filter', []) + clauses.pop('must')
+
+    for occur, items in list(clauses.items()):
+        # Filter and must_not clauses are never scored
+        items = [optimize_query(item, scoring and occur in ('must', 'should'))
+                 for item in items]
+        if occur != 'should':
+            items = _merge_nested(items, occur)
+        if occur == 'filter':
+            items = _intersect_ranges(items)
+        clauses[occur] = items
+
+    # A bool with a single clause is the clause itself, unless the
+    # bool changes its score.
+    present = [(occur, items) for occur, items in clauses.items() if items]
+    if not options and len(present) == 1 and len(present[0][1]) == 1:
+        occur, (item, ) = present[0]
+        if occur == 'must' or occur == 'should' or \
+           occur == 'filter' and not scoring:
+            return item
+
+    bool_query = {}
+    for occur in _OCCURS:
+        if occur in clauses:
+            bool_query[occur] = clauses[occur]
+    bool_query.update(options)
+    return {'bool': bool_query}
+
+
+def _merge_nested(items: list, occur: str) -> list:
+    """Splice the clauses of the bool queries among the `occur` clauses
+    `items` when that does not change what matches, nor the scores.
+
+    Must clauses are scored here, since they are moved to the filter
+    clauses otherwise.
+
+    """
+    # The kinds of clauses of a nested bool which may be spliced
+    kinds = {'filter': {'filter', 'must'}, 'must': {'must'},
+             'must_not': {'should'}}[occur]
+    merged = []
+    for item in items:
+        nested = item.get('bool') if isinstance(item, dict) and \
+            list(item) == ['bool'] else None
+        # A bool without clauses matches everything, and only
+        # should clauses make a should clause required.
+        if not isinstance(nested, dict) or not nested or \
+           not set(nested) <= kinds or \
+           not all(_as_list(clauses) for clauses in nested.values()):
+            merged.append(item)
+            continue
+        for kind in _OCCURS:
+            if kind in nested:
+                merged.extend(_as_list(nested[kind]))
+    return merged
+
+
+def _as_list(value) -> list:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _range_of(item):
+    """
+    Returns the field and the bounds of a plain range clause, or None.
+    """
+    if not isinstance(item, dict) or list(item) != ['range']:
+        return None
+    ranges = item['range']
+    if not isinstance(ranges, dict) or len(ranges) != 1:
+        return None
+    field, bounds = next(iter(ranges.items()))
+    if not isinstance(bounds, dict) or \
+       not set(bounds) & set(_LOWER + _UPPER) or \
+       not set(bounds) <= set(_LOWER + _UPPER + _OPTIONS):
+        return None
+    return field, bounds
+
+
+def _comparable(value, options: dict):
+    """
+    Returns a value to compare bounds with, or None if it cannot be
+    compared (date math, a custom date format, for instance).
+    """
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return value
+    # Digits could be anything, and times without an offset are in
+    # the time zone of the range.
+    if not isinstance(value, str) or options or value.isdigit():
+        return None
+    try:
+        return timeutils.to_millis(value)
+    except (ValueError, TypeError):
+        return None
+
+
+def _tighter(bounds: dict, other: dict, operators: tuple, upper: bool,
+             options: dict):
+    """
+    Returns the tighter of the bounds among `operators` of two ranges,
+    as a dict, or None if they cannot be compared.
+    """
+    mine = [(op, bounds[op]) for op in operators if op in bounds]
+    theirs = [(op, other[op]) for op in operators if op in other]
+    if not mine or not theirs:
+        return dict(mine or theirs)
+    if len(mine) > 1 or len(theirs) > 1:
+        return None
+    (op, value), (other_op, other_value) = mine[0], theirs[0]
+    a, b = _comparable(value, options), _comparable(other_value, options)
+    if a is None or b is None or \
+       isinstance(value, str) != isinstance(other_value, str):
+        return None
+    if a == b:
+        # Exclusive bounds are tighter
+        return {op: value} if op in ('gt', 'lt') else \
+            {other_op: other_value}
+    if (a < b) == upper:
+        return {op: value}
+    return {other_op: other_value}
+
+
+def _intersect_ranges(items: list) -> list:
+    """
+    Intersect the ranges on the same field among filter clauses.
+    """
+    result = []
+    by_field = {}
+    for item in items:
+        found = _range_of(item)
+        if found is None:
+            result.append(item)
+            continue
+        field, bounds = found
+        position = by_field.get(field)
+        if position is not None:
+            merged = _intersect(result[position]['range'][field], bounds)
+            if merged is not None:
+                result[position] = {'range': {field: merged}}
+                continue
+        by_field[field] = len(result)
+        result.append(item)
+    return result
+
+
+def _intersect(bounds: dict, other: dict) -> dict:
+    """
+    Returns the intersection of two ranges, or None if it cannot be
+    computed.
+    """
+    options = {k: v for k, v in bounds.items() if k in _OPTIONS}
+    if options != {k: v for k, v in other.items() if k in _OPTIONS}:
+        return None
+    lower = _tighter(bounds, other, _LOWER, False, options)
+    upper = _tighter(bounds, other, _UPPER, True, options)
+    if lower is None or upper is None:
+        return None
+    merged = dict(lower)
+    merged.update(upper)
+    merged.update(options)
+    return merged
@@ -1,9 +1,111 @@
 import os
 import sys
+import threading
+import weakref
 from copy import deepcopy
 
+from . import encoding
+from . import instrumentation as _instrumentation
+from .batch import iter_rows as _iter_rows
+from .msearch import iter_msearch_body as _iter_msearch_body
+from .optimizer import optimize as _optimize
+from .template import Template
 from .variable import Variable
+from .utils import copy_tree as _copy_tree
+from .utils import freeze as _freeze
 from .utils import replace_variables as _replace_variables
+from .utils import split_path as _split_path
+
+# Templates compiled from class-level query parts, shared by every
+# instance of the class.
+_class_templates = weakref.WeakKeyDictionary()
+
+_QUERY_PARTS = ('query', 'size', 'aggs', 'sort')
+
+
+_unset = object()
+
+
+class _QueryPart(object):
+    """
+    Descriptor for the parts of a query (query, aggs, size, sort and
+    filters) implementing lazy copy-on-write.
+
+    Instances share the value defined in their class until they are
+    given their own value, or until they modify it in place. As the
+    caller may modify a part it accesses through an instance, a
+    private copy is made then, but the instance only owns the part
+    once the copy no longer equals the class value: until then, it
+    is still rendered from the templates of the class and served from
+    its render cache. Only the dicts and lists of the query parts are
+    copied, their variables are shared with the class, whereas filters
+    are deep-copied. Internally, BaseQuery uses :meth:`peek`, which
+    never copies anything.
+
+    Accessing the part through the class returns the class value, as
+    a plain class attribute would.
+
+    """
+
+    def __init__(self, name, default, doc=None, copy=_copy_tree):
+        self.name = name
+        self.attr = '_' + name
+        self.default = default
+        self.copy = copy
+        self.__doc__ = doc
+
+    def owns(self, instance) -> bool:
+        """
+        Whether `instance` has its own value for the part: assigned to
+        it, or accessed through it and modified since.
+        """
+        value = instance.__dict__.get(self.attr, _unset)
+        if value is _unset:
+            return False
+        if self.name in instance.__dict__.get('_read_parts', ()):
+            return value != self.default
+        return True
+
+    def peek(self, instance):
+        """
+        Returns the current value of the part, without copying it.
+        """
+        if self.owns(instance):
+            return instance.__dict__[self.attr]
+        return self.default
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self.default
+        if instance._frozen:
+            return deepcopy(self.peek(instance))
+        value = instance.__dict__.get(self.attr, _unset)
+        if value is _unset:
+            value = instance.__dict__[self.attr] = _instrumentation.timed(
+                instance, 'copy', self.name, self.copy, self.default)
+            instance.__dict__.setdefault('_read_parts', set()).add(
+                self.name)
+        return value
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.attr] = value
+        instance.__dict__.get('_read_parts', set()).discard(self.name)
+        instance.invalidate()
+
+
+def _walk_variables(templates: tuple, filters: tuple) -> tuple:
+    """
+    Returns the variables of the filters, those of the templates and
+    an index of all of them by name.
+    """
+    filter_vars = [
+        var
+        for _filter in filters
+        for var in _filter.get_variables().values()
+    ]
+    query_vars = [var for t in templates for var in t.variables]
+    by_name = {var.name: var for var in filter_vars + query_vars}
+    return filter_vars, query_vars, by_name
 
 
 class BaseQuery(object):
@@ -13,24 +115,90 @@ class BaseQuery(object):
     possible filters (optional or required) which may change the final
     query to be given to ES.
 
+    The query parts (``query``, ``aggs``, ``size`` and ``sort``) and
+    the ``filters`` defined in the class are shared by its instances
+    until an instance modifies them: see :class:`_QueryPart`.
+
+    Rendered queries may be memoized by setting ``render_cache`` to an
+    :class:`esqb.cache.LRUCache` in the query class (or to an
+    :class:`esqb.shared_cache.SharedCache`, shared by the processes of
+    a pre-fork server), and large terms aggregations may be paged
+    through by setting ``composite_size``.
+    Rendered queries are rewritten to run faster when ``optimize`` is
+    set, and checked against the ``limits`` of the query.
+
     """
 
+    render_cache = None
+
+    #: Page size with which :class:`esqb.executor.AsyncExecutor`
+    #: fetches the large ``terms`` aggregations of the query (those
+    #: with a larger ``size``) as ``composite`` aggregations (see
+    #: :mod:`esqb.composite`), or None to send the aggregations as
+    #: they are.
+    composite_size = None
+
+    #: The indices to search: a name, a list of names, an
+    #: :class:`esqb.routing.IndexPattern` or None to leave the choice
+    #: to the caller (see :meth:`get_index`).
+    index = None
+
+    #: Whether to rewrite rendered queries with
+    #: :func:`esqb.optimizer.optimize`, which moves clauses that need
+    #: no score to filter context, merges ranges and nested bools,
+    #: and drops empty parts.
+    optimize = False
+
+    #: The :class:`esqb.guardrails.Limits` of the cost of rendered
+    #: queries, which reject or rewrite the queries over them, or None.
+    limits = None
+
+    _frozen = False
+    _serializer_lock = threading.Lock()
+
+    query = _QueryPart('query', {}, 'The ``query`` part of the query.')
+    size = _QueryPart('size', 0, 'The ``size`` part of the query.')
+    aggs = _QueryPart('aggs', {}, 'The ``aggs`` part of the query.')
+    sort = _QueryPart('sort', [], 'The ``sort`` part of the query.')
+    filters = _QueryPart('filters', [], 'The list of filters of the query.',
+                         deepcopy)
+
+    _parts = {}
+
+    def __init_subclass__(cls, **kwargs):
+        """
+        Turn the query parts defined in subclasses into copy-on-write
+        descriptors.
+        """
+        super().__init_subclass__(**kwargs)
+        parts = dict(cls._parts)
+        for name in _QUERY_PARTS + ('filters', ):
+            value = cls.__dict__.get(name, _unset)
+            if value is _unset:
+                continue
+            if isinstance(value, _QueryPart):
+                parts[name] = value
+            elif hasattr(value, '__get__'):
+                # Properties and the like are left untouched.
+                parts.pop(name, None)
+            else:
+                base = BaseQuery.__dict__[name]
+                parts[name] = _QueryPart(name, value, base.__doc__,
+                                         base.copy)
+                setattr(cls, name, parts[name])
+        cls._parts = parts
+
     def __init__(self):
         """
-        We make this arcane magic here so that we can have several
-        instances of the same query and their base (class-based)
-        attributes will not change if modified (because there is a
-        copy in the instance).
+        Instances are cheap to create: they share the query parts of
+        their class until they modify them.
 
         The serializer field exists to cache a serializer once it has
         been generated.
 
         """
-        self._size = self.__class__.__dict__.get('size', 0)
-        self._aggs = deepcopy(self.__class__.__dict__.get('aggs', {}))
-        self._query = deepcopy(self.__class__.__dict__.get('query', {}))
-        self.filters = deepcopy(self.__class__.__dict__.get('filters', []))
-        self._sort = deepcopy(self.__class__.__dict__.get('sort', []))
+        self._templates = {}
+        self._variables = None
         self._serializer = None
 
     def get_id(self):
@@ -42,70 +210,344 @@ class BaseQuery(object):
         dot = name.rfind('.')
         return (name[:dot], fullpath)
 
-    @property
-    def aggs(self):
+    def _get_part(self, name):
         """
-        Returns the ``aggs`` property of the query.
+        Returns one of the query parts or the filters, without making
+        a private copy of them.
         """
-        return self._aggs
+        part = self._parts.get(name)
+        if part is None:
+            return getattr(self, name)
+        return part.peek(self)
 
-    @aggs.setter
-    def aggs(self, val: dict):
-        self._aggs = val
+    def invalidate(self):
+        """
+        Forget the compiled templates and variables of this query.
 
-    @property
-    def query(self):
+        Assigning any of the query parts or the filters does this
+        automatically, and parts modified in place are compiled again
+        anyway (see :meth:`get_template`).
         """
-        Returns the ``query`` property of the query.
+        self._templates = {}
+        self._variables = None
+
+    def get_es_query(self, data: dict, shared: bool=False) -> dict:
         """
-        return self._query
+        Return the final ES query that should be presented to ESService.
+
+        This function scans variables and fills their values with the
+        provided arg `data`.
 
-    @query.setter
-    def query(self, val: dict):
-        self._query = val
+        Query parts which no filter modifies are rendered from their
+        compiled template (see :meth:`get_template`), which shares its
+        constant subtrees with the query definition. By default, the
+        whole result is then walked and its dicts and lists copied
+        (see :func:`esqb.utils.copy_tree`), so that callers may modify
+        it. Only with `shared` set is that walk skipped: the result
+        must then be treated as read-only.
 
-    @property
-    def size(self):
+        When the query has a ``render_cache``, results are looked up
+        by the values of the variables the query uses.
         """
-        Returns the ``size`` property of the query.
+        if _instrumentation.recorder is not None:
+            return _instrumentation.timed(self, 'get_es_query', None,
+                                          self._get_es_query, data, shared)
+        return self._get_es_query(data, shared)
+
+    def _get_es_query(self, data: dict, shared: bool=False) -> dict:
+        cache = self.render_cache
+        es_query = None
+        if cache is not None:
+            key = self.get_cache_key(data)
+            if key is not None:
+                es_query = cache.get(key)
+                if es_query is None:
+                    es_query = self._render_plan(self._get_plan(data), data)
+                    cache.set(key, es_query)
+        if es_query is None:
+            es_query = self._render_plan(self._get_plan(data), data)
+        return es_query if shared else _copy_tree(es_query)
+
+    def get_index(self, data: dict):
         """
-        return self._size
+        Returns the indices to search with `data`: the ``index`` of the
+        query, or the indices its pattern selects for the time range.
+        """
+        index = self.index
+        if index is None or isinstance(index, (str, list, tuple)):
+            return index
+        return index.get_indices(data, self)
 
-    @size.setter
-    def size(self, val):
-        self._size = val
+    def estimate(self, data: dict):
+        """
+        Returns the :class:`esqb.guardrails.Estimate` of the cost of
+        the query rendered with `data` (after its rewriting by the
+        ``limits`` of the query, if any).
+        """
+        from .guardrails import estimate
+        es_query = self.get_es_query(data, shared=True)
+        if self.limits is not None:
+            return self.limits.estimate(es_query)
+        return estimate(es_query)
 
-    @property
-    def sort(self):
+    def get_cache_key(self, data: dict, exclude=()):
+        """
+        Returns a hashable key for the rendered query with `data`, or
+        None if the query cannot be cached.
+
+        Only the variables used by the query and its filters are part
+        of the key, so other values in `data` do not change it. Values
+        are normalized by their variable first (see
+        :class:`esqb.variable.TimeVariable`). The variables named in
+        `exclude` are left out of the key.
+
+        Instances with their own query parts (see :class:`_QueryPart`)
+        cannot be cached, as these may be modified in place. Filters
+        set on the instance are part of the key by their
+        :meth:`esqb.queryfilter.QueryFilter.cache_key`, so that
+        instances creating equal filters share their entries.
+        """
+        filters = self._get_part('filters')
+        own_filters = self._own_filters()
+        if own_filters is None:
+            return None
+        _, _, by_name = self._find_variables()
+        if not all(var.cacheable for var in by_name.values()) or \
+           not all(_filter.cacheable for _filter in filters):
+            return None
+        return (self.__class__, own_filters, tuple(
+            (name, _freeze(by_name[name].normalize(data[name])))
+            if name in data else
+            (name, _freeze(by_name[name].normalize(by_name[name].default)))
+            if by_name[name].volatile else (name, )
+            for name in sorted(by_name) if name not in exclude))
+
+    def _own_filters(self):
         """
-        Returns the ``sort`` property of the query.
+        Returns the cache keys of the filters of the instance if they
+        differ from those of its class, an empty tuple if they do not,
+        or None if any query part of the instance differs from its
+        class.
         """
-        return self._sort
+        for name in _QUERY_PARTS:
+            part = self._parts.get(name)
+            if part is None or part.owns(self):
+                return None
+        part = self._parts.get('filters')
+        if part is None:
+            filters = self.filters
+        else:
+            filters = part.peek(self)
+            default = part.default
+            if filters is default or (
+                    len(filters) == len(default) and
+                    all(a is b for a, b in zip(filters, default))):
+                return ()
+        return tuple(_filter.cache_key() for _filter in filters)
+
+    def get_template(self, query_field) -> Template:
+        """
+        Return the compiled template for one of the query parts
+        (query, aggs, size, sort).
 
-    @sort.setter
-    def sort(self, val):
-        self._sort = val
+        Templates for the parts defined in the class are compiled once
+        and shared by all its instances. Parts owned by an instance
+        (assigned to it, or modified in place, see :class:`_QueryPart`)
+        are compiled again on every call, unless the query is frozen.
+        """
+        source = self._get_part(query_field)
+        part = self._parts.get(query_field)
+        if part is not None and not part.owns(self):
+            class_templates = _class_templates.setdefault(self.__class__,
+                                                          {})
+            template = class_templates.get(query_field)
+            if template is None or template.source is not source:
+                template = class_templates[query_field] = Template(source)
+            return template
+        if not self._frozen:
+            return Template(source)
+        template = self._templates.get(query_field)
+        if template is None or template.source is not source:
+            template = self._templates[query_field] = Template(source)
+        return template
+
+    def _get_plan(self, data: dict) -> list:
+        """Returns, for each query part, its template if no filter is
+        going to modify it with the given data, or None otherwise.
+
+        Filters may mutate the query they receive, so parts to be
+        filtered are deep-copied and filtered before replacing their
+        variables. The others are rendered from their templates.
 
-    def get_es_query(self, data: dict) -> dict:
         """
-        Return the final ES query that should be presented to ESService.
+        if _instrumentation.recorder is not None:
+            return _instrumentation.timed(self, 'plan', None,
+                                          self._make_plan, data)
+        return self._make_plan(data)
+
+    def _make_plan(self, data: dict) -> list:
+        plan = []
+        for _q in _QUERY_PARTS:
+            filters = [_filter for _filter in self._get_part('filters')
+                       if _filter.query_field == _q]
+            if any(_filter.can_apply(data) for _filter in filters):
+                plan.append(None)
+                continue
+
+            template = self.get_template(_q)
+            for _filter in filters:
+                # None of these filters apply (so the template is not
+                # modified), but required ones must still complain
+                # about their missing variables.
+                _filter(template.source, data)
+            plan.append(template)
+        return plan
+
+    def _render_plan(self, plan: list, data: dict) -> dict:
+        if _instrumentation.recorder is not None:
+            return self._render_plan_timed(plan, data)
+        es_query = {
+            # Filters never modify what they are given in place, as
+            # they receive a private copy unless they promise so.
+            _q: _replace_variables(self._filtered(_q, data), data, share=True)
+            if template is None else template.render(data)
+            for _q, template in zip(_QUERY_PARTS, plan)}
+        if self.optimize:
+            es_query = _optimize(es_query)
+        if self.limits is not None:
+            es_query = self.limits.apply(es_query)
+        return es_query
+
+    def _render_plan_timed(self, plan: list, data: dict) -> dict:
+        """
+        Same as :meth:`_render_plan`, recording the time spent in each
+        phase (see :mod:`esqb.instrumentation`).
+        """
+        timed = _instrumentation.timed
+        es_query = {
+            _q: timed(self, 'replace_variables', _q, _replace_variables,
+                      self._filtered(_q, data), data, True)
+            if template is None else
+            timed(self, 'render', _q, template.render, data)
+            for _q, template in zip(_QUERY_PARTS, plan)}
+        if self.optimize:
+            es_query = timed(self, 'optimize', None, _optimize, es_query)
+        if self.limits is not None:
+            es_query = timed(self, 'limits', None, self.limits.apply,
+                             es_query)
+        return es_query
+
+    def _render_plan_json(self, plan: list, data: dict) -> bytes:
+        if self.optimize or self.limits is not None:
+            return encoding.dumps(self._render_plan(plan, data))
+        return b'{' + b','.join([
+            b'"' + _q.encode('ascii') + b'":' + (
+                encoding.dumps(_replace_variables(
+                    self._filtered(_q, data), data, share=True))
+                if template is None else template.render_json(data))
+            for _q, template in zip(_QUERY_PARTS, plan)]) + b'}'
+
+    def render_json(self, data: dict) -> bytes:
+        """
+        Return the final ES query, as :meth:`get_es_query` does, but
+        encoded as JSON.
 
-        This function scans variables and fills their values with the
-        provided arg `data`.
+        The constant parts of the query are encoded only once and the
+        values of the variables are spliced into them. Query parts
+        modified by filters are rendered and then encoded.
+        """
+        if _instrumentation.recorder is not None:
+            return _instrumentation.timed(
+                self, 'render_json', None,
+                lambda: self._render_plan_json(self._get_plan(data), data))
+        return self._render_plan_json(self._get_plan(data), data)
+
+    def render_many(self, rows, shared: bool=False) -> list:
+        """
+        Return the final ES queries for many sets of data, as
+        :meth:`get_es_query` would do one by one.
+
+        `rows` is either a sequence of data dicts or a mapping of
+        variable names to columns of values (see
+        :func:`esqb.batch.iter_rows`).
+        """
+        if shared:
+            return [self._render_plan(plan, data)
+                    for data, plan in self._iter_plans(rows)]
+        return [_copy_tree(self._render_plan(plan, data))
+                for data, plan in self._iter_plans(rows)]
+
+    def render_msearch(self, rows, header=None):
+        """
+        Generate an ``_msearch`` body (NDJSON, as chunks of bytes)
+        searching this query once for each set of data in `rows`.
+
+        `header` is the dict used as header line of every search, or
+        a callable returning the header for each data dict.
+        """
+        get_header = header if callable(header) else lambda data: header
+        return _iter_msearch_body(
+            (get_header(data), self._render_plan_json(plan, data))
+            for data, plan in self._iter_plans(rows))
+
+    def scan(self, transport, data: dict, index=None, **kwargs):
         """
-        _vars = {}
-        for var in self.find_all_variables():
-            _vars[var.name] = var
+        Generate all the hits of the query with `data`, paging through
+        them with ``search_after`` over a point in time, in the order
+        of its ``sort``. See :func:`esqb.scan.scan` for the options.
+        """
+        from .scan import scan
+        return scan(self, transport, data, index, **kwargs)
+
+    def _iter_plans(self, rows):
+        """Generates the data dicts in `rows` with their render plan.
+
+        As long as filters use the default ``can_apply``, which only
+        checks that their variables are given, plans are computed
+        once for all the rows with the same filter variables.
 
-        return {_q: _replace_variables(self._filtered(_q, data), data)
-                for _q in ('query', 'size', 'aggs', 'sort')}
+        """
+        from .queryfilter import QueryFilter
+        filters = list(self._get_part('filters'))
+        names = None
+        if all(_filter.__class__.can_apply is QueryFilter.can_apply
+               for _filter in filters):
+            names = sorted({var.name
+                            for _filter in filters
+                            for var in _filter.variables.values()})
+        plans = {}
+        for data in _iter_rows(rows):
+            if names is None:
+                yield data, self._get_plan(data)
+                continue
+            key = tuple(name in data for name in names)
+            plan = plans.get(key)
+            if plan is None:
+                plan = plans[key] = self._get_plan(data)
+            yield data, plan
 
     def _filtered(self, query_field, data: dict) -> dict:
-        """Filters the query parts with the defined query filters"""
-        d = deepcopy(getattr(self, query_field))
-        for _filter in self.filters:
-            if _filter.query_field == query_field:
-                d = _filter(d, data)
+        """Filters the query parts with the defined query filters
+
+        The query part is only deep-copied if some of its filters may
+        modify it in place (see :attr:`QueryFilter.mutates`).
+
+        """
+        filters = [_filter for _filter in self._get_part('filters')
+                   if _filter.query_field == query_field]
+        d = self._get_part(query_field)
+        if _instrumentation.recorder is not None:
+            timed = _instrumentation.timed
+            if any(_filter.mutates for _filter in filters):
+                d = timed(self, 'copy', query_field, deepcopy, d)
+            for _filter in filters:
+                d = timed(self, 'filter', _filter.__class__.__name__,
+                          _filter, d, data)
+            return d
+        if any(_filter.mutates for _filter in filters):
+            d = deepcopy(d)
+        for _filter in filters:
+            d = _filter(d, data)
         return d
 
     @property
@@ -116,7 +558,9 @@ class BaseQuery(object):
 
         """
         if not self._serializer:
-            self._serializer = self.get_serializer()(**kwargs)
+            with self._serializer_lock:
+                if not self._serializer:
+                    self._serializer = self.get_serializer()(**kwargs)
         return self._serializer
 
     @serializer.setter
@@ -138,16 +582,16 @@ class BaseQuery(object):
     def find_all_variables(self, docs=None, prev=None, include_filters=True):
         """
         Returns all variables found in the query and its filters
+
+        Unless explicit `docs` are given, the variables are taken
+        from the compiled templates and the result is cached until
+        the query parts or the filters change.
         """
         if docs is None:
-            prev = [] if not include_filters else [
-                var
-                for _filter in self.filters
-                for var in _filter.get_variables().values() if include_filters
-            ]
-            return self.find_all_variables(
-                [self.query, self.aggs, self.size, self.sort], prev
-            )
+            filter_vars, query_vars, _ = self._find_variables()
+            if include_filters:
+                return filter_vars + query_vars
+            return list(query_vars)
 
         if type(docs) is list:
             for elt in docs:
@@ -165,11 +609,38 @@ class BaseQuery(object):
                     self.find_all_variables(v, prev)
         return prev
 
+    def get_variable(self, name: str):
+        """
+        Returns the variable called `name` from the query or its
+        filters, or None if there is no such variable.
+        """
+        return self._find_variables()[2].get(name)
+
+    def _find_variables(self):
+        """Returns the variables of the filters, those of the query
+        parts and an index of all of them by name, walking them only
+        if they changed since the last call.
+
+        """
+        templates = tuple(self.get_template(_q)
+                          for _q in ('query', 'aggs', 'size', 'sort'))
+        filters = tuple(self._get_part('filters'))
+        cached = self._variables
+        if cached is None or cached[0] != (templates, filters):
+            cached = self._variables = (
+                (templates, filters),
+                _instrumentation.timed(self, 'find_variables', None,
+                                       _walk_variables, templates, filters))
+        return cached[1]
+
     def dotget(self, doc: dict, path: str):
         """
         Utility function to navigate paths using dot-notation.
+
+        For paths used over and over, see
+        :func:`esqb.columnar.compile_path`.
         """
-        for key in path.split('.'):
+        for key in _split_path(path):
             doc = doc[key]
         return doc
 
@@ -226,3 +697,53 @@ class BaseQuery(object):
                       DeprecationWarning)
         from .docs_builder import generate_view_docs
         return generate_view_docs(self, variables)
+
+
+BaseQuery._parts = {
+    name: BaseQuery.__dict__[name] for name in _QUERY_PARTS + ('filters', )
+}
+
+
+class FrozenQuery(BaseQuery):
+    """
+    An immutable query, which may be shared by several threads (e.g.
+    a single instance per query class in a threaded WSGI server).
+
+    Its parts, filters and variables are compiled when it is created.
+    Afterwards, its attributes cannot be assigned, its filters are a
+    tuple and accessing its parts returns private copies of them.
+    Rendering never modifies the query: filters which may modify the
+    query in place (see :attr:`QueryFilter.mutates`) receive a copy.
+
+    As serializer instances hold the validated data, the
+    ``serializer`` property returns a new one on every access.
+
+    """
+
+    _frozen = False
+    _caches = frozenset(('_templates', '_variables'))
+
+    def __init__(self):
+        BaseQuery.__init__(self)
+        self.filters = tuple(self._get_part('filters'))
+        self._frozen = True
+        self._find_variables()
+
+    def __setattr__(self, name, value):
+        if self._frozen and name not in self._caches:
+            raise AttributeError(
+                '{} is frozen, {} cannot be set'.format(self.name, name))
+        super().__setattr__(name, value)
+
+    def __delattr__(self, name):
+        if self._frozen:
+            raise AttributeError(
+                '{} is frozen, {} cannot be deleted'.format(self.name, name))
+        super().__delattr__(name)
+
+    @property
+    def serializer(self, **kwargs):
+        """
+        Returns a new serializer instance.
+        """
+        return self.get_serializer()(**kwargs)
@@ -1,4 +1,5 @@
 from .query import BaseQuery
+from .utils import freeze
 
 
 class QueryFilter(object):
@@ -15,15 +16,27 @@ class QueryFilter(object):
 
     The variable query_field is used to define which part of the query
     will be filtered (query, aggs, size, sort)
+
+    Filters whose result does not only depend on the values of their
+    variables must set `cacheable` to False, so that queries using them
+    are never served from a render cache.
+
+    By default, a filter is allowed to modify the query it receives in
+    place, so it receives a private deep copy of it. Filters which
+    never do so, and return new dicts and lists instead (sharing the
+    unchanged parts), should set `mutates` to False to avoid the copy.
     """
     query_field = 'query'
     variables = {}
     required = False
+    cacheable = True
+    mutates = True
 
     def __call__(self, query: BaseQuery, data={}):
         """
         A filter is callable this way. Receives the query (which can be
-        mutated) and the data from forms or otherwise.
+        mutated, unless `mutates` is False) and the data from forms or
+        otherwise.
         """
         if self.can_apply(data):
             return self.apply(query, data)
@@ -35,16 +48,43 @@ class QueryFilter(object):
             return query
 
     def get_variables(self):
-        if self.required:
-            return {
-                k: variable.copy()
-                for k, variable in self.variables.items()
-            }
-        else:
-            return {
-                k: variable.copy(required=False)
-                for k, variable in self.variables.items()
-            }
+        """
+        Returns copies of the filter variables, which are optional
+        unless the filter is required.
+
+        The copies are made once and reused until `variables` (even
+        modified in place) or `required` change.
+        """
+        key = (tuple(self.variables.items()), self.required)
+        cached = getattr(self, '_variables_cache', None)
+        if cached is None or cached[0] != key:
+            if self.required:
+                copies = {
+                    k: variable.copy()
+                    for k, variable in self.variables.items()
+                }
+            else:
+                copies = {
+                    k: variable.copy(required=False)
+                    for k, variable in self.variables.items()
+                }
+            cached = self._variables_cache = (key, copies)
+        return dict(cached[1])
+
+    def cache_key(self):
+        """
+        Returns a hashable key which is equal for the filters which
+        modify queries in the same way, to be part of the render cache
+        keys of the queries using them.
+
+        By default, it is made of the class of the filter and its
+        public attributes, with variables described by their
+        definition. Filters holding other objects should override it,
+        as those are compared by identity (or by their representation,
+        between processes).
+        """
+        return (self.__class__, freeze({
+            k: v for k, v in vars(self).items() if not k.startswith('_')}))
 
     def can_apply(self, data):
         """
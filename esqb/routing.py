@@ -0,0 +1,113 @@
+"""
+Routing of searches to the time-based indices (daily, monthly...)
+covering the time range of a query, instead of a wildcard matching all
+of them::
+
+    class LastDocs(BaseQuery):
+        index = IndexPattern('logs-{:%Y.%m.%d}', start='ts', end='te',
+                             fallback='logs-*')
+
+    LastDocs().get_index({'ts': '2024-03-14T22:00Z', 'te': '2024-03-15'})
+    # ['logs-2024.03.14', 'logs-2024.03.15']
+
+"""
+from datetime import timedelta
+
+from . import timeutils
+
+__all__ = ['IndexPattern']
+
+# How to move to the start of the next period, by unit
+_STEPS = {
+    'h': lambda value: value + timedelta(hours=1),
+    'd': lambda value: value + timedelta(days=1),
+    'w': lambda value: value + timedelta(weeks=1),
+    'M': lambda value: timeutils.add_months(value, 1),
+    'y': lambda value: timeutils.add_months(value, 12),
+}
+
+
+def _truncate(value, unit: str):
+    """
+    Returns the start of the period of `unit` containing `value`.
+    """
+    value = value.replace(minute=0, second=0, microsecond=0)
+    if unit == 'h':
+        return value
+    value = value.replace(hour=0)
+    if unit == 'w':
+        return value - timedelta(days=value.weekday())
+    if unit == 'M':
+        return value.replace(day=1)
+    if unit == 'y':
+        return value.replace(month=1, day=1)
+    return value
+
+
+class IndexPattern(object):
+    """The names of time-based indices, made by formatting `template`
+    with the start of every period (of `unit`: ``'h'``, ``'d'``,
+    ``'w'``, ``'M'`` or ``'y'``, in UTC) between the values of the
+    `start` and `end` variables.
+
+    `fallback` (usually a wildcard matching all the indices) is used
+    instead when the range cannot be resolved (a variable is missing,
+    or holds something else than a time) or when it would take more
+    than `max_indices` indices.
+
+    With `ignore_missing`, names end with a ``*`` so that searches do
+    not fail for periods without an index.
+
+    """
+
+    def __init__(self, template: str, start: str='ts', end: str='te',
+                 unit: str='d', fallback: str=None, max_indices: int=64,
+                 ignore_missing: bool=False):
+        if unit not in _STEPS:
+            raise ValueError('Unknown unit {!r}'.format(unit))
+        self.template = template
+        self.start = start
+        self.end = end
+        self.unit = unit
+        self.fallback = fallback
+        self.max_indices = max_indices
+        self.ignore_missing = ignore_missing
+
+    def _get_time(self, name: str, data: dict, query):
+        var = None if query is None else query.get_variable(name)
+        if var is None:
+            value = data[name]
+        else:
+            value = var.normalize(data.get(name, var.default))
+        return timeutils.to_millis(value)
+
+    def get_indices(self, data: dict, query=None) -> list:
+        """
+        Returns the names of the indices covering the time range with
+        `data`, or a list with the fallback. Values are normalized by
+        the variables of `query`, when given (see
+        :class:`esqb.variable.TimeVariable`).
+        """
+        try:
+            start = self._get_time(self.start, data, query)
+            end = self._get_time(self.end, data, query)
+        except (KeyError, ValueError):
+            return self._fallback('No time range')
+        step = _STEPS[self.unit]
+        current = _truncate(timeutils.to_datetime(start), self.unit)
+        last = timeutils.to_datetime(end)
+        names = []
+        suffix = '*' if self.ignore_missing else ''
+        while current <= last:
+            name = self.template.format(current) + suffix
+            if not names or names[-1] != name:
+                names.append(name)
+            if len(names) > self.max_indices:
+                return self._fallback('Too many indices')
+            current = step(current)
+        return names or self._fallback('Empty time range')
+
+    def _fallback(self, reason: str) -> list:
+        if self.fallback is None:
+            raise ValueError('{} for {}'.format(reason, self.template))
+        return [self.fallback]
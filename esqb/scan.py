@@ -0,0 +1,180 @@
+"""
+Iterate over all the hits of a query, however many, by paging through
+them with ``search_after`` over a point in time (PIT).
+
+The pages follow the ``sort`` of the query, with ``_shard_doc`` added
+as a tiebreaker, and only a few pages are held in memory at any time.
+"""
+import json
+import queue
+import threading
+from urllib.parse import quote
+
+from . import encoding
+from .transport import Transport, TransportError
+
+__all__ = ['scan']
+
+# Parts of the rendered query which make no sense when paging
+_IGNORED_PARTS = ('aggs', 'size', 'from', 'search_after', 'pit')
+
+
+def scan(query, transport, data: dict, index=None, page_size: int=1000,
+         keep_alive: str='1m', slices: int=None, max_workers: int=None):
+    """Generate the hits of `query` rendered with `data`, in the order
+    of its ``sort``.
+
+    `transport` is a :class:`esqb.transport.Transport` or the URL of
+    the node. The point in time is opened on `index` (a name, a list
+    of names or None for the indices of the query, or else all of
+    them) and closed when the generator is exhausted or closed.
+
+    With `slices`, the point in time is split in as many sliced
+    searches, run by a pool of up to `max_workers` threads; hits are
+    then generated as pages arrive, so the order is only kept within
+    each slice.
+
+    """
+    owned = isinstance(transport, str)
+    if owned:
+        transport = Transport(transport)
+    if index is None:
+        index = query.get_index(data)
+    body = _get_body(query, data, page_size)
+    # Elasticsearch may return a new id with each page: the latest one
+    # is kept here to be closed.
+    pit = {'id': _open_pit(transport, index, keep_alive)}
+    try:
+        if slices is None or slices < 2:
+            pages = _iter_pages(transport, body, pit, keep_alive)
+        else:
+            pages = _iter_sliced_pages(transport, body, pit, keep_alive,
+                                       slices, max_workers or slices)
+        for page in pages:
+            yield from page
+    finally:
+        try:
+            _request(transport, 'DELETE', '/_pit', {'id': pit['id']})
+        finally:
+            if owned:
+                transport.close()
+
+
+def _get_body(query, data: dict, page_size: int) -> dict:
+    """
+    Returns the search body of `query` for paging with `page_size`
+    hits, with a tiebreaker appended to its sort.
+    """
+    body = {k: v for k, v in query.get_es_query(data).items()
+            if k not in _IGNORED_PARTS and v is not None}
+    sort = body.get('sort') or []
+    if not isinstance(sort, list):
+        sort = [sort]
+    if not any(field == '_shard_doc' or
+               isinstance(field, dict) and '_shard_doc' in field
+               for field in sort):
+        sort = sort + [{'_shard_doc': 'asc'}]
+    body['sort'] = sort
+    body['size'] = page_size
+    body['track_total_hits'] = False
+    return body
+
+
+def _request(transport, method: str, path: str, body: dict) -> dict:
+    status, response = transport.request(method, path, encoding.dumps(body))
+    if status >= 400:
+        raise TransportError(status, response)
+    return json.loads(response)
+
+
+def _open_pit(transport, index, keep_alive: str) -> str:
+    if index is None:
+        index = '*'
+    elif not isinstance(index, str):
+        index = ','.join(index)
+    status, response = transport.request(
+        'POST', '/{}/_pit?keep_alive={}'.format(
+            quote(index, safe='*,'), quote(keep_alive)))
+    if status >= 400:
+        raise TransportError(status, response)
+    return json.loads(response)['id']
+
+
+def _iter_pages(transport, body: dict, pit: dict, keep_alive: str):
+    """
+    Generate the lists of hits of successive pages, updating the id
+    of the point in time in `pit` as it changes.
+    """
+    body = dict(body)
+    pit_id = pit['id']
+    while True:
+        body['pit'] = {'id': pit_id, 'keep_alive': keep_alive}
+        response = _request(transport, 'POST', '/_search', body)
+        pit_id = pit['id'] = response.get('pit_id', pit_id)
+        hits = response['hits']['hits']
+        if hits:
+            yield hits
+        if len(hits) < body['size']:
+            return
+        body['search_after'] = hits[-1]['sort']
+
+
+def _iter_sliced_pages(transport, body: dict, pit: dict, keep_alive: str,
+                       slices: int, max_workers: int):
+    """Generate the pages of every slice as worker threads fetch them.
+
+    Workers hand their pages over through a bounded queue, so they
+    stop fetching while the consumer lags behind.
+
+    """
+    pages = queue.Queue(maxsize=2 * max_workers)
+    stop = threading.Event()
+    pending = list(range(slices))
+    lock = threading.Lock()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def work():
+        try:
+            while not stop.is_set():
+                with lock:
+                    if not pending:
+                        break
+                    slice_id = pending.pop(0)
+                sliced = dict(body, slice={'id': slice_id, 'max': slices})
+                for page in _iter_pages(transport, sliced, pit,
+                                        keep_alive):
+                    if not put(page):
+                        return
+        except Exception as e:
+            put(e)
+        finally:
+            transport.close()
+            put(done)
+
+    workers = [threading.Thread(target=work, daemon=True)
+               for _ in range(min(max_workers, slices))]
+    for worker in workers:
+        worker.start()
+    try:
+        running = len(workers)
+        while running:
+            page = pages.get()
+            if page is done:
+                running -= 1
+            elif isinstance(page, Exception):
+                raise page
+            else:
+                yield page
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
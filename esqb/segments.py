@@ -0,0 +1,264 @@
+"""
+Caching of ``date_histogram`` aggregations by time segments.
+
+Dashboards refreshing a histogram over the last weeks ask again and
+again for the same past buckets, which cannot change anymore. A
+:class:`SegmentCache` splits the time range of the query in segments
+aligned to a multiple of the histogram interval (an hour or a day, for
+instance), serves the past segments from a cache and only queries
+Elasticsearch for the segments it does not have, grouping adjacent
+ones in a single search, and for the open end of the range::
+
+    segments = SegmentCache('by_time', start='ts', end='te')
+    response = segments.search(Histogram(), transport, data, 'logs-*')
+
+The time range is given by two variables of the query, holding epoch
+milliseconds, datetimes or ISO 8601 strings (see
+:mod:`esqb.timeutils`).
+"""
+import asyncio
+import json
+import time
+
+from . import encoding, timeutils
+from .cache import LRUCache
+from .transport import Transport, TransportError
+
+__all__ = ['SegmentCache']
+
+_HOUR = timeutils.UNITS['h']
+_DAY = timeutils.UNITS['d']
+
+
+class SegmentCache(object):
+    """Serves the buckets of the ``date_histogram`` aggregation `agg`
+    from a cache of time segments.
+
+    The time range goes from the value of the `start` variable to the
+    value of the `end` variable, which is included in the range if
+    `end_inclusive` is set (as ``lte`` does in a ``range`` query).
+
+    `segment` is the length of the segments (such as ``'1d'``); by
+    default it is an hour for intervals under an hour, a day for
+    intervals up to a day, and the interval itself otherwise.
+    Segments ending less than `settle` seconds ago are never cached,
+    to give late documents the time to be indexed.
+
+    Only the histogram is kept in the merged responses, along with the
+    total number of hits (counted from the buckets of cached
+    segments): queries should have a ``size`` of 0. Queries which are
+    not eligible (their histogram has no fixed interval, an
+    ``offset``, a ``time_zone`` or an ``order``, their time range is
+    not made of plain times or they cannot be cached) are sent as they
+    are.
+
+    """
+
+    def __init__(self, agg: str, start: str='ts', end: str='te',
+                 segment=None, cache=None, settle: float=0,
+                 end_inclusive: bool=True, timer=None):
+        self.agg = agg
+        self.start = start
+        self.end = end
+        self.segment = None if segment is None else \
+            timeutils.parse_interval(segment)
+        if segment is not None and not self.segment:
+            raise ValueError('Invalid segment length {!r}'.format(segment))
+        self.cache = LRUCache(4096) if cache is None else cache
+        self.settle = settle
+        self.end_inclusive = end_inclusive
+        self.timer = timer or time.time
+
+    def _get_segment(self, histogram: dict) -> int:
+        """
+        Returns the length of the segments for a histogram, or None if
+        it cannot be segmented.
+        """
+        if histogram.get('offset') or \
+           histogram.get('time_zone') not in (None, 'UTC', 'Z', '+00:00') \
+           or histogram.get('order') not in (None, {'_key': 'asc'}):
+            return None
+        interval = histogram.get('fixed_interval') or \
+            histogram.get('calendar_interval') or histogram.get('interval')
+        if timeutils.is_week(interval):
+            # Calendar weeks start on Mondays, not on segment bounds
+            return None
+        interval = timeutils.parse_interval(interval)
+        if not interval:
+            return None
+        segment = self.segment
+        if segment is None:
+            segment = _HOUR if interval <= _HOUR else \
+                _DAY if interval <= _DAY else interval
+        if segment % interval:
+            return None
+        return segment
+
+    def plan(self, query, data: dict):
+        """
+        Returns a :class:`SegmentPlan` for running `query` with `data`,
+        or None if it is not eligible.
+        """
+        es_query = query.get_es_query(data)
+        histogram = ((es_query.get('aggs') or {}).get(self.agg) or {}) \
+            .get('date_histogram')
+        if histogram is None:
+            return None
+        segment = self._get_segment(histogram)
+        key = query.get_cache_key(data, exclude=(self.start, self.end))
+        if segment is None or key is None:
+            return None
+        # Relative times (see TimeVariable) are resolved once for all
+        # the searches.
+        data = dict(data)
+        for name in (self.start, self.end):
+            var = query.get_variable(name)
+            if var is not None:
+                data[name] = var.normalize(data.get(name, var.default))
+        try:
+            start = timeutils.to_millis(data[self.start])
+            end = timeutils.to_millis(data[self.end])
+        except (KeyError, ValueError):
+            return None
+        if self.end_inclusive:
+            end += 1
+        return SegmentPlan(self, data, (key, self.agg, segment), start, end,
+                           segment)
+
+    def search(self, query, transport, data: dict, index=None) -> dict:
+        """
+        Run `query` with `data`, with a synchronous `transport` (or
+        the URL of the node), and return the response.
+
+        Unless an `index` is given, each search goes to the indices of
+        the query for its own time range (see
+        :meth:`esqb.query.BaseQuery.get_index`).
+        """
+        from .executor import search_path
+        owned = isinstance(transport, str)
+        if owned:
+            transport = Transport(transport)
+
+        def send(data):
+            status, response = transport.request(
+                'POST',
+                search_path(query.get_index(data) if index is None
+                            else index),
+                encoding.dumps(query.get_es_query(data, shared=True)))
+            if status >= 400:
+                raise TransportError(status, response)
+            return json.loads(response)
+
+        try:
+            plan = self.plan(query, data)
+            if plan is None:
+                return send(data)
+            return plan.finish([send(data) for data in plan.requests])
+        finally:
+            if owned:
+                transport.close()
+
+    async def search_async(self, executor, query, data: dict,
+                           index=None) -> dict:
+        """
+        Run `query` with `data` through an
+        :class:`esqb.executor.AsyncExecutor` and return the response.
+        The searches for missing segments are run concurrently.
+        """
+        plan = self.plan(query, data)
+        if plan is None:
+            return await executor.search(query, data, index)
+        return plan.finish(await asyncio.gather(
+            *(executor.search(query, data, index)
+              for data in plan.requests)))
+
+
+class SegmentPlan(object):
+    """The searches needed to answer a query from a segment cache.
+
+    :attr:`requests` holds the data for each search to run, and
+    :meth:`finish` takes their responses, in the same order, to cache
+    the closed segments they cover and return the merged response.
+
+    """
+
+    def __init__(self, owner: SegmentCache, data: dict, key, start: int,
+                 end: int, segment: int):
+        self.owner = owner
+        self.key = key
+        closed = (owner.timer() - owner.settle) * 1000
+        # Segments are [from, to) ranges with their buckets, or None
+        # when they must be searched.
+        self.segments = []
+        position = start
+        while position < end:
+            to = min(end, (position // segment + 1) * segment)
+            buckets = None
+            cacheable = to - position == segment and to <= closed
+            if cacheable:
+                buckets = owner.cache.get(key + (position, ))
+            self.segments.append((position, to, cacheable, buckets))
+            position = to
+
+        # Consecutive missing segments are searched at once
+        self.requests = []
+        ranges = []
+        for segment_from, segment_to, _, buckets in self.segments:
+            if buckets is not None:
+                continue
+            if ranges and ranges[-1][1] == segment_from:
+                ranges[-1][1] = segment_to
+            else:
+                ranges.append([segment_from, segment_to])
+        for range_start, range_end in ranges:
+            request = dict(data)
+            if range_start != start:
+                request[owner.start] = timeutils.format_millis(
+                    range_start, data[owner.start])
+            if range_end != end:
+                request[owner.end] = timeutils.format_millis(
+                    range_end - 1 if owner.end_inclusive else range_end,
+                    data[owner.end])
+            self.requests.append(request)
+
+    def finish(self, responses: list) -> dict:
+        """
+        Cache the closed segments found in `responses` and return the
+        merged response.
+        """
+        owner = self.owner
+        found = []
+        total = took = 0
+        timed_out = False
+        for response in responses:
+            found.extend(response['aggregations'][owner.agg]['buckets'])
+            hits_total = response.get('hits', {}).get('total', 0)
+            if isinstance(hits_total, dict):
+                hits_total = hits_total.get('value', 0)
+            total += hits_total
+            took += response.get('took', 0)
+            timed_out = timed_out or response.get('timed_out', False)
+
+        buckets = []
+        position = 0
+        for segment in self.segments:
+            segment_from, segment_to, cacheable, cached = segment
+            if cached is not None:
+                buckets.extend(cached)
+                total += sum(bucket['doc_count'] for bucket in cached)
+                continue
+            first = position
+            while position < len(found) and \
+                    found[position]['key'] < segment_to:
+                position += 1
+            segment_buckets = found[first:position]
+            if cacheable:
+                owner.cache.set(self.key + (segment_from, ), segment_buckets)
+            buckets.extend(segment_buckets)
+        return {
+            'took': took,
+            'timed_out': timed_out,
+            'hits': {'total': {'value': total, 'relation': 'eq'},
+                     'hits': []},
+            'aggregations': {owner.agg: {'buckets': buckets}},
+        }
@@ -0,0 +1,348 @@
+"""
+A cache shared by all the processes of a host, in a memory-mapped file.
+
+With a pre-fork server (gunicorn, uwsgi...), every worker has its own
+:class:`esqb.cache.LRUCache`, so entries are rendered and fetched
+once per worker. A :class:`SharedCache` lives in a file mapped in
+memory by all of them (preferably on a ``tmpfs`` such as ``/dev/shm``),
+so an entry stored by one worker is seen by all the others::
+
+    cache = SharedCache('/dev/shm/esqb-render', maxsize=4096, ttl=300)
+
+    class LastDocs(BaseQuery):
+        render_cache = cache
+
+It has the interface of :class:`esqb.cache.LRUCache`, and may also keep
+the results of :class:`esqb.fingerprint.SingleFlight` by fingerprint.
+
+The file is made of fixed-size slots, grouped in sets of `ways` slots:
+a key may only be stored in the set its hash designates, where the
+least recently used entry is evicted (expired and empty slots first).
+Values are pickled, and those larger than a slot are not cached.
+
+Reads take no lock: each slot has a sequence number, odd while the
+slot is being written, and a checksum of its value, so that readers
+detect the slots changing under them and treat them as misses. Writers
+lock the set they write to only (with :func:`fcntl.lockf` between
+processes), so writes to different sets do not wait for each other.
+Without :mod:`fcntl` (on Windows), writes are only serialized within a
+process.
+
+As values are unpickled, the file must belong to the current user and
+be only readable and writable by them, and symbolic links are not
+followed: otherwise, :class:`PermissionError` (or another
+:class:`OSError`) is raised.
+"""
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import stat
+import struct
+import threading
+import time
+import zlib
+
+from .cache import CacheInfo
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+__all__ = ['SharedCache']
+
+_MAGIC = b'ESQBSHC1'
+# magic, number of slots, slot size, ways
+_HEADER = struct.Struct('<8sIII')
+_HEADER_SIZE = 64
+# sequence, key digest, expiry time (0 for never), access time, length
+# of the value and its checksum
+_SLOT = struct.Struct('<Q16sddII')
+_ACCESSED = struct.calcsize('<Q16sd')
+_EMPTY_DIGEST = bytes(16)
+# Symbolic links are not followed (where supported)
+_O_NOFOLLOW = getattr(os, 'O_NOFOLLOW', 0)
+
+
+def _key_default(obj):
+    if isinstance(obj, type):
+        return '{}:{}'.format(obj.__module__, obj.__qualname__)
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=lambda item: json.dumps(
+            item, sort_keys=True, default=_key_default))
+    if isinstance(obj, bytes):
+        return obj.decode('latin-1')
+    return repr(obj)
+
+
+def _digest(key) -> bytes:
+    """
+    Returns the digest of a cache key, which is equal in all processes
+    for equal keys (as long as they are made of JSON-like values,
+    classes, sets, and objects with a stable representation).
+    """
+    if isinstance(key, str):
+        data = key.encode('utf-8')
+    elif isinstance(key, bytes):
+        data = key
+    else:
+        data = json.dumps(key, sort_keys=True, separators=(',', ':'),
+                          default=_key_default).encode('utf-8')
+    digest = hashlib.blake2b(data, digest_size=16).digest()
+    # An all-zero digest marks the empty slots
+    return digest if digest != _EMPTY_DIGEST else b'\1' + digest[1:]
+
+
+class SharedCache(object):
+    """A mapping with a bounded size shared by the processes which open
+    the same `path`, evicting the least recently used entries first.
+    Entries may optionally expire after `ttl` seconds.
+
+    The file is created with room for `maxsize` entries (rounded up to
+    a multiple of `ways`) of at most `slot_size` bytes each, pickled.
+    Processes opening an existing file must use the same sizes.
+
+    Hits, misses, evictions and expirations are counted by process,
+    and may be retrieved with :meth:`info`.
+
+    """
+
+    def __init__(self, path: str, maxsize: int=1024, slot_size: int=16384,
+                 ttl: float=None, ways: int=8, timer=None):
+        if maxsize < 1:
+            raise ValueError('maxsize must be a positive number')
+        if slot_size <= _SLOT.size:
+            raise ValueError('slot_size must be larger than {} bytes'.format(
+                _SLOT.size))
+        if ways < 1:
+            raise ValueError('ways must be a positive number')
+        self.path = path
+        self.ways = ways
+        self.sets = -(-maxsize // ways)
+        self.maxsize = self.sets * ways
+        self.slot_size = slot_size
+        self.ttl = ttl
+        self.timer = timer or time.time
+        self.hits = self.misses = self.evictions = self.expirations = 0
+        self._lock = threading.Lock()
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | _O_NOFOLLOW,
+                           0o600)
+        try:
+            self._check_owner()
+            self._mmap = self._map()
+        except BaseException:
+            os.close(self._fd)
+            raise
+
+    def _check_owner(self):
+        """
+        Refuse files which other users could have written, as their
+        values are unpickled.
+        """
+        info = os.fstat(self._fd)
+        if not stat.S_ISREG(info.st_mode) or info.st_mode & 0o077 or (
+                hasattr(os, 'geteuid') and info.st_uid != os.geteuid()):
+            raise PermissionError(
+                '{} must be a regular file only readable and writable by '
+                'its owner, the current user'.format(self.path))
+
+    def _map(self):
+        size = _HEADER_SIZE + self.maxsize * self.slot_size
+        header = _HEADER.pack(_MAGIC, self.maxsize, self.slot_size,
+                              self.ways)
+        self._lockf(True, 0, _HEADER_SIZE)
+        try:
+            current = os.fstat(self._fd).st_size
+            if current == 0:
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, header, 0)
+            elif os.pread(self._fd, _HEADER.size, 0) != header or \
+                    current != size:
+                raise ValueError(
+                    '{} is not a shared cache with {} slots of {} bytes in '
+                    'sets of {}'.format(self.path, self.maxsize,
+                                        self.slot_size, self.ways))
+        finally:
+            self._lockf(False, 0, _HEADER_SIZE)
+        return mmap.mmap(self._fd, size)
+
+    def _lockf(self, lock: bool, start: int, length: int):
+        if fcntl is not None:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX if lock else fcntl.LOCK_UN,
+                        length, start)
+
+    def _set_offset(self, digest: bytes) -> int:
+        index = int.from_bytes(digest[:8], 'little') % self.sets
+        return _HEADER_SIZE + index * self.ways * self.slot_size
+
+    def _read(self, offset: int, digest: bytes, now: float=None):
+        """
+        Returns the pickled value of the slot at `offset` if it holds
+        `digest`, or None. Unless `now` is None, the entry is marked as
+        used, and KeyError is raised if it has expired.
+        """
+        mm = self._mmap
+        sequence, slot_digest, expires, _, length, checksum = \
+            _SLOT.unpack_from(mm, offset)
+        if slot_digest != digest or sequence & 1 or \
+                length > self.slot_size - _SLOT.size:
+            return None
+        start = offset + _SLOT.size
+        data = mm[start:start + length]
+        if _SLOT.unpack_from(mm, offset)[0] != sequence or \
+                zlib.crc32(data) != checksum:
+            # Written meanwhile
+            return None
+        if now is None:
+            return data
+        if expires and expires <= now:
+            raise KeyError(digest)
+        # Not atomic, but only used to choose which entry to evict
+        struct.pack_into('<d', mm, offset + _ACCESSED, now)
+        return data
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored for `key`, or `default` if it is not
+        cached (or expired).
+        """
+        digest = _digest(key)
+        now = self.timer()
+        offset = self._set_offset(digest)
+        for _ in range(self.ways):
+            try:
+                data = self._read(offset, digest, now)
+            except KeyError:
+                self.expirations += 1
+                break
+            if data is not None:
+                try:
+                    value = pickle.loads(data)
+                except Exception:
+                    break
+                self.hits += 1
+                return value
+            offset += self.slot_size
+        self.misses += 1
+        return default
+
+    def set(self, key, value):
+        """
+        Stores `value` for `key`, evicting the least recently used
+        entry of its set if it is full. Values larger than a slot, or
+        which cannot be pickled, are not stored.
+        """
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+        if len(data) > self.slot_size - _SLOT.size:
+            return
+        digest = _digest(key)
+        now = self.timer()
+        expires = 0 if self.ttl is None else now + self.ttl
+        start = self._set_offset(digest)
+        with self._lock:
+            self._lockf(True, start, self.ways * self.slot_size)
+            try:
+                offset = self._choose(start, digest, now)
+                self._write(offset, digest, expires, now, data)
+            finally:
+                self._lockf(False, start, self.ways * self.slot_size)
+
+    def _choose(self, start: int, digest: bytes, now: float) -> int:
+        """
+        Returns the offset of the slot of the set at `start` in which
+        to store `digest`.
+        """
+        victim = None
+        victim_rank = None
+        offset = start
+        for _ in range(self.ways):
+            _, slot_digest, expires, accessed, _, _ = _SLOT.unpack_from(
+                self._mmap, offset)
+            if slot_digest == digest:
+                return offset
+            if slot_digest == _EMPTY_DIGEST:
+                rank = (0, 0)
+            elif expires and expires <= now:
+                rank = (1, accessed)
+            else:
+                rank = (2, accessed)
+            if victim_rank is None or rank < victim_rank:
+                victim, victim_rank = offset, rank
+            offset += self.slot_size
+        if victim_rank[0] == 2:
+            self.evictions += 1
+        return victim
+
+    def _write(self, offset: int, digest: bytes, expires: float,
+               accessed: float, data: bytes):
+        mm = self._mmap
+        sequence = _SLOT.unpack_from(mm, offset)[0]
+        # Odd while being written, so that readers skip the slot
+        struct.pack_into('<Q', mm, offset, sequence + 1)
+        start = offset + _SLOT.size
+        mm[start:start + len(data)] = data
+        _SLOT.pack_into(mm, offset, sequence + 1, digest, expires, accessed,
+                        len(data), zlib.crc32(data))
+        struct.pack_into('<Q', mm, offset, sequence + 2)
+
+    def clear(self):
+        """
+        Removes all the entries, for all the processes. Statistics are
+        kept.
+        """
+        with self._lock:
+            for index in range(self.sets):
+                start = _HEADER_SIZE + index * self.ways * self.slot_size
+                self._lockf(True, start, self.ways * self.slot_size)
+                try:
+                    for way in range(self.ways):
+                        self._write(start + way * self.slot_size,
+                                    _EMPTY_DIGEST, 0, 0, b'')
+                finally:
+                    self._lockf(False, start, self.ways * self.slot_size)
+
+    def _entries(self):
+        """
+        Yields the pickled values of the slots in use, expired or not.
+        """
+        mm = self._mmap
+        for index in range(self.maxsize):
+            offset = _HEADER_SIZE + index * self.slot_size
+            digest = _SLOT.unpack_from(mm, offset)[1]
+            if digest == _EMPTY_DIGEST:
+                continue
+            data = self._read(offset, digest)
+            if data is not None:
+                yield data
+
+    def info(self) -> CacheInfo:
+        """
+        Returns the cache statistics of this process, with the number
+        of entries of the shared file.
+        """
+        return CacheInfo(self.hits, self.misses, self.evictions,
+                         self.expirations, self.maxsize, len(self))
+
+    def values(self) -> list:
+        """
+        Returns a snapshot of the cached values, expired or not.
+        """
+        return [pickle.loads(data) for data in self._entries()]
+
+    def close(self):
+        """
+        Unmaps the file. The entries stay in it for the other
+        processes.
+        """
+        if self._fd is not None:
+            self._mmap.close()
+            os.close(self._fd)
+            self._fd = None
+
+    def __len__(self):
+        return sum(1 for _ in self._entries())
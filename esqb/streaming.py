@@ -0,0 +1,293 @@
+"""
+Incremental parsing of large responses: the items of the arrays found
+at some dot-notation paths (the paths ``BaseQuery.dotget`` uses, such
+as ``'hits.hits'`` or ``'aggregations.by_day.buckets'``) are decoded
+and generated one by one, while the rest of the response is skipped
+without being decoded. Only the item being generated and a chunk of
+the response are held in memory::
+
+    for hit in iter_items(response_file, 'hits.hits'):
+        ...
+
+Responses may be given as a file-like object, an iterable of chunks
+(bytes or str) or a whole bytes or str object.
+"""
+import codecs
+import json
+import re
+
+from . import encoding
+from .transport import Transport, TransportError
+from .utils import split_path
+
+__all__ = ['iter_items', 'iter_paths', 'stream_search']
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_SPECIAL = re.compile(r'["{}\[\]]')
+_STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+_SCALAR = re.compile(r'[^,}\]\s]*')
+
+_decoder = json.JSONDecoder()
+
+# Marks the end of a path in the tree of paths
+_END = object()
+
+
+class _Reader(object):
+    """
+    A buffer over the chunks of a JSON document, from which values are
+    read or skipped.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decode = codecs.getincrementaldecoder('utf-8')().decode
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, keep: int) -> bool:
+        """
+        Drop the buffer before `keep` and append the next chunk to it.
+        Returns False if there was nothing more to read.
+        """
+        if self.eof:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self.eof = True
+            text = self._decode(b'', True)
+        elif chunk.__class__ is str:
+            text = chunk
+        else:
+            text = self._decode(chunk)
+        self.buf = self.buf[keep:] + text
+        self.pos -= keep
+        return True
+
+    def peek(self) -> str:
+        """
+        Skip whitespace and return the next character, or an empty
+        string at the end of the document.
+        """
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill(self.pos):
+                return ''
+
+    def expect(self, chars: str) -> str:
+        c = self.peek()
+        if not c or c not in chars:
+            raise ValueError('Expecting one of {!r} at {!r}'.format(
+                chars, self.buf[self.pos:self.pos + 20]))
+        self.pos += 1
+        return c
+
+    def read_value(self):
+        """
+        Decode the next value.
+        """
+        if self.peek() not in '{["':
+            # Numbers and literals may go on in the next chunk (a
+            # prefix such as "12." decodes as 12): find where they end
+            # before decoding them.
+            start = self.skip_value(keep=True)
+            return json.loads(self.buf[start:self.pos])
+        try:
+            value, self.pos = _decoder.raw_decode(self.buf, self.pos)
+        except json.JSONDecodeError:
+            if self.eof:
+                raise
+            # The value may be cut by the end of the buffer: find
+            # where it ends before decoding it.
+            start = self.skip_value(keep=True)
+            return json.loads(self.buf[start:self.pos])
+        return value
+
+    def skip_value(self, keep: bool=False):
+        """
+        Move past the next value without decoding it. With `keep`, the
+        value is kept in the buffer, and its position is returned.
+        """
+        c = self.peek()
+        start = self.pos
+        if c not in '{["':
+            while True:
+                end = _SCALAR.match(self.buf, self.pos).end()
+                if end < len(self.buf) or not self.fill(self.pos):
+                    break
+            start = self.pos
+            self.pos = end
+            return start
+        depth = 0
+        in_string = False
+        i = self.pos
+        while True:
+            if in_string:
+                end = _STRING_BODY.match(self.buf, i).end()
+                if end < len(self.buf) and self.buf[end] == '"':
+                    in_string = False
+                    i = end + 1
+                    if not depth:
+                        break
+                    continue
+                i = end
+            else:
+                match = _SPECIAL.search(self.buf, i)
+                if match is not None:
+                    c = match.group()
+                    i = match.end()
+                    if c == '"':
+                        in_string = True
+                    elif c in '{[':
+                        depth += 1
+                    else:
+                        depth -= 1
+                        if not depth:
+                            break
+                    continue
+                i = len(self.buf)
+            # The value goes on in the next chunk
+            keep_from = start if keep else i
+            if not self.fill(keep_from):
+                raise ValueError('Unexpected end of JSON document')
+            i -= keep_from
+            start -= keep_from
+        self.pos = i
+        return start
+
+
+def _walk(reader: _Reader, tree: dict):
+    """
+    Generate the ``(path, item)`` pairs of the next value for the
+    paths in `tree`, relative to it, skipping the rest.
+    """
+    c = reader.peek()
+    if _END in tree:
+        if c == '[':
+            reader.pos += 1
+            if reader.peek() == ']':
+                reader.pos += 1
+                return
+            while True:
+                yield tree[_END], reader.read_value()
+                if reader.expect(',]') == ']':
+                    return
+        elif c == '{':
+            reader.pos += 1
+            if reader.peek() == '}':
+                reader.pos += 1
+                return
+            while True:
+                key = reader.read_value()
+                reader.expect(':')
+                yield tree[_END], (key, reader.read_value())
+                if reader.expect(',}') == '}':
+                    return
+        yield tree[_END], reader.read_value()
+    elif c == '{':
+        reader.pos += 1
+        if reader.peek() == '}':
+            reader.pos += 1
+            return
+        while True:
+            key = reader.read_value()
+            reader.expect(':')
+            if key in tree:
+                yield from _walk(reader, tree[key])
+            else:
+                reader.skip_value()
+            if reader.expect(',}') == '}':
+                return
+    elif c == '[':
+        reader.pos += 1
+        if reader.peek() == ']':
+            reader.pos += 1
+            return
+        index = 0
+        while True:
+            key = str(index)
+            if key in tree:
+                yield from _walk(reader, tree[key])
+            else:
+                reader.skip_value()
+            if reader.expect(',]') == ']':
+                return
+            index += 1
+    else:
+        reader.skip_value()
+
+
+def _iter_chunks(source, chunk_size: int):
+    if isinstance(source, (bytes, str)):
+        for i in range(0, len(source), chunk_size):
+            yield source[i:i + chunk_size]
+    elif hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        yield from source
+
+
+def iter_paths(source, paths, chunk_size: int=65536):
+    """Generate ``(path, item)`` pairs for the items found at each of
+    `paths` in the JSON document `source`, in the order in which they
+    appear.
+
+    Arrays at those paths are generated item by item, objects as
+    ``(key, value)`` pairs (keyed buckets, for instance) and other
+    values as they are. Paths which are not found generate nothing.
+
+    """
+    tree = {}
+    for path in paths:
+        node = tree
+        for key in split_path(path):
+            node = node.setdefault(key, {})
+        node[_END] = path
+    reader = _Reader(_iter_chunks(source, chunk_size))
+    if reader.peek():
+        yield from _walk(reader, tree)
+
+
+def iter_items(source, path: str, chunk_size: int=65536):
+    """
+    Generate the items found at `path` in the JSON document `source`
+    (see :func:`iter_paths`).
+    """
+    for _, item in iter_paths(source, [path], chunk_size):
+        yield item
+
+
+def stream_search(query, transport, data: dict, path: str='hits.hits',
+                  index=None, chunk_size: int=65536):
+    """
+    Run `query` with `data` and generate the items found at `path` in
+    the response as it is received.
+
+    `transport` is a :class:`esqb.transport.Transport` or the URL of
+    the node.
+    """
+    from .executor import search_path
+    owned = isinstance(transport, str)
+    if owned:
+        transport = Transport(transport)
+    status, response = transport.stream(
+        'POST',
+        search_path(query.get_index(data) if index is None else index),
+        encoding.dumps(query.get_es_query(data, shared=True)))
+    try:
+        if status >= 400:
+            raise TransportError(status, response.read())
+        yield from iter_items(response, path, chunk_size)
+    finally:
+        if owned or not response.isclosed():
+            # The connection cannot be reused unless the whole response
+            # was read.
+            response.close()
+            transport.close()
@@ -0,0 +1,168 @@
+from . import encoding
+from .variable import Variable
+
+__all__ = ['Template']
+
+
+class Template(object):
+    """A Template is a query part (usually ``BaseQuery.query``,
+    ``aggs``, ``size`` or ``sort``) compiled once so that it can be
+    rendered many times.
+
+    Compiling walks the part a single time, recording where every
+    Variable lives, either as a dictionary key or as a value. Subtrees
+    without variables are kept as they are and are shared by every
+    rendered result, so they are never copied nor walked again.
+    Rendering only rebuilds the dicts and lists leading to a Variable.
+
+    As constant subtrees are shared, the rendered results must be
+    treated as read-only. :meth:`esqb.query.BaseQuery.get_es_query`
+    copies them unless asked for a shared result.
+
+    Templates may also be rendered straight to JSON: the constant parts
+    are encoded once and the encoded values of the variables are
+    spliced between them.
+
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.variables = []
+        self._render = _compile(source, self.variables)
+        self._json_parts = None
+
+    @property
+    def is_constant(self):
+        """
+        Whether the template contains no variables at all.
+        """
+        return not self.variables
+
+    def render(self, data: dict):
+        """
+        Return the template with its variables filled with the
+        provided arg `data`.
+        """
+        if self._render is None:
+            return self.source
+        return self._render(data)
+
+    def render_json(self, data: dict) -> bytes:
+        """
+        Return the JSON encoding of ``render(data)``.
+        """
+        parts = self._json_parts
+        if parts is None:
+            parts = self._json_parts = _compile_json(self.source)
+        dumps = encoding.dumps
+        return b''.join([
+            part if part.__class__ is bytes else
+            encoding.encode_key(part[1].value_from_dict(data)) if part[0]
+            else dumps(part[1].value_from_dict(data))
+            for part in parts])
+
+
+def _compile(doc, found: list):
+    """Compile `doc` into a render function, or None if `doc` holds no
+    variables.
+
+    Variables are appended to `found` in the same order in which
+    BaseQuery.find_all_variables reports them.
+
+    """
+    if type(doc) is dict:
+        return _compile_dict(doc, found)
+    elif type(doc) is list:
+        return _compile_list(doc, found)
+    elif isinstance(doc, Variable):
+        found.append(doc)
+        return doc.value_from_dict
+    return None
+
+
+def _compile_dict(doc: dict, found: list):
+    entries = []
+    dynamic = False
+    for k, v in doc.items():
+        key_var = None
+        if isinstance(k, Variable):
+            found.append(k)
+            key_var = k
+        render = _compile(v, found)
+        if key_var is not None or render is not None:
+            dynamic = True
+        entries.append((k, key_var, v, render))
+
+    if not dynamic:
+        return None
+
+    entries = tuple(entries)
+
+    def render_dict(data):
+        d = {}
+        for k, key_var, v, render in entries:
+            if key_var is not None:
+                k = key_var.value_from_dict(data)
+            d[k] = v if render is None else render(data)
+        return d
+
+    return render_dict
+
+
+def _compile_list(doc: list, found: list):
+    entries = tuple((v, _compile(v, found)) for v in doc)
+    if all(render is None for _, render in entries):
+        return None
+
+    def render_list(data):
+        return [v if render is None else render(data)
+                for v, render in entries]
+
+    return render_list
+
+
+def _compile_json(doc) -> tuple:
+    """Compile `doc` into a sequence of JSON-encoded constant fragments
+    and ``(is_key, variable)`` slots.
+
+    """
+    parts = []
+    _compile_json_parts(doc, parts)
+    merged = []
+    for part in parts:
+        if part.__class__ is bytes and merged and \
+           merged[-1].__class__ is bytes:
+            merged[-1] += part
+        else:
+            merged.append(part)
+    return tuple(merged)
+
+
+def _compile_json_parts(doc, parts: list):
+    if isinstance(doc, Variable):
+        parts.append((False, doc))
+    elif type(doc) is dict and _has_variables(doc):
+        parts.append(b'{')
+        for i, (k, v) in enumerate(doc.items()):
+            if i:
+                parts.append(b',')
+            if isinstance(k, Variable):
+                parts.append((True, k))
+            else:
+                parts.append(encoding.encode_key(k))
+            parts.append(b':')
+            _compile_json_parts(v, parts)
+        parts.append(b'}')
+    elif type(doc) is list and _has_variables(doc):
+        parts.append(b'[')
+        for i, v in enumerate(doc):
+            if i:
+                parts.append(b',')
+            _compile_json_parts(v, parts)
+        parts.append(b']')
+    else:
+        parts.append(encoding.dumps(doc))
+
+
+def _has_variables(doc) -> bool:
+    return _compile(doc, []) is not None
@@ -0,0 +1,260 @@
+"""
+A local stand-in for an Elasticsearch node, to test and benchmark code
+sending queries without a real cluster::
+
+    with MockElasticsearch({'logs': [{'name': 'esqb'}]}) as es:
+        executor = AsyncExecutor(es.url, index='logs')
+        ...
+
+It understands just enough of the search API to return the stored
+documents as hits (ignoring the ``query``), supporting ``sort``,
+``from``, ``size``, ``search_after``, ``slice``, points in time and
+``_msearch``. Any other behaviour can be provided by giving a
+`handler`, which receives the method, the path and the decoded JSON
+body of each request and returns a status and a JSON-serializable
+response (or None to fall back to the default behaviour).
+"""
+import fnmatch
+import json
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+__all__ = ['MockElasticsearch']
+
+
+class MockElasticsearch(object):
+    """
+    An HTTP server emulating an Elasticsearch node, in a thread.
+    """
+
+    def __init__(self, documents: dict=None, handler=None,
+                 latency: float=0, host: str='127.0.0.1', port: int=0):
+        self.documents = documents or {}
+        self.handler = handler
+        self.latency = latency
+        self.requests = []
+        self.connections = 0
+        self.pits = {}
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _RequestHandler)
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def handle(self, method: str, path: str, body):
+        """
+        Returns the status and response for a request.
+        """
+        with self._lock:
+            self.requests.append((method, path, body))
+        if self.latency:
+            time.sleep(self.latency)
+        if self.handler is not None:
+            response = self.handler(method, path, body)
+            if response is not None:
+                return response
+
+        parts = [part for part in path.split('?')[0].split('/') if part]
+        index = parts[0] if len(parts) == 2 else None
+        if parts and parts[-1] == '_search' and len(parts) <= 2:
+            return self.search_or_error(index, body or {})
+        if parts and parts[-1] == '_msearch' and len(parts) <= 2:
+            return 200, self.msearch(index, body or [])
+        if parts and parts[-1] == '_pit':
+            if method == 'DELETE':
+                freed = self.pits.pop((body or {}).get('id'), None)
+                return 200, {'succeeded': True,
+                             'num_freed': 0 if freed is None else 1}
+            if index is not None:
+                status, response = self.search_or_error(index, {})
+                if status != 200:
+                    return status, response
+                with self._lock:
+                    pit_id = 'pit-{}'.format(len(self.requests))
+                    self.pits[pit_id] = index
+                return 200, {'id': pit_id}
+        return 404, {'error': 'Unsupported path {}'.format(path),
+                     'status': 404}
+
+    def search_or_error(self, index, body: dict):
+        """
+        Returns the status and response of a search, failing as
+        Elasticsearch does for missing indices.
+        """
+        pit = body.get('pit')
+        if pit is not None:
+            if index is not None or pit.get('id') not in self.pits:
+                return 404, {
+                    'error': {'type': 'search_context_missing_exception'},
+                    'status': 404}
+            index = self.pits[pit['id']]
+        for name in (index or '*').split(','):
+            if '*' not in name and name not in self.documents:
+                return 404, {
+                    'error': {'type': 'index_not_found_exception',
+                              'reason': 'no such index [{}]'.format(name)},
+                    'status': 404}
+        return 200, self.search(index, body)
+
+    def msearch(self, index, lines: list) -> dict:
+        """
+        Returns the responses of the searches in an ``_msearch`` body.
+        """
+        responses = []
+        for header, body in zip(lines[::2], lines[1::2]):
+            status, response = self.search_or_error(
+                header.get('index', index), body)
+            response['status'] = status
+            responses.append(response)
+        return {'took': 0, 'responses': responses}
+
+    def get_documents(self, index) -> list:
+        """
+        Returns the documents of the indices matching `index` (names
+        or patterns separated by commas, None for all) with their
+        index and id, as hits.
+        """
+        patterns = index.split(',') if index else ['*']
+        hits = []
+        for name in sorted(self.documents):
+            if any(fnmatch.fnmatchcase(name, p) for p in patterns):
+                hits.extend(
+                    {'_index': name, '_id': str(i), '_source': doc}
+                    for i, doc in enumerate(self.documents[name]))
+        return hits
+
+    def search(self, index, body: dict) -> dict:
+        """
+        Returns the documents of `index` as hits.
+        """
+        hits = self.get_documents(index)
+        if 'slice' in body:
+            hits = hits[body['slice']['id']::body['slice']['max']]
+        total = len(hits)
+        sort = _parse_sort(body.get('sort') or [])
+        if sort:
+            for position, hit in enumerate(hits):
+                hit['sort'] = [
+                    position if field == '_shard_doc' else
+                    hit['_source'].get(field)
+                    for field, _ in sort]
+            for i, (_, order) in reversed(list(enumerate(sort))):
+                hits.sort(key=lambda hit: _sort_key(hit['sort'][i], order),
+                          reverse=order == 'desc')
+        if 'search_after' in body:
+            after = body['search_after']
+            hits = [hit for hit in hits
+                    if _compare(hit['sort'], after, sort) > 0]
+        start = body.get('from', 0)
+        response = {
+            'took': 0,
+            'timed_out': False,
+            'hits': {
+                'total': {'value': total, 'relation': 'eq'},
+                'hits': hits[start:start + body.get('size', 10)],
+            },
+        }
+        if 'pit' in body:
+            response['pit_id'] = body['pit']['id']
+        return response
+
+
+def _parse_sort(sort: list) -> list:
+    """
+    Returns the fields and orders of a ``sort`` clause.
+    """
+    fields = []
+    for item in sort:
+        if isinstance(item, str):
+            fields.append((item, 'asc'))
+            continue
+        field, options = next(iter(item.items()))
+        if isinstance(options, dict):
+            options = options.get('order', 'asc')
+        fields.append((field, options))
+    return fields
+
+
+def _sort_key(value, order: str):
+    # Missing values are sorted last
+    missing = value is None
+    return (missing if order == 'asc' else not missing,
+            0 if missing else value)
+
+
+def _compare(values: list, after: list, sort: list) -> int:
+    for value, other, (_, order) in zip(values, after, sort):
+        a, b = _sort_key(value, order), _sort_key(other, order)
+        if a != b:
+            return (1 if a > b else -1) * (-1 if order == 'desc' else 1)
+    return 0
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients going away (e.g. after a timeout) are not an error
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Headers and body are written separately
+        self.connection.setsockopt(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server.mock._lock:
+            self.server.mock.connections += 1
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        content_type = self.headers.get('Content-Type', '')
+        if not raw:
+            body = None
+        elif 'ndjson' in content_type:
+            body = [json.loads(line) for line in raw.splitlines() if line]
+        else:
+            body = json.loads(raw)
+        status, response = self.server.mock.handle(
+            self.command, self.path, body)
+        payload = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
@@ -0,0 +1,216 @@
+"""
+Conversions between the time values given to queries (epoch
+milliseconds, ISO 8601 strings or datetimes) and epoch milliseconds,
+and parsing of Elasticsearch intervals.
+"""
+import re
+from datetime import datetime, timedelta, timezone
+
+__all__ = ['add_months', 'format_millis', 'is_date_math', 'is_week',
+           'parse_interval', 'resolve_date_math', 'round_millis',
+           'to_datetime', 'to_millis']
+
+# Fixed intervals in milliseconds, by unit
+UNITS = {
+    'ms': 1,
+    's': 1000,
+    'm': 60 * 1000,
+    'h': 60 * 60 * 1000,
+    'd': 24 * 60 * 60 * 1000,
+    'w': 7 * 24 * 60 * 60 * 1000,
+}
+
+# Calendar intervals which are fixed in UTC
+_CALENDAR = {
+    'second': 's', 'minute': 'm', 'hour': 'h', 'day': 'd', 'week': 'w',
+    '1s': 's', '1m': 'm', '1h': 'h', '1d': 'd', '1w': 'w',
+}
+
+# Weeks start on Mondays, and 1970-01-01 was a Thursday
+MONDAY = 4 * UNITS['d']
+
+_INTERVAL = re.compile(r'^(\d+)(ms|s|m|h|d|w)$')
+_PARTIAL_DATE = re.compile(r'^(\d{4})(?:-(\d{2}))?$')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Date math: an anchor (now, or a date followed by ||) and operations
+_DATE_MATH = re.compile(r'^(now|.+\|\|)((?:[+-]\d+[yMwdhHms]|/[yMwdhHms])*)$')
+_DATE_MATH_OP = re.compile(r'([+-]\d+|/)([yMwdhHms])')
+
+
+def parse_interval(interval) -> int:
+    """
+    Returns the length of an interval (such as ``'30m'``, ``'1d'`` or
+    ``'hour'``) in milliseconds, or None for intervals without a fixed
+    length (months, quarters and years).
+    """
+    if isinstance(interval, int):
+        return interval
+    if not isinstance(interval, str):
+        return None
+    unit = _CALENDAR.get(interval)
+    if unit is not None:
+        return UNITS[unit]
+    match = _INTERVAL.match(interval)
+    if match is None:
+        return None
+    return int(match.group(1)) * UNITS[match.group(2)]
+
+
+def is_week(interval) -> bool:
+    """
+    Whether an interval is made of calendar weeks (``'week'``,
+    ``'1w'``, ``'2w'``...), which start on Mondays rather than on
+    multiples of their length since the epoch.
+    """
+    return isinstance(interval, str) and (
+        interval == 'week' or interval.endswith('w') and
+        _INTERVAL.match(interval) is not None)
+
+
+def to_millis(value) -> int:
+    """Returns a time as epoch milliseconds.
+
+    `value` may be a number of milliseconds, a datetime (naive ones
+    are taken as UTC) or a string with either of them in ISO 8601
+    format, with or without a time. Raises ValueError for other
+    values, such as date math expressions.
+
+    """
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        delta = value - _EPOCH
+        return (delta.days * 86400 + delta.seconds) * 1000 + \
+            delta.microseconds // 1000
+    if isinstance(value, bool):
+        raise ValueError('Not a time: {!r}'.format(value))
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not isinstance(value, str):
+        raise ValueError('Not a time: {!r}'.format(value))
+    match = _PARTIAL_DATE.match(value)
+    if match is not None:
+        # Years and months, as Elasticsearch reads them
+        return to_millis(datetime(int(match.group(1)),
+                                  int(match.group(2) or 1), 1))
+    if value.isdigit():
+        return int(value)
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return to_millis(datetime.fromisoformat(value))
+
+
+def to_datetime(millis: int) -> datetime:
+    """
+    Returns epoch milliseconds as an aware datetime in UTC.
+    """
+    return _EPOCH + timedelta(milliseconds=millis)
+
+
+def format_millis(millis: int, like):
+    """
+    Returns epoch milliseconds in the same representation as `like`:
+    a number, a datetime or an ISO 8601 string in UTC.
+    """
+    if isinstance(like, datetime):
+        value = _EPOCH + timedelta(milliseconds=millis)
+        return value if like.tzinfo else value.replace(tzinfo=None)
+    if isinstance(like, (int, float)):
+        return millis
+    if isinstance(like, str) and like.isdigit() and len(like) > 4:
+        return str(millis)
+    value = _EPOCH + timedelta(milliseconds=millis)
+    return '{}.{:03d}Z'.format(
+        value.strftime('%Y-%m-%dT%H:%M:%S'), value.microsecond // 1000)
+
+
+def round_millis(millis: int, step: int, up: bool=False,
+                 offset: int=0) -> int:
+    """
+    Round epoch milliseconds down to a multiple of `step` (plus
+    `offset`, such as :data:`MONDAY` for weeks), or with `up`, to the
+    last millisecond before the next multiple (the end of the period,
+    as Elasticsearch rounds ``lte`` bounds).
+    """
+    millis -= (millis - offset) % step
+    return millis + step - 1 if up else millis
+
+
+def is_date_math(value) -> bool:
+    """
+    Whether `value` is an Elasticsearch date math expression, such as
+    ``'now-1h/m'`` or ``'2017-12-01||+1M'``.
+    """
+    return isinstance(value, str) and _DATE_MATH.match(value) is not None \
+        and (value.startswith('now') or '||' in value)
+
+
+def add_months(value: datetime, months: int) -> datetime:
+    """
+    Returns `value` moved by a number of months, keeping its day
+    unless the month is shorter.
+    """
+    month = value.month - 1 + months
+    year = value.year + month // 12
+    month = month % 12 + 1
+    day = value.day
+    while True:
+        try:
+            return value.replace(year=year, month=month, day=day)
+        except ValueError:
+            day -= 1
+
+
+def resolve_date_math(expression: str, now: int, up: bool=False) -> int:
+    """Returns the epoch milliseconds of a date math expression, in
+    UTC, taking `now` as the current time in epoch milliseconds.
+
+    Rounding goes to the start of the period, or to its last
+    millisecond with `up`. Raises ValueError for anything else than
+    date math.
+
+    """
+    match = _DATE_MATH.match(expression) if isinstance(
+        expression, str) else None
+    if match is None:
+        raise ValueError('Not a date math expression: {!r}'.format(
+            expression))
+    anchor = match.group(1)
+    millis = now if anchor == 'now' else to_millis(anchor[:-2])
+    value = _EPOCH + timedelta(milliseconds=millis)
+    for amount, unit in _DATE_MATH_OP.findall(match.group(2)):
+        if amount != '/':
+            amount = int(amount)
+            if unit == 'y':
+                value = add_months(value, 12 * amount)
+            elif unit == 'M':
+                value = add_months(value, amount)
+            else:
+                value += timedelta(
+                    milliseconds=amount * UNITS[unit.lower()])
+            continue
+        start = value
+        if unit in 'yMwd':
+            start = start.replace(hour=0, minute=0, second=0, microsecond=0)
+            if unit == 'y':
+                start = start.replace(month=1, day=1)
+            elif unit == 'M':
+                start = start.replace(day=1)
+            elif unit == 'w':
+                start -= timedelta(days=start.weekday())
+        else:
+            step = UNITS[unit.lower()]
+            start = _EPOCH + timedelta(milliseconds=round_millis(
+                to_millis(start), step))
+        if not up:
+            value = start
+        elif unit in 'yM':
+            value = add_months(start, 12 if unit == 'y' else 1) - \
+                timedelta(milliseconds=1)
+        else:
+            value = start + timedelta(milliseconds=(
+                UNITS['w'] if unit == 'w' else UNITS['d'] if unit == 'd'
+                else UNITS[unit.lower()]) - 1)
+    return to_millis(value)
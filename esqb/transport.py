@@ -0,0 +1,229 @@
+"""
+Minimal HTTP/1.1 clients to send rendered queries to Elasticsearch,
+keeping connections alive between requests.
+"""
+import asyncio
+import collections
+import http.client
+import ssl as _ssl
+import threading
+from urllib.parse import urlsplit
+
+__all__ = ['AsyncTransport', 'Transport', 'TransportError']
+
+
+class TransportError(Exception):
+    """
+    Elasticsearch replied with an error status.
+    """
+
+    def __init__(self, status: int, body: bytes):
+        super().__init__(status, body)
+        self.status = status
+        self.body = body
+
+    def __str__(self):
+        return 'HTTP {}: {}'.format(
+            self.status, self.body[:200].decode('utf-8', 'replace'))
+
+
+class Transport(object):
+    """Sends requests to an Elasticsearch node, keeping a connection
+    alive for each thread using it.
+
+    Requests fail with :class:`socket.timeout` if the node does not
+    answer in `timeout` seconds.
+
+    """
+
+    def __init__(self, url: str='http://localhost:9200', timeout: float=10):
+        parts = urlsplit(url)
+        self.host = parts.hostname or 'localhost'
+        self.https = parts.scheme == 'https'
+        self.port = parts.port or (443 if self.https else 80)
+        self.prefix = parts.path.rstrip('/')
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def request(self, method: str, path: str, body: bytes=None,
+                content_type: str='application/json'):
+        """
+        Send a request and return the response status and body.
+        """
+        response = self._send(method, path, body, content_type)
+        return response.status, response.read()
+
+    def stream(self, method: str, path: str, body: bytes=None,
+               content_type: str='application/json'):
+        """
+        Send a request and return the response status and the response
+        itself, a file-like object to read the body from.
+
+        The response must be read to its end before sending another
+        request from the same thread; otherwise, close it and call
+        :meth:`close`.
+        """
+        response = self._send(method, path, body, content_type)
+        return response.status, response
+
+    def _send(self, method, path, body, content_type):
+        connection = getattr(self._local, 'connection', None)
+        reused = connection is not None
+        if not reused:
+            connection = self._local.connection = self._connect()
+        headers = {'Content-Type': content_type}
+        try:
+            connection.request(method, self.prefix + path, body, headers)
+            response = connection.getresponse()
+        except (ConnectionError, http.client.HTTPException):
+            connection.close()
+            if not reused:
+                self._local.connection = None
+                raise
+            # The server closed an idle connection; retry once with a
+            # new one.
+            connection = self._local.connection = self._connect()
+            connection.request(method, self.prefix + path, body, headers)
+            response = connection.getresponse()
+        return response
+
+    def _connect(self):
+        if self.https:
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(
+            self.host, self.port, timeout=self.timeout)
+
+    def close(self):
+        """
+        Close the connection of the current thread.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
+
+
+class AsyncTransport(object):
+    """Sends requests to an Elasticsearch node over a pool of keep-alive
+    connections, with asyncio.
+
+    At most `max_connections` requests are in flight at the same time;
+    other requests wait for a free connection. Once sent, requests
+    fail with :class:`asyncio.TimeoutError` if they take more than
+    `timeout` seconds.
+
+    """
+
+    def __init__(self, url: str='http://localhost:9200',
+                 max_connections: int=10, timeout: float=10):
+        parts = urlsplit(url)
+        self.host = parts.hostname or 'localhost'
+        self.ssl = _ssl.create_default_context() \
+            if parts.scheme == 'https' else None
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.prefix = parts.path.rstrip('/')
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._idle = collections.deque()
+        self._semaphore = None
+
+    async def request(self, method: str, path: str, body: bytes=None,
+                      content_type: str='application/json'):
+        """
+        Send a request and return the response status and body.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        async with self._semaphore:
+            return await asyncio.wait_for(
+                self._request(method, path, body, content_type),
+                self.timeout)
+
+    async def _request(self, method, path, body, content_type):
+        reused = bool(self._idle)
+        connection = self._idle.pop() if reused else \
+            await asyncio.open_connection(self.host, self.port, ssl=self.ssl)
+        try:
+            status, response, keep_alive = await self._send(
+                connection, method, path, body, content_type)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            connection[1].close()
+            if not reused:
+                raise
+            # The server closed an idle connection; retry once with a
+            # new one.
+            connection = await asyncio.open_connection(
+                self.host, self.port, ssl=self.ssl)
+            try:
+                status, response, keep_alive = await self._send(
+                    connection, method, path, body, content_type)
+            except BaseException:
+                connection[1].close()
+                raise
+        except BaseException:
+            connection[1].close()
+            raise
+        if keep_alive:
+            self._idle.append(connection)
+        else:
+            connection[1].close()
+        return status, response
+
+    async def _send(self, connection, method, path, body, content_type):
+        reader, writer = connection
+        body = body or b''
+        writer.write(
+            '{} {}{} HTTP/1.1\r\nHost: {}:{}\r\n'
+            'Content-Type: {}\r\nContent-Length: {}\r\n\r\n'.format(
+                method, self.prefix, path, self.host, self.port,
+                content_type, len(body)).encode('latin-1') + body)
+        await writer.drain()
+        return await read_response(reader)
+
+    async def close(self):
+        """
+        Close the idle connections.
+        """
+        while self._idle:
+            _, writer = self._idle.pop()
+            writer.close()
+
+
+async def read_response(reader):
+    """
+    Read an HTTP/1.1 response and return its status, its body and
+    whether the connection may be reused.
+    """
+    status_line = await reader.readuntil(b'\r\n')
+    status = int(status_line.split()[1])
+    headers = {}
+    while True:
+        line = await reader.readuntil(b'\r\n')
+        if line == b'\r\n':
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readuntil(b'\r\n')).split(b';')[0], 16)
+            if size == 0:
+                while await reader.readuntil(b'\r\n') != b'\r\n':
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b''.join(chunks)
+        keep_alive = True
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+        keep_alive = True
+    else:
+        body = await reader.read()
+        keep_alive = False
+
+    if headers.get('connection', '').lower() == 'close':
+        keep_alive = False
+    return status, body, keep_alive
@@ -1,30 +1,140 @@
+from functools import lru_cache
+from types import FunctionType
+
 from .variable import Variable
 
 
-def replace_variables(d, data: dict):
+def replace_variables(d, data: dict, share: bool=False):
     """
     Replace variables in `d` (usually BaseQuery.query)
     with data from the `data` dict.
+
+    By default every dict and list in `d` is copied. When `share` is
+    set, only the dicts and lists leading to a Variable are rebuilt
+    (copy-on-write) and subtrees without variables are returned by
+    reference, so the result must be treated as read-only.
     """
+    if share:
+        return _replace_shared(d, data)
     if type(d) is dict:
-        d = d.copy()
+        replaced = {}
         for k, v in d.items():
             if isinstance(k, Variable):
-                d[k.value_from_dict(data)] = d[k]
-                del d[k]
                 k = k.value_from_dict(data)
+            replaced[k] = replace_variables(v, data)
+        return replaced
+    elif type(d) is list:
+        return [replace_variables(v, data) for v in d]
+    elif isinstance(d, Variable):
+        return d.value_from_dict(data)
+    return d
+
+
+def _replace_shared(d, data: dict):
+    """
+    Copy-on-write version of replace_variables: `d` itself is returned
+    when it does not contain any variable.
 
-            if isinstance(v, Variable):
-                d[k] = v.value_from_dict(data)
+    Unlike :class:`esqb.template.Template`, which records where the
+    variables are once, every subtree is still walked, as `d` may have
+    changed since the last call (filters build new queries): this mode
+    mostly saves allocations.
+    """
+    cls = d.__class__
+    if cls is dict:
+        replaced = None
+        for k, v in d.items():
+            new_k = k
+            if k.__class__ is not str and isinstance(k, Variable):
+                new_k = k.value_from_dict(data)
+            # Inlined rather than recursing into the scalars, which are
+            # the bulk of a query
+            v_cls = v.__class__
+            if v_cls is dict or v_cls is list:
+                new_v = _replace_shared(v, data)
+            elif isinstance(v, Variable):
+                new_v = v.value_from_dict(data)
             else:
-                d[k] = replace_variables(v, data)
-    elif type(d) is list:
-        d = d[:]
+                new_v = v
+            if replaced is None:
+                if new_k is k and new_v is v:
+                    continue
+                # First change: copy the items before it
+                replaced = {}
+                for prev_k, prev_v in d.items():
+                    if prev_k is k:
+                        break
+                    replaced[prev_k] = prev_v
+            replaced[new_k] = new_v
+        return d if replaced is None else replaced
+    elif cls is list:
+        replaced = None
         for i, v in enumerate(d):
-            if isinstance(v, Variable):
-                d[i] = v.value_from_dict(data)
+            v_cls = v.__class__
+            if v_cls is dict or v_cls is list:
+                new_v = _replace_shared(v, data)
+            elif isinstance(v, Variable):
+                new_v = v.value_from_dict(data)
             else:
-                d[i] = replace_variables(v, data)
+                new_v = v
+            if replaced is None:
+                if new_v is v:
+                    continue
+                replaced = d[:i]
+            replaced.append(new_v)
+        return d if replaced is None else replaced
     elif isinstance(d, Variable):
-        d = d.value_from_dict(data)
+        return d.value_from_dict(data)
+    return d
+
+
+def copy_tree(d):
+    """
+    Copy the dicts and lists in `d` (usually a rendered query).
+
+    This is much cheaper than a deepcopy for JSON-like documents.
+    """
+    if type(d) is dict:
+        return {k: copy_tree(v) for k, v in d.items()}
+    elif type(d) is list:
+        return [copy_tree(v) for v in d]
     return d
+
+
+def freeze(value):
+    """
+    Returns a hashable value which is equal for equal JSON-like
+    values, to be used as (part of) a cache key.
+
+    Variables, and functions which do not close over other values,
+    are described by their definition rather than their identity, as
+    they are usually created again with each filter.
+    """
+    if isinstance(value, Variable):
+        return (type(value), freeze({
+            k: v for k, v in vars(value).items() if not k.startswith('_')}))
+    elif isinstance(value, FunctionType) and value.__closure__ is None:
+        return (FunctionType, value.__module__, value.__qualname__,
+                freeze(value.__defaults__))
+    elif isinstance(value, dict):
+        return (dict, tuple(sorted(
+            ((freeze(k), freeze(v)) for k, v in value.items()),
+            key=repr)))
+    elif isinstance(value, (list, tuple)):
+        return (list, tuple(freeze(v) for v in value))
+    elif isinstance(value, (set, frozenset)):
+        return (set, frozenset(freeze(v) for v in value))
+    try:
+        hash(value)
+    except TypeError:
+        return (type(value), repr(value))
+    return (type(value), value)
+
+
+@lru_cache(maxsize=1024)
+def split_path(path: str) -> tuple:
+    """
+    Split a dot-notation path into its keys, remembering the most
+    recently used paths.
+    """
+    return tuple(path.split('.'))
@@ -1,4 +1,8 @@
-__all__ = ['Variable']
+import time
+
+from . import instrumentation, timeutils
+
+__all__ = ['TimeVariable', 'Variable']
 
 
 class Variable(object):
@@ -11,6 +15,8 @@ class Variable(object):
     You can define a method (builder) that builds a part of the query
     if you need more than a simple replacement.
     For example, build a date_histogram or a histogram depending on the value.
+    If the builder is not deterministic, set `cacheable` to False so that
+    queries using the variable are never served from a render cache.
     """
 
     def __init__(
@@ -22,7 +28,8 @@ class Variable(object):
             help_text: str='Unknown variable',
             serializer_class=None,
             serializer_options=None,
-            builder=None):
+            builder=None,
+            cacheable: bool=True):
         self.name = name
         self.default = default
         self.type = type
@@ -31,17 +38,36 @@ class Variable(object):
         self.serializer_options = serializer_options or {}
         self.serializer_class = serializer_class
         self.builder = builder
+        self.cacheable = cacheable
 
     def copy(self, **kwargs):
         """
         Copy the variable, optionally changing some of the values.
 
         Implementation nodte: currently it uses the __dict__ of the
-        object for the copy.
+        object for the copy (but its private attributes), so subclasses
+        must store their arguments under their own name.
         """
-        d = self.__dict__.copy()
+        d = {k: v for k, v in self.__dict__.items()
+             if not k.startswith('_')}
         d.update(kwargs)
-        return Variable(**d)
+        return type(self)(**d)
+
+    def normalize(self, value):
+        """
+        Returns the value the variable actually uses for `value`.
+        Subclasses may override it to map many values to the same one,
+        which also makes queries using them share cached renders.
+        """
+        return value
+
+    @property
+    def volatile(self) -> bool:
+        """
+        Whether the default value depends on something else than the
+        data, such as the current time.
+        """
+        return False
 
     def value_from_dict(self, d: dict=None):
         """
@@ -59,7 +85,9 @@ class Variable(object):
         else:
             if self.builder is None:
                 return d.get(self.name, self.default)
-            return self.builder(d.get(self.name, self.default))
+            return instrumentation.timed(
+                None, 'builder', self.name, self.builder,
+                d.get(self.name, self.default))
 
     def __str__(self):
         """
@@ -84,3 +112,103 @@ class Variable(object):
             type=self.type.__name__,
             default=repr(self.default),
             req="(R)" if self.required else "(O)")
+
+
+class TimeVariable(Variable):
+    """A Variable holding a time, rounded to a granularity so that
+    requests sent within the same period are identical and may be
+    served from caches (the render cache of the query, the segment
+    cache or the Elasticsearch request cache)::
+
+        ts = TimeVariable('ts', 'now-1h', round_to='1m')
+        te = TimeVariable('te', 'now', round_to='1m', rounding='up')
+
+    Times given as epoch milliseconds, ISO 8601 strings or datetimes
+    are rounded down to a multiple of `round_to`, or up to the end of
+    the period with ``rounding='up'`` (for ``lte`` bounds), and keep
+    their representation. Weeks (``'1w'``) start on Mondays, as in
+    Elasticsearch.
+
+    Date math expressions such as ``'now-1h'`` are resolved with
+    `timer` and rounded in the same way, unless `date_math` is set:
+    then they are sent to Elasticsearch as date math, with a rounding
+    to the unit of `round_to` added (``'now-1h/m'``). Other values
+    are left as they are.
+
+    """
+
+    def __init__(
+            self,
+            name: str,
+            default=None,
+            type: type=str,
+            required: bool=False,
+            help_text: str='Unknown variable',
+            serializer_class=None,
+            serializer_options=None,
+            builder=None,
+            cacheable: bool=True,
+            round_to='1m',
+            rounding: str='down',
+            date_math: bool=False,
+            timer=None):
+        super().__init__(name, default, type, required, help_text,
+                         serializer_class, serializer_options, builder,
+                         cacheable)
+        if rounding not in ('down', 'up'):
+            raise ValueError("rounding must be 'down' or 'up'")
+        step = timeutils.parse_interval(round_to)
+        if not step:
+            raise ValueError('Invalid granularity {!r}'.format(round_to))
+        self.round_to = round_to
+        self.rounding = rounding
+        self.date_math = date_math
+        self.timer = timer
+        self._step = step
+        # Calendar weeks start on Mondays
+        weeks = timeutils.is_week(round_to)
+        self._offset = timeutils.MONDAY if weeks else 0
+        # The largest date math unit the granularity is made of
+        self._unit = next((unit for unit in ('wdhms' if weeks else 'dhms')
+                           if step % timeutils.UNITS[unit] == 0), None)
+
+    def normalize(self, value):
+        """
+        Returns `value` rounded to the granularity of the variable.
+        """
+        up = self.rounding == 'up'
+        if timeutils.is_date_math(value):
+            if self.date_math:
+                if '/' in value.rpartition('||')[2] or self._unit is None:
+                    return value
+                return value + '/' + self._unit
+            now = int((self.timer or time.time)() * 1000)
+            millis = timeutils.round_millis(
+                timeutils.resolve_date_math(value, now, up), self._step,
+                up, self._offset)
+            if self.type is int:
+                return millis
+            return timeutils.format_millis(millis, '')
+        try:
+            millis = timeutils.to_millis(value)
+        except (ValueError, TypeError):
+            return value
+        return timeutils.format_millis(
+            timeutils.round_millis(millis, self._step, up, self._offset),
+            value)
+
+    @property
+    def volatile(self) -> bool:
+        return not self.date_math and timeutils.is_date_math(self.default)
+
+    def value_from_dict(self, d: dict=None):
+        if d is None:
+            d = {}
+        if self.required and self.name not in d:
+            raise Exception(
+                "Required variable {} does not have a value".format(self.name))
+        value = self.normalize(d.get(self.name, self.default))
+        if self.builder is None:
+            return value
+        return instrumentation.timed(
+            None, 'builder', self.name, self.builder, value)
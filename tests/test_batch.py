@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_batch
+----------------------------------
+
+Tests for batch rendering and `_msearch` bodies.
+"""
+
+import json
+from array import array
+
+import pytest
+
+from esqb import batch, query, queryfilter, variable
+
+ts = variable.Variable('ts')
+te = variable.Variable('te')
+sort_field = variable.Variable('sort_field', default='age')
+
+
+class RangeFilter(queryfilter.QueryFilter):
+    variables = {'ts': ts, 'te': te}
+
+    def apply(self, query, data):
+        query.setdefault('bool', {}).setdefault('must', []).append(
+            {'range': {'timestamp': {'gte': ts, 'lte': te}}})
+        return query
+
+
+class Q(query.BaseQuery):
+    size = 3
+    sort = [{sort_field: {'order': 'asc'}}]
+    filters = [RangeFilter()]
+
+
+rows = [
+    {'ts': 1, 'te': 2},
+    {'sort_field': 'name'},
+    {'ts': 3, 'te': 4, 'sort_field': 'name'},
+]
+
+
+def test_iter_rows_from_columns():
+    assert list(batch.iter_rows({'ts': array('q', [1, 3]), 'te': [2, 4]})) \
+        == [{'ts': 1, 'te': 2}, {'ts': 3, 'te': 4}]
+    with pytest.raises(ValueError):
+        list(batch.iter_rows({'ts': [1], 'te': []}))
+
+
+def test_render_many_matches_get_es_query():
+    assert Q().render_many(rows) == [Q().get_es_query(d) for d in rows]
+    columns = {'ts': [1, 3], 'te': [2, 4]}
+    assert Q().render_many(columns) == [
+        Q().get_es_query({'ts': 1, 'te': 2}),
+        Q().get_es_query({'ts': 3, 'te': 4})]
+
+
+def test_render_msearch():
+    lines = b''.join(
+        Q().render_msearch(rows, header={'index': 'logs'})).splitlines()
+    assert len(lines) == 2 * len(rows)
+    assert [json.loads(line) for line in lines[::2]] == \
+        [{'index': 'logs'}] * len(rows)
+    assert [json.loads(line) for line in lines[1::2]] == \
+        [Q().get_es_query(d) for d in rows]
+
+
+def test_render_msearch_header_per_item():
+    lines = b''.join(Q().render_msearch(
+        rows, header=lambda d: {'index': d.get('sort_field', 'x')}
+    )).splitlines()
+    assert [json.loads(line) for line in lines[::2]] == [
+        {'index': 'x'}, {'index': 'name'}, {'index': 'name'}]
+
+
+def test_custom_can_apply_is_evaluated_per_row():
+    class OddFilter(RangeFilter):
+        def can_apply(self, data):
+            return data['ts'] % 2 == 1
+
+    class OddQ(query.BaseQuery):
+        filters = [OddFilter()]
+
+    rendered = OddQ().render_many({'ts': [1, 2], 'te': [5, 5]})
+    assert rendered[0]['query'] != {}
+    assert rendered[1]['query'] == {}
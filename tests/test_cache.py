@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_cache
+----------------------------------
+
+Tests for `esqb.cache` module and the render cache of queries.
+"""
+
+import pytest
+
+from esqb import cache, query, queryfilter, variable
+
+value = variable.Variable('value', default=0)
+
+
+class Clock(object):
+    now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_evicts_least_recently_used():
+    c = cache.LRUCache(maxsize=2)
+    c.set('a', 1)
+    c.set('b', 2)
+    assert c.get('a') == 1
+    c.set('c', 3)
+    assert c.get('b') is None
+    assert c.get('a') == 1
+    assert c.get('c') == 3
+    assert c.info() == cache.CacheInfo(
+        hits=3, misses=1, evictions=1, expirations=0, maxsize=2, currsize=2)
+
+
+def test_lru_expires_entries():
+    clock = Clock()
+    c = cache.LRUCache(ttl=10, timer=clock)
+    c.set('a', 1)
+    clock.now = 9
+    assert c.get('a') == 1
+    clock.now = 10
+    assert c.get('a') is None
+    assert c.info().expirations == 1
+    assert len(c) == 0
+
+
+def test_lru_rejects_empty_caches():
+    with pytest.raises(ValueError):
+        cache.LRUCache(maxsize=0)
+
+
+def test_query_render_cache():
+    class Q(query.BaseQuery):
+        render_cache = cache.LRUCache()
+        aggs = {'x': {'terms': {'size': value}}}
+
+    first = Q().get_es_query({'value': 1, 'unrelated': 1})
+    first['aggs']['x']['terms']['size'] = 'mutated'
+    second = Q().get_es_query({'value': 1, 'unrelated': 2})
+    assert second['aggs'] == {'x': {'terms': {'size': 1}}}
+    assert Q().get_es_query({'value': 2})['aggs'] == {
+        'x': {'terms': {'size': 2}}}
+    assert Q.render_cache.info()[:2] == (1, 2)
+
+
+def test_query_render_cache_opt_out():
+    class QF(queryfilter.QueryFilter):
+        cacheable = False
+
+    class Q(query.BaseQuery):
+        render_cache = cache.LRUCache()
+        aggs = {'x': value}
+
+    q = Q()
+    assert q.get_cache_key({'value': 1}) is not None
+    q.filters = [QF()]
+    assert q.get_cache_key({'value': 1}) is None
+    q.filters = []
+    q.aggs = {'x': variable.Variable('value', cacheable=False)}
+    assert q.get_cache_key({'value': 1}) is None
+    q.get_es_query({'value': 1})
+    assert len(Q.render_cache) == 0
+
+
+def test_query_render_cache_of_modified_instances():
+    class QF(queryfilter.QueryFilter):
+        def apply(self, query, data):
+            return {'filtered': True}
+
+    class Q(query.BaseQuery):
+        render_cache = cache.LRUCache()
+        aggs = {'x': value}
+
+    assert Q().get_es_query({'value': 1})['aggs'] == {'x': 1}
+    q2 = Q()
+    q2.aggs = {'y': value}
+    assert q2.get_es_query({'value': 1})['aggs'] == {'y': 1}
+    assert q2.get_cache_key({'value': 1}) is None
+    q3 = Q()
+    q3.size = 50
+    assert q3.get_es_query({'value': 1})['size'] == 50
+    q4 = Q()
+    q4.filters = [QF()]
+    assert q4.get_es_query({'value': 1})['query'] == {'filtered': True}
+    assert Q().get_es_query({'value': 1})['query'] == {}
+    assert q4.get_cache_key({}) != Q().get_cache_key({})
+    assert len(Q.render_cache) == 2
+
+
+class range_filter(queryfilter.QueryFilter):
+
+    def __init__(self, field, ts, te):
+        self.field = field
+        self.variables = {'ts': ts, 'te': te}
+
+    def apply(self, query, data):
+        query.setdefault('bool', {}).setdefault('filter', []).append(
+            {'range': {self.field: {'gte': self.variables['ts'],
+                                    'lte': self.variables['te']}}})
+        return query
+
+
+class PerRequest(query.BaseQuery):
+    render_cache = cache.LRUCache(16)
+    size = value
+
+    def __init__(self, field='timestamp'):
+        super().__init__()
+        self.filters = [range_filter(field, variable.Variable('ts'),
+                                     variable.Variable('te'))]
+
+
+def test_query_render_cache_of_instances_with_their_own_filters():
+    data = {'ts': 1, 'te': 2, 'value': 3}
+    es_queries = [PerRequest().get_es_query(data) for _ in range(20)]
+    assert es_queries[0]['query'] == {'bool': {'filter': [
+        {'range': {'timestamp': {'gte': 1, 'lte': 2}}}]}}
+    assert all(es_query == es_queries[0] for es_query in es_queries)
+    assert PerRequest.render_cache.info()[:3] == (19, 1, 0)
+    assert PerRequest('other').get_es_query(data)['query'] == {
+        'bool': {'filter': [{'range': {'other': {'gte': 1, 'lte': 2}}}]}}
+
+    # Reading the parts does not disable the cache
+    q = PerRequest()
+    assert q.size is value and q.aggs == {}
+    assert q.get_cache_key(data) == PerRequest().get_cache_key(data)
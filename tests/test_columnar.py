@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_columnar
+----------------------------------
+
+Tests for `esqb.columnar` module.
+"""
+
+import math
+
+import pytest
+
+from esqb import columnar, query
+
+response = {
+    'hits': {'hits': [
+        {'_id': '1', '_source': {'user': {'name': 'a'}, 'n': 1},
+         'sort': [10, 1]},
+        {'_id': '2', '_source': {'user': {'name': 'b'}}, 'sort': [20, 2]},
+    ]},
+    'aggregations': {
+        'by_day': {'buckets': [
+            {'key': 1000, 'key_as_string': '1970-01-01T00:00:01',
+             'doc_count': 3,
+             'by_host': {'buckets': [
+                 {'key': 'h1', 'doc_count': 2, 'cpu': {'value': 0.5}},
+                 {'key': 'h2', 'doc_count': 1, 'cpu': {'value': None}},
+             ]}},
+            {'key': 2000, 'key_as_string': '1970-01-01T00:00:02',
+             'doc_count': 1,
+             'by_host': {'buckets': [
+                 {'key': 'h1', 'doc_count': 1, 'cpu': {'value': 1.5}},
+             ]}},
+        ]},
+        'status': {'buckets': {
+            'ok': {'doc_count': 4}, 'failed': {'doc_count': 0}}},
+    },
+}
+
+
+def test_compile_path():
+    get = columnar.compile_path('_source.user.name')
+    assert get(response['hits']['hits'][0]) == 'a'
+    assert columnar.compile_path('sort.1')(response['hits']['hits'][1]) == 2
+    assert columnar.compile_path('_source.n', 0)(
+        response['hits']['hits'][1]) == 0
+    with pytest.raises(KeyError):
+        get({'_source': {}})
+    assert columnar.compile_path('_source.user.name') is get
+
+
+def test_dotget_is_unchanged():
+    assert query.BaseQuery().dotget(response, 'hits.hits') is \
+        response['hits']['hits']
+    with pytest.raises(KeyError):
+        query.BaseQuery().dotget(response, 'hits.missing')
+
+
+def test_nested_bucket_columns():
+    columns = columnar.bucket_columns(
+        response['aggregations'], 'by_day', 'by_host',
+        values=['cpu.value', 'missing'])
+    assert list(columns['by_day']) == [1000, 1000, 2000]
+    assert list(columns['by_host']) == ['h1', 'h2', 'h1']
+    assert list(columns['doc_count']) == [2, 1, 1]
+    cpu = list(columns['cpu.value'])
+    assert cpu[0] == 0.5 and math.isnan(cpu[1]) and cpu[2] == 1.5
+    assert all(math.isnan(v) for v in columns['missing'])
+
+
+def test_bucket_columns_keys():
+    columns = columnar.bucket_columns(
+        response['aggregations'], 'by_day', key_as_string=True)
+    assert columns['by_day'] == ['1970-01-01T00:00:01',
+                                 '1970-01-01T00:00:02']
+    assert list(columns['doc_count']) == [3, 1]
+
+    columns = columnar.bucket_columns(response['aggregations'], 'status')
+    assert columns['status'] == ['ok', 'failed']
+    assert list(columns['doc_count']) == [4, 0]
+
+
+def test_numeric_columns_are_compact():
+    columns = columnar.bucket_columns(
+        response['aggregations'], 'by_day', 'by_host')
+    assert columns['by_day'].itemsize == 8
+    assert not isinstance(columns['by_day'], list)
+
+
+def test_column_types():
+    assert list(columnar._to_column([1, 2.5, None]))[:2] == [1.0, 2.5]
+    assert columnar._to_column([1, 2 ** 70]) == [1, 2 ** 70]
+    assert columnar._to_column([1, 'x', None]) == [1, 'x', None]
+    assert columnar._to_column([True, False]) == [True, False]
+    assert columnar._to_column([]) == []
+
+
+def test_hits_columns():
+    columns = columnar.hits_columns(
+        response, ['_id', '_source.user.name', '_source.n', 'sort.0'])
+    assert columns['_id'] == ['1', '2']
+    assert columns['_source.user.name'] == ['a', 'b']
+    assert columns['_source.n'][0] == 1 and math.isnan(columns['_source.n'][1])
+    assert list(columns['sort.0']) == [10, 20]
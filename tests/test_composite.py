@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_composite
+----------------------------------
+
+Tests for `esqb.composite` module.
+"""
+
+import asyncio
+import collections
+
+from esqb import composite, executor, query, testing, variable
+
+documents = {'logs': [{'user': 'u{:02d}'.format(i % 23), 'ok': i % 3 == 0}
+                      for i in range(200)]}
+
+
+def aggregate(body):
+    """
+    Emulates the terms and composite aggregations of Elasticsearch.
+    """
+    aggregations = {}
+    for name, agg in body.get('aggs', {}).items():
+        if 'terms' in agg:
+            field = agg['terms']['field']
+            counts = collections.Counter(d[field] for d in documents['logs'])
+            buckets = sorted(counts.items(), key=lambda i: (-i[1], i[0]))
+            size = agg['terms'].get('size', 10)
+            aggregations[name] = {
+                'doc_count_error_upper_bound': 0,
+                'sum_other_doc_count': sum(c for _, c in buckets[size:]),
+                'buckets': [terms_bucket(k, c) for k, c in buckets[:size]]}
+        elif 'composite' in agg:
+            (source, options), = agg['composite']['sources'][0].items()
+            field = options['terms']['field']
+            counts = collections.Counter(d[field] for d in documents['logs'])
+            keys = sorted(counts)
+            if 'after' in agg['composite']:
+                after = agg['composite']['after'][source]
+                keys = [k for k in keys if k > after]
+            keys = keys[:agg['composite']['size']]
+            aggregations[name] = {
+                'buckets': [{'key': {source: k}, 'doc_count': counts[k]}
+                            for k in keys]}
+            if keys:
+                aggregations[name]['after_key'] = {source: keys[-1]}
+    return {'hits': {'hits': []}, 'aggregations': aggregations}
+
+
+def terms_bucket(key, count):
+    if isinstance(key, bool):
+        return {'key': int(key), 'key_as_string': str(key).lower(),
+                'doc_count': count}
+    return {'key': key, 'doc_count': count}
+
+
+def handler(method, path, body):
+    if path.endswith('/_search'):
+        return 200, aggregate(body)
+
+
+class Users(query.BaseQuery):
+    query = {'match_all': {}}
+    aggs = {
+        'users': {'terms': {'field': 'user',
+                            'size': variable.Variable('size', type=int)}},
+        'ok': {'terms': {'field': 'ok', 'order': {'_key': 'asc'}}},
+        'top': {'top_hits': {'size': 1}},
+    }
+
+    def result(self, response):
+        return response['aggregations']
+
+
+def test_eligible_aggregations():
+    assert composite.is_eligible({'terms': {'field': 'a', 'size': 1000}})
+    assert composite.is_eligible(
+        {'terms': {'field': 'a', 'order': [{'_count': 'asc'}]},
+         'aggs': {'x': {'max': {'field': 'b'}}}})
+    assert not composite.is_eligible({'terms': {'field': 'a',
+                                                'order': {'x': 'desc'}}})
+    assert not composite.is_eligible({'terms': {'field': 'a',
+                                                'include': 'a.*'}})
+    assert not composite.is_eligible({'terms': {'field': 'a',
+                                                'min_doc_count': 0}})
+    assert not composite.is_eligible({'histogram': {'field': 'a'}})
+    assert composite.is_eligible({'terms': {'field': 'a', 'size': '20'}}, 10)
+    assert not composite.is_eligible({'terms': {'field': 'a', 'size': 10}},
+                                     10)
+    assert not composite.is_eligible({'terms': {'field': 'a'}}, 10)
+
+
+def test_small_terms_aggregations_are_left_unchanged():
+    es_query = Users().get_es_query({'size': 10})
+    pager = composite.CompositePager(es_query, page_size=10)
+    assert pager.terms == {}
+    assert pager.next_body()['aggs'] == es_query['aggs']
+    pager.collect(aggregate(es_query))
+    assert pager.next_body() is None
+    assert pager.get_response() == aggregate(es_query)
+
+
+def test_pager_rewrites_and_pages():
+    es_query = Users().get_es_query({'size': 100})
+    pager = composite.CompositePager(es_query, page_size=10)
+    body = pager.next_body()
+    assert body['aggs']['users'] == {'composite': {
+        'size': 10, 'sources': [{'users': {'terms': {'field': 'user'}}}]}}
+    assert body['aggs']['top'] == es_query['aggs']['top']
+    assert es_query['aggs']['users']['terms']['size'] == 100
+
+    bodies = []
+    while body is not None:
+        bodies.append(body)
+        pager.collect(aggregate(body))
+        body = pager.next_body()
+    assert len(bodies) == 3
+    assert set(bodies[1]['aggs']) == {'users'}
+    assert bodies[1]['size'] == 0
+    assert bodies[1]['aggs']['users']['composite']['after'] == {
+        'users': 'u09'}
+
+    aggregations = pager.get_response()['aggregations']
+    expected = aggregate(es_query)['aggregations']
+    assert aggregations['users'] == expected['users']
+    assert aggregations['ok']['buckets'] == [
+        {'key': 0, 'key_as_string': 'false', 'doc_count': 133},
+        {'key': 1, 'key_as_string': 'true', 'doc_count': 67}]
+    assert 'top' not in aggregations
+
+
+def test_min_doc_count_from_variables():
+    class MinCount(query.BaseQuery):
+        aggs = {'users': {'terms': {
+            'field': 'user', 'size': 100,
+            'min_doc_count': variable.Variable('min_doc_count', '1')}}}
+
+    es_query = MinCount().get_es_query({'min_doc_count': '9'})
+    assert composite.is_eligible(es_query['aggs']['users'])
+    assert not composite.is_eligible(
+        MinCount().get_es_query({'min_doc_count': '0'})['aggs']['users'])
+    assert not composite.is_eligible(
+        MinCount().get_es_query({'min_doc_count': 'x'})['aggs']['users'])
+
+    pager = composite.CompositePager(es_query, page_size=10)
+    body = pager.next_body()
+    while body is not None:
+        pager.collect(aggregate(body))
+        body = pager.next_body()
+    buckets = pager.get_response()['aggregations']['users']['buckets']
+    assert buckets and all(b['doc_count'] >= 9 for b in buckets)
+
+
+def test_size_and_other_doc_count_are_kept():
+    es_query = Users().get_es_query({'size': 5})
+    pager = composite.CompositePager(es_query, page_size=7, min_size=0)
+    body = pager.next_body()
+    while body is not None:
+        pager.collect(aggregate(body))
+        body = pager.next_body()
+    users = pager.get_response()['aggregations']['users']
+    assert users == aggregate(es_query)['aggregations']['users']
+    assert users['sum_other_doc_count'] == 200 - sum(
+        b['doc_count'] for b in users['buckets'])
+
+
+def test_iter_buckets_and_search():
+    with testing.MockElasticsearch(documents, handler) as es:
+        buckets = list(composite.iter_buckets(
+            Users(), es.url, {'size': 3}, 'logs', page_size=10))
+        response = composite.search(
+            Users(), es.url, {'size': 3}, 'logs', page_size=10)
+        # A top 3 is not paged through
+        assert len(es.requests) == 4
+        assert 'terms' in es.requests[-1][2]['aggs']['users']
+
+    users = [bucket['key'] for name, bucket in buckets if name == 'users']
+    assert users == sorted('u{:02d}'.format(i) for i in range(23))
+    assert [b['key'] for b in response['aggregations']['users']['buckets']] \
+        == ['u00', 'u01', 'u02']
+
+
+def test_executor_uses_composite_size():
+    class PagedUsers(Users):
+        composite_size = 10
+
+    async def run(url, q):
+        e = executor.AsyncExecutor(url, index='logs')
+        try:
+            return await e.execute(q, {'size': 50})
+        finally:
+            await e.close()
+
+    with testing.MockElasticsearch(documents, handler) as es:
+        paged = asyncio.run(run(es.url, PagedUsers()))
+        assert len(es.requests) == 3
+        plain = asyncio.run(run(es.url, Users()))
+        assert len(es.requests) == 4
+
+    assert paged['users'] == plain['users']
+    assert paged['ok']['buckets'][0]['key'] == 0
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_drf_support
+----------------------------------
+
+Tests for `esqb.drf_support` module.
+"""
+
+from array import array
+
+import pytest
+
+pytest.importorskip('rest_framework')
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+if not settings.configured:
+    settings.configure()
+    django.setup()
+
+from rest_framework import serializers  # noqa: E402
+
+from esqb import drf_support, query, variable  # noqa: E402
+
+size = variable.Variable('size', default=10, type=int)
+field = variable.Variable('field', required=True, help_text='Field')
+
+
+class Q(query.BaseQuery):
+    size = size
+    aggs = {'x': {'terms': {'field': field}}}
+
+
+def setup_function(function):
+    drf_support.clear_serializer_cache()
+
+
+def test_serializer_fields():
+    serializer = drf_support.get_query_serializer(Q())(
+        data={'field': 'name'})
+    assert serializer.is_valid(), serializer.errors
+    assert serializer.validated_data == {'field': 'name', 'size': 10}
+
+
+def test_serializers_are_cached():
+    before = drf_support.serializer_cache_info()
+    serializer = drf_support.get_query_serializer(Q())
+    assert drf_support.get_query_serializer(Q()) is serializer
+    hidden = drf_support.get_query_serializer(Q(), hide=('size', ))
+    assert hidden is not serializer
+    assert list(hidden().fields) == ['field']
+    assert drf_support.get_query_serializer(Q(), hide=(size, )) is not hidden
+    info = drf_support.serializer_cache_info()
+    assert info['hits'] - before['hits'] == 1
+    assert info['misses'] - before['misses'] == 3
+    assert info['currsize'] == 3
+    assert info['memory'] > 0
+
+
+def test_changed_variables_invalidate_serializers():
+    q = Q()
+    serializer = drf_support.get_query_serializer(q)
+    q.size = variable.Variable('size', default=20, type=int)
+    assert drf_support.get_query_serializer(q) is not serializer
+
+
+def test_field_construction_has_no_side_effects():
+    var = variable.Variable('v', default=1, type=int)
+    var.serializer_field_options = {'min_value': 0}
+    drf_support.get_variable_serializer_field(var)
+    assert var.serializer_field_options == {'min_value': 0}
+
+
+def list_field(child, **kwargs):
+    field = drf_support.ListField(child=child, **kwargs)
+    field.bind('ids', None)
+    return field
+
+
+def test_list_field_parses_integers_in_bulk():
+    field = list_field(serializers.IntegerField())
+    assert field.run_validation(['1,2, 3,4.0']) == [1, 2, 3, 4]
+    with pytest.raises(serializers.ValidationError) as e:
+        field.run_validation(['1,x,3,'])
+    assert sorted(e.value.detail) == [1, 3]
+
+
+def test_list_field_parses_floats_and_strings_in_bulk():
+    assert list_field(serializers.FloatField()).run_validation(
+        ['1.5,2']) == [1.5, 2.0]
+    with pytest.raises(serializers.ValidationError) as e:
+        list_field(serializers.FloatField()).run_validation(['1,nan'])
+    assert list(e.value.detail) == [1]
+    assert list_field(serializers.CharField()).run_validation(
+        ['a, b ,c']) == ['a', 'b', 'c']
+    with pytest.raises(serializers.ValidationError) as e:
+        list_field(serializers.CharField()).run_validation(['a,,c\x00'])
+    assert sorted(e.value.detail) == [1, 2]
+
+
+def test_list_field_validates_children_with_options():
+    field = list_field(serializers.IntegerField(max_value=10))
+    assert field.run_validation(['1,10']) == [1, 10]
+    with pytest.raises(serializers.ValidationError) as e:
+        field.run_validation(['1,11'])
+    assert list(e.value.detail) == [1]
+
+
+def test_list_field_unique_array_and_max_length():
+    field = list_field(serializers.IntegerField(), unique=True,
+                       as_array=True, max_length=4)
+    assert field.run_validation(['3,1,3,2']) == array('q', [3, 1, 2])
+    with pytest.raises(serializers.ValidationError):
+        field.run_validation(['1,2,3,4,5'])
+    with pytest.raises(serializers.ValidationError) as e:
+        field.run_validation(['1,{},{}'.format(2 ** 63, -2 ** 63)])
+    assert list(e.value.detail) == [1]
@@ -88,3 +88,112 @@ def test_complex_query_contains_multiple_vars():
             ]
         }
     }
+
+
+def test_get_variable_by_name():
+    q = Query()
+    assert q.get_variable('t') is testvar
+    assert q.get_variable('missing') is None
+
+
+def test_variables_are_cached():
+    q = Query()
+    assert q.find_all_variables() == q.find_all_variables()
+    assert q.find_all_variables() is not q.find_all_variables()
+    assert q._find_variables() is q._find_variables()
+
+
+def test_assigning_parts_invalidates_variables():
+    other = variable.Variable('o')
+
+    class RQuery(query.BaseQuery):
+        pass
+
+    q = RQuery()
+    assert q.find_all_variables() == []
+    q.aggs = {'x': other}
+    assert q.find_all_variables() == [other]
+    q.size = testvar
+    assert q.find_all_variables() == [other, testvar]
+
+
+def test_in_place_changes_are_rendered():
+    other = variable.Variable('o')
+
+    class RQuery(query.BaseQuery):
+        query = {'bool': {'must': [{'term': {'a': 1}}]}}
+
+    q = RQuery()
+    q.query['x'] = other
+    assert q.get_variable('o') is other
+
+    q = RQuery()
+    q.get_es_query({})
+    q.query['bool']['must'].append(
+        {'term': {'b': variable.Variable('b', default=2)}})
+    assert q.get_es_query({})['query'] == {'bool': {'must': [
+        {'term': {'a': 1}}, {'term': {'b': 2}}]}}
+    assert [v.name for v in q.find_all_variables()] == ['b']
+    assert RQuery().get_es_query({})['query'] == RQuery.query
+
+
+def test_rendered_queries_are_independent():
+    class RQuery(query.BaseQuery):
+        query = {'bool': {'must': [{'term': {'a': 1}}]}}
+        aggs = {'x': {'terms': {'field': 'f', 'size': testvar}}}
+
+    rendered = RQuery().get_es_query({'t': 1})
+    rendered['query']['bool']['must'].append({'term': {'b': 2}})
+    rendered['aggs']['x']['terms']['field'] = 'g'
+    assert RQuery.query == {'bool': {'must': [{'term': {'a': 1}}]}}
+    assert RQuery().get_es_query({'t': 1}) == {
+        'query': {'bool': {'must': [{'term': {'a': 1}}]}},
+        'aggs': {'x': {'terms': {'field': 'f', 'size': 1}}},
+        'size': 0, 'sort': []}
+    shared = RQuery().get_es_query({'t': 1}, shared=True)
+    assert shared['query'] is RQuery.query
+
+
+def test_instances_share_class_parts_until_modified():
+    class RQuery(query.BaseQuery):
+        query = {'bool': {'must': []}}
+
+    assert RQuery.query == {'bool': {'must': []}}
+    q = RQuery()
+    assert q.get_template('query').source is RQuery.query
+    q.query['bool']['must'].append({'term': {'x': 1}})
+    assert RQuery.query == {'bool': {'must': []}}
+    assert RQuery().get_es_query({})['query'] == {'bool': {'must': []}}
+    assert q.get_es_query({})['query'] == {
+        'bool': {'must': [{'term': {'x': 1}}]}}
+
+
+def test_instances_do_not_copy_parts_on_creation():
+    class RQuery(query.BaseQuery):
+        aggs = {'x': testvar}
+
+    q = RQuery()
+    assert '_aggs' not in q.__dict__
+    assert q.get_es_query({'t': 1})['aggs'] == {'x': 1}
+    assert '_aggs' not in q.__dict__
+
+
+def test_reading_parts_keeps_the_class_templates():
+    class RQuery(query.BaseQuery):
+        aggs = {'x': {'terms': {'field': 'f', 'size': testvar}}}
+
+    q = RQuery()
+    template = RQuery().get_template('aggs')
+    assert q.aggs['x']['terms']['field'] == 'f'
+    assert q.aggs is not RQuery.aggs
+    assert q.get_template('aggs') is template
+    assert q.get_es_query({'t': 2})['aggs'] == {
+        'x': {'terms': {'field': 'f', 'size': 2}}}
+    assert q.get_template('aggs') is template
+
+    q.aggs['x']['terms']['field'] = 'g'
+    assert q.get_template('aggs') is not template
+    assert q.get_es_query({'t': 2})['aggs'] == {
+        'x': {'terms': {'field': 'g', 'size': 2}}}
+    assert RQuery().get_es_query({'t': 2})['aggs'] == {
+        'x': {'terms': {'field': 'f', 'size': 2}}}
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_executor
+----------------------------------
+
+Tests for `esqb.executor` and `esqb.transport` modules, against the
+mock Elasticsearch server of `esqb.testing`.
+"""
+
+import asyncio
+
+import pytest
+
+from esqb import executor, query, testing, transport, variable
+
+size = variable.Variable('size', default=10, type=int)
+
+
+class LastDocs(query.BaseQuery):
+    size = size
+
+    def result(self, response):
+        return [r.get('_source', {})
+                for r in self.dotget(response, 'hits.hits')]
+
+
+documents = {'logs': [{'n': i} for i in range(5)], 'other': [{'n': -1}]}
+
+
+def test_execute_returns_the_query_result():
+    async def run(url):
+        e = executor.AsyncExecutor(url, index='logs')
+        try:
+            return await e.execute(LastDocs(), {'size': 3})
+        finally:
+            await e.close()
+
+    with testing.MockElasticsearch(documents) as es:
+        assert asyncio.run(run(es.url)) == [{'n': 0}, {'n': 1}, {'n': 2}]
+        method, path, body = es.requests[0]
+        assert (method, path) == ('POST', '/logs/_search')
+        assert body == LastDocs().get_es_query({'size': 3})
+
+
+def test_execute_many_reuses_pooled_connections():
+    async def run(url):
+        e = executor.AsyncExecutor(url, max_connections=2)
+        try:
+            return await e.execute_many(
+                [(LastDocs(), {'size': i}) for i in range(20)])
+        finally:
+            await e.close()
+
+    with testing.MockElasticsearch(documents, latency=0.005) as es:
+        results = asyncio.run(run(es.url))
+        assert [len(r) for r in results] == [min(i, 6) for i in range(20)]
+        assert es.connections <= 2
+
+
+def test_errors_and_timeouts():
+    async def run(url, **kwargs):
+        e = executor.AsyncExecutor(url, index='missing/_doc', **kwargs)
+        try:
+            return await e.execute(LastDocs(), {})
+        finally:
+            await e.close()
+
+    with testing.MockElasticsearch(documents) as es:
+        with pytest.raises(transport.TransportError) as error:
+            asyncio.run(run(es.url))
+        assert error.value.status == 404
+
+    with testing.MockElasticsearch(documents, latency=0.5) as es:
+        with pytest.raises(asyncio.TimeoutError):
+            asyncio.run(run(es.url, timeout=0.05))
+
+
+def test_queries_without_result_return_the_response():
+    assert executor.get_result(query.BaseQuery(), {'a': 1}) == {'a': 1}
+    assert executor.search_path(['a', 'b']) == '/a,b/_search'
+    assert executor.search_path('a', 'x:y/z') == \
+        '/a/_search?preference=x%3Ay%2Fz'
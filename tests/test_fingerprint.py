@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_fingerprint
+----------------------------------
+
+Tests for `esqb.fingerprint` module, against the mock Elasticsearch
+server of `esqb.testing`.
+"""
+
+import asyncio
+import threading
+
+import pytest
+
+from esqb import executor, fingerprint, query, testing, transport, variable
+
+
+class LastDocs(query.BaseQuery):
+    size = variable.Variable('size', default=10, type=int)
+    sort = [{'n': 'desc'}]
+
+    def result(self, response):
+        return [r.get('_source', {})
+                for r in self.dotget(response, 'hits.hits')]
+
+
+class OtherDocs(LastDocs):
+    pass
+
+
+documents = {'logs': [{'n': i} for i in range(5)]}
+
+
+def test_canonical_json_sorts_keys():
+    assert fingerprint.canonical_json({'b': 1, 'a': (1, 2)}) == \
+        b'{"a":[1,2],"b":1}'
+    assert fingerprint.canonical_json({'a': {'y': 1, 'x': 2}}) == \
+        fingerprint.canonical_json({'a': {'x': 2, 'y': 1}})
+
+
+def test_fingerprint():
+    key = fingerprint.fingerprint(LastDocs(), {'size': 3}, 'logs')
+    assert len(key) == 32
+    assert key == fingerprint.fingerprint(LastDocs(), {'size': 3}, 'logs')
+    assert key == fingerprint.fingerprint(LastDocs(), {'size': 3}, ['logs'])
+    assert key != fingerprint.fingerprint(LastDocs(), {'size': 4}, 'logs')
+    assert key != fingerprint.fingerprint(LastDocs(), {'size': 3}, 'other')
+    assert key != fingerprint.fingerprint(OtherDocs(), {'size': 3}, 'logs')
+
+
+def test_threads_share_one_search():
+    flights = fingerprint.SingleFlight()
+    barrier = threading.Barrier(10)
+    results = []
+
+    def search(url, size):
+        barrier.wait()
+        results.append(flights.execute(LastDocs(), {'size': size}, url,
+                                       index='logs', preference=True))
+
+    with testing.MockElasticsearch(documents, latency=0.2) as es:
+        threads = [threading.Thread(target=search, args=(es.url, 2))
+                   for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(es.requests) == 1
+        method, path, body = es.requests[0]
+        key = fingerprint.fingerprint(LastDocs(), {'size': 2}, 'logs')
+        assert path == '/logs/_search?preference=' + key
+        assert body == LastDocs().get_es_query({'size': 2})
+    assert results == [[{'n': 4}, {'n': 3}]] * 10
+    assert (flights.calls, flights.coalesced) == (1, 9)
+
+
+def test_errors_are_shared():
+    flights = fingerprint.SingleFlight()
+    with testing.MockElasticsearch(documents) as es:
+        with pytest.raises(transport.TransportError):
+            flights.execute(LastDocs(), {}, es.url, index='missing')
+    assert flights._calls == {}
+
+
+def test_tasks_share_one_search():
+    async def run(url):
+        e = executor.AsyncExecutor(url, index='logs')
+        flights = fingerprint.AsyncSingleFlight()
+        try:
+            results = await asyncio.gather(*[
+                flights.execute(e, LastDocs(), {'size': size % 2 + 1})
+                for size in range(10)])
+        finally:
+            await e.close()
+        return results, flights
+
+    with testing.MockElasticsearch(documents, latency=0.2) as es:
+        results, flights = asyncio.run(run(es.url))
+        assert len(es.requests) == 2
+        assert all('preference' not in path for _, path, _ in es.requests)
+    assert results == [[{'n': 4}], [{'n': 4}, {'n': 3}]] * 5
+    assert (flights.calls, flights.coalesced) == (2, 8)
+
+
+def test_cancelling_the_first_task_does_not_cancel_the_others():
+    async def run():
+        flights = fingerprint.AsyncSingleFlight()
+        release = asyncio.Event()
+
+        async def search():
+            await release.wait()
+            return 'result'
+
+        leader = asyncio.ensure_future(flights.do('key', search))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.do('key', search))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        assert await follower == 'result'
+        assert flights._flights == {}
+
+        # The call is cancelled once nobody waits for it
+        release.clear()
+        waiting = asyncio.ensure_future(flights.do('key', search))
+        await asyncio.sleep(0)
+        task = flights._flights['key'][0]
+        waiting.cancel()
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        assert task.cancelled() and flights._flights == {}
+        return flights
+
+    flights = asyncio.run(run())
+    assert (flights.calls, flights.coalesced) == (2, 1)
+
+
+def test_tasks_render_their_query_once():
+    renders = []
+
+    class Counted(LastDocs):
+        def get_es_query(self, data, shared=False):
+            renders.append(data)
+            return super().get_es_query(data, shared)
+
+        def render_json(self, data):
+            renders.append(data)
+            return super().render_json(data)
+
+    async def run(url):
+        e = executor.AsyncExecutor(url, index='logs')
+        try:
+            return await fingerprint.AsyncSingleFlight().execute(
+                e, Counted(), {'size': 1}, preference=True)
+        finally:
+            await e.close()
+
+    with testing.MockElasticsearch(documents) as es:
+        assert asyncio.run(run(es.url)) == [{'n': 4}]
+        assert es.requests[0][2] == LastDocs().get_es_query({'size': 1})
+    assert len(renders) == 1
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_frozen
+----------------------------------
+
+Tests for immutable queries shared by several threads.
+"""
+
+import json
+import threading
+from copy import deepcopy
+
+import pytest
+
+from esqb import query, queryfilter, variable
+
+ts = variable.Variable('ts')
+te = variable.Variable('te')
+size = variable.Variable('size', default=10)
+
+
+class PureRangeFilter(queryfilter.QueryFilter):
+    mutates = False
+    variables = {'ts': ts, 'te': te}
+
+    def apply(self, query, data):
+        bool_query = query.get('bool', {})
+        must = bool_query.get('must', []) + [
+            {'range': {'timestamp': {'gte': ts, 'lte': te}}}]
+        return dict(query, bool=dict(bool_query, must=must))
+
+
+class MutatingTermFilter(queryfilter.QueryFilter):
+    variables = {'name': variable.Variable('name')}
+
+    def apply(self, query, data):
+        query.setdefault('bool', {}).setdefault('must', []).append(
+            {'term': {'name': self.variables['name']}})
+        return query
+
+
+class Q(query.FrozenQuery):
+    size = size
+    query = {'bool': {'must': [{'term': {'type': 'log'}}]}}
+    aggs = {'by_time': {'date_histogram': {'field': 'timestamp'}}}
+    filters = [PureRangeFilter(), MutatingTermFilter()]
+
+
+def test_frozen_queries_cannot_be_modified():
+    q = Q()
+    with pytest.raises(AttributeError):
+        q.aggs = {}
+    with pytest.raises(AttributeError):
+        q.filters = []
+    with pytest.raises(AttributeError):
+        del q.size
+    assert isinstance(q.filters, tuple)
+    q.query['bool'] = 'changed'
+    assert q.get_es_query({})['query'] == Q.query
+
+
+def test_pure_filters_do_not_copy_the_query():
+    class RQuery(query.BaseQuery):
+        query = {'bool': {'filter': [{'term': {'type': 'log'}}]}}
+        filters = [PureRangeFilter()]
+
+    rendered = RQuery().get_es_query({'ts': 1, 'te': 2},
+                                     shared=True)['query']
+    assert rendered['bool']['must'] == [
+        {'range': {'timestamp': {'gte': 1, 'lte': 2}}}]
+    assert rendered['bool']['filter'] is RQuery.query['bool']['filter']
+
+    rendered = RQuery().get_es_query({'ts': 1, 'te': 2})['query']
+    assert rendered['bool']['filter'] == RQuery.query['bool']['filter']
+    assert rendered['bool']['filter'] is not RQuery.query['bool']['filter']
+
+
+def test_frozen_query_shared_by_threads():
+    shared = Q()
+    original = deepcopy(Q.query)
+    datasets = [
+        {'ts': i, 'te': i + 1, 'name': 'n{}'.format(i % 3), 'size': i}
+        if i % 2 else {'size': i}
+        for i in range(50)
+    ]
+    expected = [json.dumps(Q().get_es_query(d), sort_keys=True)
+                for d in datasets]
+    errors = []
+    barrier = threading.Barrier(8)
+
+    def worker(offset):
+        barrier.wait()
+        for _ in range(20):
+            for i, data in enumerate(datasets):
+                if i % 8 != offset:
+                    continue
+                got = shared.get_es_query(data)
+                if json.dumps(got, sort_keys=True) != expected[i]:
+                    errors.append((i, got))
+                if json.loads(shared.render_json(data)) != got:
+                    errors.append((i, 'json'))
+
+    threads = [threading.Thread(target=worker, args=(i, ))
+               for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert Q.query == original
+
+
+def test_rendered_queries_of_frozen_queries_are_independent():
+    shared = Q()
+    rendered = shared.get_es_query({})
+    rendered['query']['bool']['must'].append({'term': {'x': 1}})
+    rendered['aggs']['by_time']['date_histogram']['field'] = 'other'
+    assert shared.get_es_query({}) == {
+        'query': Q.query, 'aggs': Q.aggs, 'size': 10, 'sort': []}
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_guardrails
+----------------------------------
+
+Tests for `esqb.guardrails` module.
+"""
+
+import json
+
+import pytest
+
+from esqb import guardrails, query, timeutils, variable
+
+NOW = timeutils.to_millis('2024-06-01T00:00:00Z')
+
+
+class Histogram(query.BaseQuery):
+    size = 0
+    query = {'bool': {'filter': [
+        {'term': {'service': 'api'}},
+        {'range': {'ts': {'gte': variable.Variable('ts'),
+                          'lte': variable.Variable('te')}}}]}}
+    aggs = {'by_host': {
+        'terms': {'field': 'host', 'size': variable.Variable(
+            'hosts', default=10)},
+        'aggs': {'by_time': {
+            'date_histogram': {'field': 'ts', 'fixed_interval':
+                               variable.Variable('interval', default='1h')},
+            'aggs': {'latency': {'avg': {'field': 'latency'}}}}}}}
+
+
+def test_estimate_buckets_and_hits():
+    result = Histogram().estimate({'ts': '2024-01-01', 'te': '2024-01-02'})
+    # 25 hours, as both ends are included
+    assert result.aggs == {'by_host': 10, 'by_host>by_time': 250}
+    assert result.buckets == 260
+    assert result.values == 250
+    assert result.hits == 0
+    assert result.unknown == []
+    assert result.response_bytes == guardrails._BASE_BYTES + \
+        260 * guardrails.BUCKET_BYTES + 250 * guardrails.VALUE_BYTES
+    assert result.as_dict()['buckets'] == 260
+
+
+def test_estimate_other_aggregations():
+    es_query = {
+        'query': {'range': {'price': {'gte': 0, 'lt': 100}}},
+        'size': 20,
+        'aggs': {
+            'prices': {'histogram': {'field': 'price', 'interval': 10},
+                       'aggs': {'top': {'top_hits': {}}}},
+            'ranges': {'range': {'field': 'price', 'ranges': [
+                {'to': 10}, {'from': 10}]}},
+            'recent': {'date_histogram': {
+                'field': 'ts', 'calendar_interval': 'day',
+                'extended_bounds': {'min': 'now-7d/d', 'max': 'now'}}},
+            'open': {'date_histogram': {'field': 'other',
+                                        'fixed_interval': '1d'}},
+        }}
+    result = guardrails.estimate(es_query, now=NOW)
+    assert result.aggs == {'prices': 11, 'ranges': 2, 'recent': 8, 'open': 1}
+    assert result.unknown == ['open']
+    assert result.hits == 20 + 11 * 3
+
+
+def test_limits_reject():
+
+    class Limited(Histogram):
+        limits = guardrails.Limits(max_buckets=1000)
+
+    Limited().get_es_query({'ts': '2024-01-01', 'te': '2024-01-02'})
+    with pytest.raises(guardrails.QueryLimitExceeded) as info:
+        Limited().get_es_query({'ts': '2024-01-01', 'te': '2025-01-01',
+                                'interval': '1m'})
+    assert info.value.estimate.buckets > 1000
+    assert 'buckets' in str(info.value)
+
+
+def test_limits_rewrite():
+    estimates = []
+
+    class Limited(Histogram):
+        limits = guardrails.Limits(max_buckets=10000, max_terms_size=100,
+                                   rewrite=True,
+                                   on_estimate=estimates.append)
+
+    data = {'ts': '2024-01-01', 'te': '2025-01-01', 'interval': '1m',
+            'hosts': 1000000}
+    es_query = Limited().get_es_query(data)
+    assert es_query['aggs']['by_host']['terms']['size'] == 100
+    histogram = es_query['aggs']['by_host']['aggs']['by_time'][
+        'date_histogram']
+    # Daily buckets of 100 hosts over a year are still too many
+    assert histogram['fixed_interval'] == '7d'
+    assert estimates[-1].buckets <= 10000
+    assert json.loads(Limited().render_json(data)) == es_query
+    # The definition of the query is left alone
+    assert Limited.aggs['by_host']['aggs']['by_time']['date_histogram'][
+        'fixed_interval'].name == 'interval'
+
+
+def test_limits_rewrite_hits_and_response_size():
+    limits = guardrails.Limits(max_hits=100, max_response_bytes=50000,
+                               rewrite=True)
+    es_query = {'query': {}, 'size': 1000,
+                'aggs': {'hosts': {'terms': {'field': 'host'},
+                                   'aggs': {'last': {'top_hits': {
+                                       'size': 20}}}}}}
+    rewritten = limits.apply(es_query)
+    result = limits.estimate(rewritten)
+    assert result.hits <= 100 and result.response_bytes <= 50000
+    assert es_query['size'] == 1000
+    assert rewritten['size'] < 100
+
+    # Sizes given by string variables
+    limits = guardrails.Limits(max_hits=1000, rewrite=True)
+    rewritten = limits.apply({'query': {}, 'size': '5000', 'aggs': {
+        'last': {'top_hits': {'size': '3'}}}})
+    assert rewritten['size'] <= 1000
+
+    limits = guardrails.Limits(max_buckets=10, rewrite=True)
+    with pytest.raises(guardrails.QueryLimitExceeded):
+        limits.apply({'query': {}, 'aggs': {'r': {'range': {
+            'field': 'a', 'ranges': [{'to': i} for i in range(20)]}}}})
+
+
+def test_coarser_intervals():
+    for kind, body, expected in (
+            ('histogram', {'interval': 10}, 20),
+            ('histogram', {'interval': 20}, 50),
+            ('histogram', {'interval': 50}, 100),
+            ('date_histogram', {'fixed_interval': '1m'}, '5m'),
+            ('date_histogram', {'fixed_interval': '45m'}, '1h'),
+            ('date_histogram', {'calendar_interval': 'day'}, '1w'),
+            ('date_histogram', {'calendar_interval': '1M'}, '1q')):
+        assert guardrails._coarsen(kind, body)
+        assert list(body.values()) == [expected]
+    assert not guardrails._coarsen('date_histogram',
+                                   {'calendar_interval': 'year'})
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_instrumentation
+----------------------------------
+
+Tests for `esqb.instrumentation` module.
+"""
+
+import json
+
+from esqb import instrumentation, query, queryfilter, variable
+
+
+class term_filter(queryfilter.QueryFilter):
+
+    def __init__(self, field, var):
+        self.field = field
+        self.variables = {'value': var}
+
+    def apply(self, query, data):
+        query.setdefault('bool', {}).setdefault('filter', []).append(
+            {'term': {self.field: self.variables['value']}})
+        return query
+
+
+class Instrumented(query.BaseQuery):
+    size = variable.Variable('size', 10, builder=lambda value: value * 2)
+
+    def __init__(self):
+        super().__init__()
+        self.filters = [term_filter('host', variable.Variable('host'))]
+
+
+def test_nothing_is_recorded_when_disabled():
+    recorder = instrumentation.Recorder()
+    Instrumented().get_es_query({'host': 'a'})
+    assert instrumentation.recorder is None
+    assert recorder.as_dict() == {}
+
+
+def test_phases_are_recorded():
+    name = instrumentation.query_id(Instrumented())
+    with instrumentation.instrument() as recorder:
+        q = Instrumented()
+        es_query = q.get_es_query({'host': 'a'})
+        q.get_es_query({'host': 'b'})
+        json.loads(q.render_json({}))
+        q.find_all_variables()
+    assert instrumentation.recorder is None
+    assert es_query == {
+        'query': {'bool': {'filter': [{'term': {'host': 'a'}}]}},
+        'size': 20, 'aggs': {}, 'sort': []}
+
+    stats = recorder.as_dict()
+    assert list(stats) == [name]
+    phases = stats[name]
+    assert phases['get_es_query']['']['seconds']['count'] == 2
+    assert phases['render_json']['']['seconds']['count'] == 1
+    assert phases['plan']['']['seconds']['count'] == 3
+    assert phases['filter']['term_filter']['seconds']['count'] == 2
+    assert phases['copy']['query']['seconds']['count'] == 2
+    assert phases['replace_variables']['query']['seconds']['count'] == 2
+    assert phases['render']['size']['seconds']['count'] == 2
+    # Called while rendering, and attributed to the query rendered
+    assert phases['builder']['size']['seconds']['count'] == 3
+    assert phases['find_variables']['']['seconds']['count'] == 1
+    assert 'count' in phases['filter']['term_filter']['blocks']
+
+
+def test_histograms():
+    histogram = instrumentation.Histogram((1, 2, 5))
+    for value in (0.5, 1, 1.5, 3, 10):
+        histogram.observe(value)
+    assert histogram.cumulative() == [(1, 2), (2, 3), (5, 4),
+                                      (float('inf'), 5)]
+    assert histogram.quantile(0.5) == 2
+    assert histogram.quantile(1) == float('inf')
+    assert histogram.sum == 16
+
+
+def test_prometheus_export():
+    recorder = instrumentation.Recorder(allocations=False,
+                                        seconds_buckets=(0.001, 0.01))
+    recorder.record('app.Query', 'filter', 'a"b', 0.005, 0)
+    recorder.record('app.Query', 'plan', None, 0.0001, 0)
+    assert recorder.to_prometheus().splitlines() == [
+        '# HELP esqb_phase_seconds Time spent in each phase of query '
+        'rendering.',
+        '# TYPE esqb_phase_seconds histogram',
+        'esqb_phase_seconds_bucket{query="app.Query",phase="filter",'
+        'label="a\\"b",le="0.001"} 0',
+        'esqb_phase_seconds_bucket{query="app.Query",phase="filter",'
+        'label="a\\"b",le="0.01"} 1',
+        'esqb_phase_seconds_bucket{query="app.Query",phase="filter",'
+        'label="a\\"b",le="+Inf"} 1',
+        'esqb_phase_seconds_sum{query="app.Query",phase="filter",'
+        'label="a\\"b"} 0.005',
+        'esqb_phase_seconds_count{query="app.Query",phase="filter",'
+        'label="a\\"b"} 1',
+        'esqb_phase_seconds_bucket{query="app.Query",phase="plan",'
+        'label="",le="0.001"} 1',
+        'esqb_phase_seconds_bucket{query="app.Query",phase="plan",'
+        'label="",le="0.01"} 1',
+        'esqb_phase_seconds_bucket{query="app.Query",phase="plan",'
+        'label="",le="+Inf"} 1',
+        'esqb_phase_seconds_sum{query="app.Query",phase="plan",'
+        'label=""} 0.0001',
+        'esqb_phase_seconds_count{query="app.Query",phase="plan",'
+        'label=""} 1',
+    ]
+
+
+def test_time_variable_builders_are_recorded():
+    class TimeRange(query.BaseQuery):
+        query = {'range': {'timestamp': {'gte': variable.TimeVariable(
+            'ts', '2017-01-01T00:00:00Z', round_to='1h',
+            builder=lambda value: value[:10])}}}
+
+    with instrumentation.instrument() as recorder:
+        es_query = TimeRange().get_es_query({'ts': '2017-03-04T05:06:07Z'})
+    assert es_query['query'] == {'range': {'timestamp': {'gte': '2017-03-04'}}}
+    phases = recorder.as_dict()[instrumentation.query_id(TimeRange())]
+    assert phases['builder']['ts']['seconds']['count'] == 1
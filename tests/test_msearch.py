@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_msearch
+----------------------------------
+
+Tests for `esqb.msearch` and multiplexed searches.
+"""
+
+import asyncio
+import json
+
+from esqb import executor, msearch, query, testing, variable
+
+size = variable.Variable('size', default=10, type=int)
+
+
+class LastDocs(query.BaseQuery):
+    size = size
+
+    def result(self, response):
+        return [r['_source']['n'] for r in self.dotget(response, 'hits.hits')]
+
+
+class Count(query.BaseQuery):
+    def result(self, response):
+        return self.dotget(response, 'hits.total.value')
+
+
+class Broken(query.BaseQuery):
+    def result(self, response):
+        raise KeyError('broken')
+
+
+documents = {'logs': [{'n': i} for i in range(5)], 'other': [{'n': -1}]}
+
+
+def test_requests_are_chunked():
+    searches = msearch.MultiSearch(max_batch=2)
+    for i in range(5):
+        assert searches.add(LastDocs(), {'size': i}, index=['a', 'b']) == i
+    requests = list(searches.iter_requests())
+    assert [len(items) for items, _ in requests] == [2, 2, 1]
+    lines = requests[0][1].splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {'index': 'a,b'}, LastDocs().get_es_query({'size': 0}),
+        {'index': 'a,b'}, LastDocs().get_es_query({'size': 1})]
+
+
+def test_dispatch_isolates_errors():
+    searches = msearch.MultiSearch()
+    searches.add(Count(), {})
+    searches.add(Count(), {})
+    searches.add(Broken(), {})
+    results = searches.dispatch(searches.items, {'responses': [
+        {'hits': {'total': {'value': 3}}},
+        {'error': {'type': 'index_not_found_exception'}, 'status': 404},
+        {'hits': {'total': {'value': 3}}},
+    ]})
+    assert results[0] == 3
+    assert isinstance(results[1], msearch.SearchError)
+    assert results[1].status == 404
+    assert isinstance(results[2], KeyError)
+
+
+def test_executor_multiplexes_queries():
+    async def run(url):
+        e = executor.AsyncExecutor(url, index='logs')
+        try:
+            return await e.msearch([
+                (LastDocs(), {'size': 2}),
+                (Count(), {}, 'other'),
+                (Count(), {}, 'missing'),
+                (LastDocs(), {'size': 1}, 'other'),
+            ], max_batch=3)
+        finally:
+            await e.close()
+
+    with testing.MockElasticsearch(documents) as es:
+        results = asyncio.run(run(es.url))
+        assert len(es.requests) == 2
+        assert all(path == '/_msearch' for _, path, _ in es.requests)
+
+    assert results[0] == [0, 1]
+    assert results[1] == 1
+    assert isinstance(results[2], msearch.SearchError)
+    assert results[3] == [-1]
+
+
+class Required(query.BaseQuery):
+    size = variable.Variable('size', type=int, required=True)
+
+
+def test_failures_are_isolated():
+    def handler(method, path, body):
+        if any(line.get('index') == 'down' for line in body or []):
+            return 503, {'error': 'unavailable'}
+
+    async def run(url):
+        e = executor.AsyncExecutor(url, index='logs')
+        try:
+            return await e.msearch([
+                (LastDocs(), {'size': 2}),
+                (Required(), {}),
+                (Count(), {}, 'down'),
+                (Count(), {}),
+                (Required(), {}),
+                (Required(), {}),
+                (Count(), {}, 'other'),
+            ], max_batch=2)
+        finally:
+            await e.close()
+
+    with testing.MockElasticsearch(documents, handler) as es:
+        results = asyncio.run(run(es.url))
+        # The chunk of Required searches only is not sent
+        assert len(es.requests) == 3
+
+    assert results[0] == [0, 1]
+    assert isinstance(results[1], Exception)
+    assert isinstance(results[2], executor.TransportError)
+    assert results[3] is results[2]
+    assert isinstance(results[4], Exception)
+    assert isinstance(results[5], Exception)
+    assert results[6] == 1
+
+
+def test_searches_over_the_limits_are_isolated():
+    from esqb.guardrails import Limits, QueryLimitExceeded
+
+    class Limited(query.BaseQuery):
+        size = size
+        limits = Limits(max_hits=5)
+
+    searches = msearch.MultiSearch()
+    searches.add(Limited(), {'size': 100})
+    searches.add(Count(), {})
+    [(items, body)] = searches.iter_requests()
+    assert len(body.splitlines()) == 2
+    results = searches.dispatch(items, {'responses': [
+        {'hits': {'total': {'value': 3}}}]})
+    assert isinstance(results[0], QueryLimitExceeded)
+    assert results[1] == 3
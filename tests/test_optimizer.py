@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_optimizer
+----------------------------------
+
+Tests for `esqb.optimizer` module.
+"""
+
+import json
+import random
+
+from esqb import optimizer, query, timeutils, variable
+
+FIELDS = ('a', 'b')
+
+
+def documents():
+    return [{'a': a, 'b': b, 'ts': '2024-01-{:02d}T00:00:00Z'.format(day)}
+            for a in range(6) for b in range(4) for day in (1, 2, 3)]
+
+
+def evaluate(clause, doc):
+    """
+    Returns the score of a document for a query (with a score of 1 by
+    matching term or range), or None if it does not match.
+    """
+    kind, body = next(iter(clause.items()))
+    if kind == 'match_all':
+        return 1.0
+    if kind == 'term':
+        field, value = next(iter(body.items()))
+        return 1.0 if doc[field] == value else None
+    if kind == 'range':
+        field, bounds = next(iter(body.items()))
+        value = doc[field]
+        if field == 'ts':
+            value = timeutils.to_millis(value)
+            bounds = {op: timeutils.to_millis(bound)
+                      for op, bound in bounds.items()}
+        ok = all({'gt': value > bound, 'gte': value >= bound,
+                  'lt': value < bound, 'lte': value <= bound}[op]
+                 for op, bound in bounds.items())
+        return 1.0 if ok else None
+    assert kind == 'bool'
+
+    def scores(occur):
+        clauses = body.get(occur, [])
+        if isinstance(clauses, dict):
+            clauses = [clauses]
+        return [evaluate(c, doc) for c in clauses]
+
+    must, filters, should, must_not = (
+        scores(occur) for occur in ('must', 'filter', 'should', 'must_not'))
+    if None in must or None in filters or \
+       any(s is not None for s in must_not):
+        return None
+    matched = [s for s in should if s is not None]
+    required = body.get('minimum_should_match',
+                        0 if must or filters or not should else 1)
+    if len(matched) < required:
+        return None
+    return sum(must) + sum(matched)
+
+
+def assert_equivalent(before, after, scoring):
+    for doc in documents():
+        expected, found = evaluate(before, doc), evaluate(after, doc)
+        if scoring:
+            assert expected == found, (doc, before, after)
+        else:
+            assert (expected is None) == (found is None), (doc, before, after)
+
+
+def random_clause(rng, depth):
+    choice = rng.random()
+    if depth > 2 or choice < 0.3:
+        field = rng.choice(FIELDS)
+        return {'term': {field: rng.randrange(6)}}
+    if choice < 0.6:
+        field = rng.choice(FIELDS + ('ts', ))
+        ops = rng.sample(('gt', 'gte', 'lt', 'lte'), rng.randint(1, 2))
+        if field == 'ts':
+            return {'range': {field: {
+                op: '2024-01-{:02d}'.format(rng.randint(1, 3))
+                for op in ops}}}
+        return {'range': {field: {op: rng.randrange(6) for op in ops}}}
+    bool_query = {}
+    for occur in rng.sample(('must', 'filter', 'should', 'must_not'),
+                            rng.randint(1, 3)):
+        bool_query[occur] = [random_clause(rng, depth + 1)
+                             for _ in range(rng.randint(1, 3))]
+    return {'bool': bool_query}
+
+
+def test_random_queries_match_the_same_documents():
+    rng = random.Random(42)
+    for _ in range(300):
+        clause = random_clause(rng, 0)
+        for es_query in ({'query': clause, 'size': 0},
+                         {'query': clause, 'size': 10}):
+            scoring = optimizer.uses_scores(es_query)
+            optimized = optimizer.optimize(es_query)
+            assert_equivalent(clause, optimized['query'], scoring)
+
+
+def test_must_moves_to_filter_without_scores():
+    clause = {'bool': {'must': [{'term': {'a': 1}}, {'term': {'b': 2}}]}}
+    assert optimizer.optimize({'query': clause, 'size': 0})['query'] == {
+        'bool': {'filter': [{'term': {'a': 1}}, {'term': {'b': 2}}]}}
+    assert optimizer.optimize({'query': clause, 'sort': ['a']})['query'] \
+        == {'bool': {'filter': [{'term': {'a': 1}}, {'term': {'b': 2}}]}}
+    for es_query in ({'query': clause},
+                     {'query': clause, 'sort': ['_score']},
+                     {'query': clause, 'size': 0, 'aggs': {
+                         'top': {'top_hits': {'size': 1}}}}):
+        assert optimizer.optimize(es_query)['query'] == clause
+
+
+def test_ranges_are_intersected():
+    clause = {'bool': {'filter': [
+        {'range': {'a': {'gte': 1, 'lt': 5}}},
+        {'term': {'b': 1}},
+        {'range': {'a': {'gt': 1, 'lte': 3}}},
+        {'range': {'ts': {'gte': '2024-01-01T00:00:00Z'}}},
+        {'range': {'ts': {'gte': '2024-01-02', 'lte': 'now'}}},
+        {'range': {'ts': {'gte': 'now-7d'}}},
+    ]}}
+    assert optimizer.optimize({'query': clause})['query'] == {'bool': {
+        'filter': [
+            {'range': {'a': {'gt': 1, 'lte': 3}}},
+            {'term': {'b': 1}},
+            {'range': {'ts': {'gte': '2024-01-02', 'lte': 'now'}}},
+            # Date math cannot be compared
+            {'range': {'ts': {'gte': 'now-7d'}}},
+        ]}}
+    # Scored ranges are left alone
+    clause = {'bool': {'must': [{'range': {'a': {'gte': 1}}},
+                                {'range': {'a': {'gte': 2}}}]}}
+    assert optimizer.optimize({'query': clause})['query'] == clause
+
+
+def test_nested_bools_are_flattened():
+    clause = {'bool': {
+        'filter': [{'bool': {'filter': [{'term': {'a': 1}}],
+                             'must': {'term': {'b': 1}}}}],
+        'must': [{'bool': {'must': [{'term': {'a': 2}}]}}],
+        'must_not': [{'bool': {'should': [{'term': {'a': 3}},
+                                          {'term': {'a': 4}}]}}]}}
+    assert optimizer.optimize({'query': clause})['query'] == {'bool': {
+        'must': [{'term': {'a': 2}}],
+        'filter': [{'term': {'a': 1}}, {'term': {'b': 1}}],
+        'must_not': [{'term': {'a': 3}}, {'term': {'a': 4}}]}}
+    # A lone filter is only unwrapped when scores are not used
+    clause = {'bool': {'filter': [{'term': {'a': 1}}]}}
+    assert optimizer.optimize({'query': clause})['query'] == clause
+    assert optimizer.optimize({'query': clause, 'size': 0})['query'] == \
+        {'term': {'a': 1}}
+    # Empty bools match everything and are kept
+    clause = {'bool': {'filter': [{'bool': {}}],
+                       'should': [{'term': {'a': 1}}]}}
+    assert optimizer.optimize({'query': clause, 'size': 0})['query'] == \
+        clause
+
+
+def test_empty_parts_are_dropped():
+    assert optimizer.optimize(
+        {'query': {}, 'aggs': {}, 'size': 0, 'sort': []}) == {'size': 0}
+
+
+def test_queries_opt_in():
+
+    class Query(query.BaseQuery):
+        optimize = True
+        size = 0
+        query = {'bool': {'must': [
+            {'term': {'a': variable.Variable('a')}},
+            {'range': {'a': {'gte': 0}}},
+            {'range': {'a': {'lt': variable.Variable('max')}}}]}}
+
+    data = {'a': 1, 'max': 4}
+    expected = {'query': {'bool': {'filter': [
+        {'term': {'a': 1}}, {'range': {'a': {'gte': 0, 'lt': 4}}}]}},
+        'size': 0}
+    assert Query().get_es_query(data) == expected
+    assert json.loads(Query().render_json(data)) == expected
+    assert Query.query['bool']['must'][1] == {'range': {'a': {'gte': 0}}}
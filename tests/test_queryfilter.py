@@ -87,3 +87,18 @@ def test_queryfilter_filters_query():
          'size': 0,
          'sort': []
          }
+
+
+def test_variables_changed_in_place_are_not_stale():
+    class QF(queryfilter.QueryFilter):
+        def __init__(self):
+            self.variables = {'ts': variable.Variable('ts')}
+
+    qf = QF()
+    assert [v.name for v in qf.get_variables().values()] == ['ts']
+    assert qf.get_variables()['ts'] is qf.get_variables()['ts']
+    qf.variables['ts'] = variable.Variable('start')
+    assert [v.name for v in qf.get_variables().values()] == ['start']
+    copy = qf.get_variables()['ts']
+    qf.required = True
+    assert qf.get_variables()['ts'] is not copy
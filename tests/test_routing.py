@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_routing
+----------------------------------
+
+Tests for `esqb.routing` module.
+"""
+
+import asyncio
+
+import pytest
+
+from esqb import executor, query, routing, testing, variable
+
+
+def test_daily_indices():
+    pattern = routing.IndexPattern('logs-{:%Y.%m.%d}')
+    assert pattern.get_indices(
+        {'ts': '2024-02-28T22:00:00Z', 'te': '2024-03-01T01:00:00Z'}) == [
+        'logs-2024.02.28', 'logs-2024.02.29', 'logs-2024.03.01']
+    assert pattern.get_indices({'ts': '2024-03-01T10:00:00Z',
+                                'te': '2024-03-01T11:00:00Z'}) == [
+        'logs-2024.03.01']
+
+
+def test_other_units():
+    data = {'ts': '2023-12-30', 'te': '2024-02-02'}
+    assert routing.IndexPattern('logs-{:%Y.%m}', unit='M').get_indices(
+        data) == ['logs-2023.12', 'logs-2024.01', 'logs-2024.02']
+    assert routing.IndexPattern('logs-{:%G.%V}', unit='w').get_indices(
+        {'ts': '2024-01-03', 'te': '2024-01-08'}) == [
+        'logs-2024.01', 'logs-2024.02']
+    assert routing.IndexPattern('logs-{:%Y.%m.%d.%H}', unit='h').get_indices(
+        {'ts': '2024-01-03T10:30:00Z', 'te': '2024-01-03T11:00:00Z'}) == [
+        'logs-2024.01.03.10', 'logs-2024.01.03.11']
+    with pytest.raises(ValueError):
+        routing.IndexPattern('logs', unit='q')
+
+
+def test_fallback():
+    pattern = routing.IndexPattern('logs-{:%Y.%m.%d}', max_indices=7,
+                                   fallback='logs-*')
+    assert len(pattern.get_indices({'ts': '2024-01-01',
+                                    'te': '2024-01-07'})) == 7
+    assert pattern.get_indices({'ts': '2024-01-01', 'te': '2024-01-08'}) \
+        == ['logs-*']
+    assert pattern.get_indices({'ts': '2024-01-01'}) == ['logs-*']
+    assert pattern.get_indices({'ts': 'now-1d', 'te': 'now'}) == ['logs-*']
+    assert pattern.get_indices({'ts': '2024-01-02', 'te': '2024-01-01'}) \
+        == ['logs-*']
+    with pytest.raises(ValueError):
+        routing.IndexPattern('logs-{:%Y}').get_indices({})
+
+
+def test_ignore_missing():
+    pattern = routing.IndexPattern('logs-{:%Y.%m.%d}', ignore_missing=True)
+    assert pattern.get_indices({'ts': 0, 'te': 0}) == ['logs-1970.01.01*']
+
+
+class LastDocs(query.BaseQuery):
+    index = routing.IndexPattern('logs-{:%Y.%m.%d}', fallback='logs-*')
+    size = 10
+    query = {'range': {'ts': {
+        'gte': variable.TimeVariable('ts', 'now-1d', timer=lambda: 2e5),
+        'lte': variable.TimeVariable('te', 'now', timer=lambda: 2e5)}}}
+
+
+def test_query_indices():
+    q = LastDocs()
+    assert q.get_index({'ts': '2024-03-14T22:00Z', 'te': '2024-03-15'}) == [
+        'logs-2024.03.14', 'logs-2024.03.15']
+    # The defaults of the variables are resolved
+    assert q.get_index({}) == ['logs-1970.01.02', 'logs-1970.01.03']
+    assert query.BaseQuery().get_index({}) is None
+
+    q.index = 'other'
+    assert q.get_index({}) == 'other'
+
+
+def test_executor_searches_the_query_indices():
+    documents = {'logs-2024.03.{:02d}'.format(day): [{'day': day}]
+                 for day in range(1, 31)}
+
+    async def run(url):
+        e = executor.AsyncExecutor(url, index='ignored')
+        try:
+            return [
+                await e.search(LastDocs(), {'ts': '2024-03-14T22:00Z',
+                                            'te': '2024-03-15'}),
+                (await e.msearch([(LastDocs(), {'ts': '2024-03-03',
+                                                'te': '2024-03-03'})]))[0],
+            ]
+        finally:
+            await e.close()
+
+    with testing.MockElasticsearch(documents) as es:
+        search, msearch = asyncio.run(run(es.url))
+        assert es.requests[0][1] == '/logs-2024.03.14,logs-2024.03.15/_search'
+        assert es.requests[1][2][0] == {'index': 'logs-2024.03.03'}
+
+    assert [hit['_source']['day'] for hit in search['hits']['hits']] == [
+        14, 15]
+    assert [hit['_source']['day'] for hit in msearch['hits']['hits']] == [3]
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_scan
+----------------------------------
+
+Tests for `esqb.scan` module, against the mock Elasticsearch server of
+`esqb.testing`.
+"""
+
+import pytest
+
+from esqb import query, testing, transport
+
+documents = {
+    'logs': [{'n': i, 'ts': i % 7} for i in range(53)],
+    'other': [{'n': -1, 'ts': 0}],
+}
+
+
+class ByTimestamp(query.BaseQuery):
+    query = {'match_all': {}}
+    aggs = {'n': {'terms': {'field': 'n'}}}
+    size = 5
+    sort = [{'ts': 'desc'}]
+
+
+def test_scan_pages_through_all_hits_in_sort_order():
+    with testing.MockElasticsearch(documents) as es:
+        hits = list(ByTimestamp().scan(es.url, {}, 'logs', page_size=10))
+        searches = [body for method, path, body in es.requests
+                    if path == '/_search']
+        assert not es.pits
+
+    expected = sorted(documents['logs'], key=lambda d: -d['ts'])
+    assert [hit['_source'] for hit in hits] == expected
+    assert len(searches) == 6
+    assert all(body['size'] == 10 and 'aggs' not in body
+               for body in searches)
+    assert searches[0]['sort'] == [{'ts': 'desc'}, {'_shard_doc': 'asc'}]
+    assert 'search_after' not in searches[0]
+    assert searches[1]['search_after'] == hits[9]['sort']
+
+
+def test_scan_does_not_modify_the_query():
+    q = ByTimestamp()
+    with testing.MockElasticsearch(documents) as es:
+        list(q.scan(es.url, {}, 'logs'))
+    assert q.sort == [{'ts': 'desc'}]
+    assert q.size == 5
+
+
+def test_closing_the_scan_frees_the_point_in_time():
+    with testing.MockElasticsearch(documents) as es:
+        hits = ByTimestamp().scan(es.url, {}, 'logs', page_size=10)
+        next(hits)
+        assert len(es.pits) == 1
+        hits.close()
+        assert not es.pits
+        assert len([r for r in es.requests if r[1] == '/_search']) == 1
+
+
+def test_sliced_scan_returns_every_hit_once():
+    with testing.MockElasticsearch(documents) as es:
+        t = transport.Transport(es.url)
+        hits = list(ByTimestamp().scan(
+            t, {}, 'logs', page_size=4, slices=3, max_workers=2))
+        assert not es.pits
+
+    assert sorted(hit['_source']['n'] for hit in hits) == list(range(53))
+
+
+def test_closing_a_sliced_scan_stops_the_workers():
+    with testing.MockElasticsearch(documents) as es:
+        hits = ByTimestamp().scan(es.url, {}, 'logs', page_size=2, slices=4)
+        next(hits)
+        hits.close()
+        assert not es.pits
+
+
+def test_scan_errors_are_raised():
+    with testing.MockElasticsearch(documents) as es:
+        with pytest.raises(transport.TransportError) as e:
+            list(ByTimestamp().scan(es.url, {}, 'missing'))
+    assert e.value.status == 404
+
+    def handler(method, path, body):
+        if path == '/_search' and 'slice' in body and \
+           body['slice']['id'] == 1:
+            return 500, {'error': 'boom'}
+
+    with testing.MockElasticsearch(documents, handler) as es:
+        with pytest.raises(transport.TransportError) as e:
+            list(ByTimestamp().scan(es.url, {}, 'logs', slices=2))
+        assert not es.pits
+    assert e.value.status == 500
+
+
+def test_scan_closes_the_latest_point_in_time_id():
+    def handler(method, path, body):
+        if path != '/_search':
+            return None
+        # Elasticsearch may rotate the id of the point in time
+        status, response = es.search_or_error(None, body)
+        if status == 200:
+            old = body['pit']['id']
+            new = response['pit_id'] = old + "'"
+            es.pits[new] = es.pits.pop(old)
+        return status, response
+
+    with testing.MockElasticsearch(documents, handler) as es:
+        hits = list(ByTimestamp().scan(es.url, {}, 'logs', page_size=10))
+        assert not es.pits
+        searches = [body for method, path, body in es.requests
+                    if path == '/_search']
+        deleted = [body['id'] for method, path, body in es.requests
+                   if method == 'DELETE']
+    assert len(hits) == 53
+    assert searches[1]['pit']['id'] == searches[0]['pit']['id'] + "'"
+    assert deleted == [searches[-1]['pit']['id'] + "'"]
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_segments
+----------------------------------
+
+Tests for `esqb.segments` and `esqb.timeutils` modules.
+"""
+
+import asyncio
+import collections
+from datetime import datetime
+
+from esqb import executor, query, segments, testing, timeutils, variable
+
+HOUR = 3600 * 1000
+DAY = 24 * HOUR
+NOW = 10 * DAY + 5 * HOUR + 1234
+
+documents = {'logs': [{'ts': t} for t in range(0, NOW, 7 * 60 * 1000)]}
+
+
+def histogram(body):
+    """
+    Emulates a date_histogram with a range query on ``ts``.
+    """
+    bounds = body['query']['range']['ts']
+    start = timeutils.to_millis(bounds['gte'])
+    end = timeutils.to_millis(bounds['lte'])
+    agg = body['aggs']['by_time']['date_histogram']
+    interval = timeutils.parse_interval(
+        agg.get('fixed_interval') or agg.get('calendar_interval')) or \
+        30 * DAY
+    hits = [d['ts'] for d in documents['logs'] if start <= d['ts'] <= end]
+    counts = collections.Counter(ts // interval * interval for ts in hits)
+    return {'took': 1, 'timed_out': False,
+            'hits': {'total': {'value': len(hits), 'relation': 'eq'},
+                     'hits': []},
+            'aggregations': {'by_time': {'buckets': [
+                {'key': key, 'doc_count': counts[key]}
+                for key in sorted(counts)]}}}
+
+
+def handler(method, path, body):
+    if path.endswith('/_search'):
+        return 200, histogram(body)
+
+
+class Histogram(query.BaseQuery):
+    size = 0
+    query = {'range': {'ts': {'gte': variable.Variable('ts'),
+                              'lte': variable.Variable('te')}}}
+    aggs = {'by_time': {'date_histogram': {
+        'field': 'ts', 'fixed_interval': variable.Variable(
+            'interval', default='1h')}}}
+
+
+def test_to_millis_and_back():
+    for value, millis in (
+            ('1970-01-02T00:00:00.500Z', DAY + 500),
+            ('1970-01-02', DAY),
+            ('1971', 365 * DAY),
+            (DAY, DAY),
+            (str(DAY), DAY),
+            (datetime(1970, 1, 2, 1), DAY + HOUR)):
+        assert timeutils.to_millis(value) == millis
+    assert timeutils.format_millis(DAY + 1, '1970') == \
+        '1970-01-02T00:00:00.001Z'
+    assert timeutils.format_millis(DAY, 0) == DAY
+    assert timeutils.format_millis(DAY, datetime(1970, 1, 1)) == \
+        datetime(1970, 1, 2)
+    assert timeutils.parse_interval('30m') == HOUR // 2
+    assert timeutils.parse_interval('day') == DAY
+    assert timeutils.parse_interval('month') is None
+
+
+def test_past_segments_are_served_from_the_cache():
+    cache = segments.SegmentCache('by_time', timer=lambda: NOW / 1000)
+    data = {'ts': 2 * DAY + 30 * 60 * 1000, 'te': NOW}
+    expected = histogram(Histogram().get_es_query(data))
+
+    with testing.MockElasticsearch(documents, handler) as es:
+        first = cache.search(Histogram(), es.url, data, 'logs')
+        assert len(es.requests) == 1
+        second = cache.search(Histogram(), es.url, data, 'logs')
+        assert len(es.requests) == 3
+        tail = es.requests[-1][2]['query']['range']['ts']
+
+    assert first['aggregations'] == second['aggregations'] == \
+        expected['aggregations']
+    assert second['hits']['total'] == expected['hits']['total']
+    assert first['hits']['total'] == expected['hits']['total']
+    # Only the partial first hour and the open hour are searched again
+    assert tail == {'gte': 10 * DAY + 5 * HOUR, 'lte': NOW}
+    assert cache.cache.info().currsize == 8 * 24 + 4
+
+
+def test_missing_segments_are_grouped():
+    cache = segments.SegmentCache('by_time', segment='1d',
+                                  timer=lambda: NOW / 1000)
+    data = {'ts': '1970-01-02', 'te': '1970-01-08T00:00:00Z'}
+    expected = histogram(Histogram().get_es_query(data))
+    plan = cache.plan(Histogram(), data)
+    plan.finish([histogram(Histogram().get_es_query(d))
+                 for d in plan.requests])
+    assert plan.requests == [data]
+
+    # Forget two days in the middle
+    key = plan.key
+    cache.cache._data.pop(key + (3 * DAY, ))
+    cache.cache._data.pop(key + (4 * DAY, ))
+    plan = cache.plan(Histogram(), data)
+    assert plan.requests == [
+        {'ts': '1970-01-04T00:00:00.000Z', 'te': '1970-01-05T23:59:59.999Z'},
+        {'ts': '1970-01-08T00:00:00.000Z', 'te': '1970-01-08T00:00:00Z'},
+    ]
+    response = plan.finish([histogram(Histogram().get_es_query(d))
+                            for d in plan.requests])
+    assert response['aggregations'] == expected['aggregations']
+    assert response['hits']['total'] == expected['hits']['total']
+
+
+def test_settle_and_segment_length():
+    cache = segments.SegmentCache('by_time', segment='1d', settle=2 * 86400,
+                                  timer=lambda: NOW / 1000)
+    data = {'ts': 0, 'te': NOW, 'interval': '3h'}
+    plan = cache.plan(Histogram(), data)
+    assert [s[1] - s[0] for s in plan.segments] == [DAY] * 10 + [NOW % DAY + 1]
+    assert [s[2] for s in plan.segments] == [True] * 8 + [False] * 3
+
+
+def test_ineligible_queries_are_sent_as_they_are():
+    cache = segments.SegmentCache('by_time', segment='1d')
+    assert cache.plan(Histogram(), {'ts': 0, 'te': NOW,
+                                    'interval': '7h'}) is None
+    assert cache.plan(Histogram(), {'ts': 'now-1d', 'te': 'now'}) is None
+
+    class Monthly(Histogram):
+        aggs = {'by_time': {'date_histogram': {
+            'field': 'ts', 'calendar_interval': 'month'}}}
+
+    class Weekly(Histogram):
+        aggs = {'by_time': {'date_histogram': {
+            'field': 'ts', 'calendar_interval': 'week'}}}
+
+    assert cache.plan(Weekly(), {'ts': 0, 'te': NOW}) is None
+
+    with testing.MockElasticsearch(documents, handler) as es:
+        cache.search(Monthly(), es.url, {'ts': 0, 'te': NOW}, 'logs')
+        assert es.requests[0][2]['query']['range']['ts'] == {
+            'gte': 0, 'lte': NOW}
+
+
+def test_search_async():
+    cache = segments.SegmentCache('by_time', timer=lambda: NOW / 1000)
+    data = {'ts': 0, 'te': NOW}
+
+    async def run(url):
+        e = executor.AsyncExecutor(url, index='logs')
+        try:
+            return [await cache.search_async(e, Histogram(), data)
+                    for _ in range(2)]
+        finally:
+            await e.close()
+
+    with testing.MockElasticsearch(documents, handler) as es:
+        first, second = asyncio.run(run(es.url))
+        assert len(es.requests) == 2
+    assert first['aggregations'] == second['aggregations'] == histogram(
+        Histogram().get_es_query(data))['aggregations']
+
+
+def test_relative_ranges_keep_their_segments():
+    clock = [NOW / 1000]
+
+    class Relative(Histogram):
+        query = {'range': {'ts': {
+            'gte': variable.TimeVariable('ts', 'now-1d', int,
+                                         timer=lambda: clock[0]),
+            'lte': variable.TimeVariable('te', 'now', int,
+                                         timer=lambda: clock[0])}}}
+
+    cache = segments.SegmentCache('by_time', timer=lambda: clock[0])
+    first = cache.plan(Relative(), {})
+    clock[0] += 120
+    second = cache.plan(Relative(), {})
+    assert first.key == second.key
+    assert second.segments[0][0] == first.segments[0][0] + 120 * 1000
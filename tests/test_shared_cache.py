@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_shared_cache
+----------------------------------
+
+Tests for `esqb.shared_cache` module.
+"""
+
+import json
+import os
+
+import pytest
+
+from esqb import fingerprint, query, queryfilter, testing, variable
+from esqb.shared_cache import SharedCache, _digest, _key_default
+
+fork = pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def run_in_child(func):
+    """
+    Run `func` in a forked process, and return its exit status.
+    """
+    pid = os.fork()
+    if pid == 0:
+        try:
+            func()
+        except BaseException:
+            os._exit(1)
+        os._exit(0)
+    return os.waitpid(pid, 0)[1]
+
+
+def test_get_and_set(tmp_path):
+    cache = SharedCache(str(tmp_path / 'cache'), maxsize=10, slot_size=256)
+    assert cache.maxsize == 16
+    assert cache.get('a') is None
+    cache.set('a', {'x': [1, 2]})
+    cache.set(('b', frozenset({1, 2})), None)
+    assert cache.get('a') == {'x': [1, 2]}
+    assert cache.get(('b', frozenset({2, 1})), 0) is None
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    assert cache.info() == (3, 1, 0, 0, 16, 2)
+    assert sorted(cache.values(), key=repr) == [1, None]
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.get('a') is None
+
+
+def test_large_values_are_not_stored(tmp_path):
+    cache = SharedCache(str(tmp_path / 'cache'), maxsize=4, slot_size=128)
+    cache.set('a', 'x' * 200)
+    assert cache.get('a') is None
+
+
+def test_expiration(tmp_path):
+    clock = Clock()
+    cache = SharedCache(str(tmp_path / 'cache'), maxsize=4, slot_size=128,
+                        ttl=10, timer=clock)
+    cache.set('a', 1)
+    clock.now += 9
+    assert cache.get('a') == 1
+    clock.now += 1
+    assert cache.get('a') is None
+    assert cache.info().expirations == 1
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    clock = Clock()
+    cache = SharedCache(str(tmp_path / 'cache'), maxsize=2, slot_size=128,
+                        ways=2, timer=clock)
+    cache.set('a', 1)
+    clock.now += 1
+    cache.set('b', 2)
+    clock.now += 1
+    assert cache.get('a') == 1
+    clock.now += 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.info().evictions == 1
+
+
+def test_sizes_must_match(tmp_path):
+    path = str(tmp_path / 'cache')
+    SharedCache(path, maxsize=8, slot_size=128).close()
+    SharedCache(path, maxsize=8, slot_size=128).close()
+    with pytest.raises(ValueError):
+        SharedCache(path, maxsize=16, slot_size=128)
+    with pytest.raises(ValueError):
+        SharedCache(path, maxsize=0)
+
+
+@fork
+def test_entries_are_shared_between_processes(tmp_path):
+    cache = SharedCache(str(tmp_path / 'cache'), maxsize=64, slot_size=256)
+    key = (query.BaseQuery, (('ids', frozenset({1, 2, 3})), ))
+
+    def child():
+        assert cache.get(key) is None
+        cache.set(key, {'n': 1})
+
+    assert run_in_child(child) == 0
+    assert cache.get(key) == {'n': 1}
+
+    # A new mapping of the same file
+    other = SharedCache(str(tmp_path / 'cache'), maxsize=64, slot_size=256)
+    assert run_in_child(lambda: other.set('x', 2)) == 0
+    assert cache.get('x') == 2
+
+
+@fork
+def test_concurrent_writers(tmp_path):
+    path = str(tmp_path / 'cache')
+    cache = SharedCache(path, maxsize=16, slot_size=512, ways=4)
+
+    def child():
+        for i in range(500):
+            key = 'key-{}'.format(i % 40)
+            cache.set(key, [key] * (i % 50))
+            value = cache.get('key-{}'.format((i * 7) % 40))
+            assert value is None or len(set(value)) <= 1 and \
+                value[:1] in ([], ['key-{}'.format((i * 7) % 40)])
+
+    pids = []
+    for _ in range(4):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                child()
+            except BaseException:
+                os._exit(1)
+            os._exit(0)
+        pids.append(pid)
+    assert [os.waitpid(pid, 0)[1] for pid in pids] == [0] * 4
+    assert len(cache) == 16
+
+
+def test_render_cache(tmp_path):
+    cache = SharedCache(str(tmp_path / 'cache'), maxsize=16)
+
+    class Cached(query.BaseQuery):
+        render_cache = cache
+        size = variable.Variable('size', 10, type=int)
+
+    es_query = Cached().get_es_query({'size': 5})
+    assert Cached().get_es_query({'size': 5}) == es_query
+    assert Cached().get_es_query({'size': 6})['size'] == 6
+    assert cache.info()[:2] == (1, 2)
+
+
+def test_single_flight_results(tmp_path):
+    class LastDocs(query.BaseQuery):
+        size = 10
+
+        def result(self, response):
+            return len(self.dotget(response, 'hits.hits'))
+
+    flights = fingerprint.SingleFlight(
+        SharedCache(str(tmp_path / 'cache'), maxsize=16))
+    with testing.MockElasticsearch({'logs': [{}, {}]}) as es:
+        assert flights.execute(LastDocs(), {}, es.url, index='logs') == 2
+        assert flights.execute(LastDocs(), {}, es.url, index='logs') == 2
+        assert len(es.requests) == 1
+
+
+def test_values_which_cannot_be_pickled_are_not_stored(tmp_path):
+    cache = SharedCache(str(tmp_path / 'cache'), maxsize=4)
+    cache.set('a', (i for i in range(3)))
+    assert cache.get('a') is None
+
+
+def test_files_writable_by_others_are_refused(tmp_path):
+    path = tmp_path / 'cache'
+    SharedCache(str(path), maxsize=4).close()
+    assert path.stat().st_mode & 0o777 == 0o600
+    path.chmod(0o666)
+    with pytest.raises(PermissionError):
+        SharedCache(str(path), maxsize=4)
+    path.chmod(0o600)
+    link = tmp_path / 'link'
+    link.symlink_to(path)
+    with pytest.raises(OSError):
+        SharedCache(str(link), maxsize=4)
+    SharedCache(str(path), maxsize=4).close()
+    if os.geteuid() == 0:
+        os.chown(str(path), 12345, -1)
+        with pytest.raises(PermissionError):
+            SharedCache(str(path), maxsize=4)
+
+
+def test_keys_do_not_depend_on_addresses():
+    class term_filter(queryfilter.QueryFilter):
+
+        def __init__(self, field):
+            self.field = field
+            self.variables = {'value': variable.Variable(
+                'value', builder=lambda value: value.lower())}
+
+        def apply(self, query, data):
+            return {'term': {self.field: self.variables['value']}}
+
+    class Filtered(query.BaseQuery):
+
+        def __init__(self):
+            super().__init__()
+            self.filters = [term_filter('host')]
+
+    key = Filtered().get_cache_key({'value': 'A'})
+    assert key == Filtered().get_cache_key({'value': 'A'})
+    assert ' at 0x' not in json.dumps(key, default=_key_default)
+    assert _digest(key) == _digest(Filtered().get_cache_key({'value': 'A'}))
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_streaming
+----------------------------------
+
+Tests for `esqb.streaming` module.
+"""
+
+import io
+import json
+
+import pytest
+
+from esqb import query, streaming, testing, transport
+
+response = {
+    'took': 3,
+    'hits': {
+        'total': {'value': 40, 'relation': 'eq'},
+        'hits': [
+            {'_id': str(i),
+             '_source': {'text': 'q"u\\o{t}e[s] ñ ' * i, 'n': i * 1.5,
+                         'ok': i % 2 == 0, 'none': None, 'big': 10 ** i}}
+            for i in range(40)],
+    },
+    'aggregations': {
+        'by_user': {'buckets': [{'key': 'a', 'doc_count': 3},
+                                {'key': 12345, 'doc_count': 1}]},
+        'keyed': {'buckets': {'x': {'doc_count': 1}, 'y': {}}},
+        'empty': {'buckets': []},
+        # Keyed percentiles: numbers ending exactly at a chunk end
+        'p': {'values': {'50.0': 12.5, '99.0': -1e-05, '99.9': 1500.25}},
+    },
+}
+
+text = json.dumps(response, indent=1, ensure_ascii=False)
+compact = json.dumps(response, separators=(',', ':'), ensure_ascii=False)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 6, 7, 11, 14, 16, 21,
+                                        42, 55, 1 << 20])
+@pytest.mark.parametrize('text', [text, compact])
+def test_items_are_the_same_whatever_the_chunks(text, chunk_size):
+    source = io.BytesIO(text.encode('utf-8'))
+    hits = list(streaming.iter_items(source, 'hits.hits', chunk_size))
+    assert hits == response['hits']['hits']
+
+    items = list(streaming.iter_paths(text, [
+        'aggregations.by_user.buckets', 'took', 'aggregations.keyed.buckets',
+        'aggregations.empty.buckets', 'hits.hits.2._id', 'missing.path',
+        'aggregations.p.values',
+    ], chunk_size))
+    assert items == [
+        ('took', 3),
+        ('hits.hits.2._id', '2'),
+        ('aggregations.by_user.buckets', {'key': 'a', 'doc_count': 3}),
+        ('aggregations.by_user.buckets', {'key': 12345, 'doc_count': 1}),
+        ('aggregations.keyed.buckets', ('x', {'doc_count': 1})),
+        ('aggregations.keyed.buckets', ('y', {})),
+        ('aggregations.p.values', ('50.0', 12.5)),
+        ('aggregations.p.values', ('99.0', -1e-05)),
+        ('aggregations.p.values', ('99.9', 1500.25)),
+    ]
+
+
+def test_chunks_may_be_given_as_an_iterable():
+    chunks = [text[i:i + 7].encode('utf-8') for i in range(0, len(text), 7)]
+    assert list(streaming.iter_items(chunks, 'aggregations.by_user.buckets')) \
+        == response['aggregations']['by_user']['buckets']
+
+
+def test_truncated_documents_fail():
+    with pytest.raises(ValueError):
+        list(streaming.iter_items(text[:len(text) // 2], 'hits.hits', 64))
+
+
+class AllDocs(query.BaseQuery):
+    size = 100
+
+
+def test_stream_search():
+    documents = {'logs': [{'n': i} for i in range(30)]}
+    with testing.MockElasticsearch(documents) as es:
+        t = transport.Transport(es.url)
+        hits = list(streaming.stream_search(AllDocs(), t, {}, index='logs'))
+        assert [hit['_source'] for hit in hits] == documents['logs']
+
+        # The connection is reused once the response has been read
+        items = streaming.stream_search(
+            AllDocs(), t, {}, 'hits.total', 'logs')
+        assert list(items) == [('value', 30), ('relation', 'eq')]
+        assert es.connections == 1
+
+        # and dropped when it was not
+        items = streaming.stream_search(
+            AllDocs(), t, {}, index='logs', chunk_size=64)
+        next(items)
+        items.close()
+        assert len(list(streaming.stream_search(
+            AllDocs(), t, {}, index='logs'))) == 30
+        assert es.connections == 2
+
+        with pytest.raises(transport.TransportError):
+            list(streaming.stream_search(AllDocs(), es.url, {}, index='x'))
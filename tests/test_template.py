@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_template
+----------------------------------
+
+Tests for `esqb.template` module.
+"""
+
+import json
+
+import pytest
+
+from esqb import encoding, query, queryfilter, template, variable
+
+field = variable.Variable('field', default='f')
+value = variable.Variable('value', default=0)
+
+
+def test_constant_template_returns_source():
+    source = {'a': [{'b': 1}]}
+    t = template.Template(source)
+    assert t.is_constant
+    assert t.render({}) is source
+
+
+def test_renders_keys_and_values():
+    source = {
+        'must': [
+            {'match': {field: value}},
+            {'term': {'name': 'esqb'}},
+        ]
+    }
+    t = template.Template(source)
+    assert t.variables == [field, value]
+    assert t.render({'field': 'x', 'value': 'y'}) == {
+        'must': [
+            {'match': {'x': 'y'}},
+            {'term': {'name': 'esqb'}},
+        ]
+    }
+
+
+def test_constant_subtrees_are_shared():
+    constant = {'terms': {'field': 'name', 'size': 10}}
+    source = {'by_name': constant, 'size': value}
+    rendered = template.Template(source).render({'value': 3})
+    assert rendered == {'by_name': constant, 'size': 3}
+    assert rendered['by_name'] is constant
+    assert source['size'] is value
+
+
+def test_templates_are_shared_between_instances():
+    class Q(query.BaseQuery):
+        aggs = {'x': value}
+
+    assert Q().get_template('aggs') is Q().get_template('aggs')
+
+
+def test_template_follows_reassigned_parts():
+    class Q(query.BaseQuery):
+        aggs = {'x': value}
+
+    q = Q()
+    assert q.get_es_query({'value': 1})['aggs'] == {'x': 1}
+    q.aggs = {'y': value}
+    assert q.get_es_query({'value': 1})['aggs'] == {'y': 1}
+    assert Q().get_es_query({'value': 1})['aggs'] == {'x': 1}
+
+
+def test_render_json_matches_render():
+    source = {
+        'must': [
+            {'match': {field: value}},
+            {'term': {'name': 'esqb', 1: None}},
+        ],
+        'size': value,
+    }
+    t = template.Template(source)
+    data = {'field': 'año', 'value': [1, {'x': True}]}
+    assert json.loads(t.render_json(data).decode('utf-8')) == \
+        json.loads(json.dumps(t.render(data)))
+    assert json.loads(template.Template([1, 'a']).render_json({})) == [1, 'a']
+
+
+def test_query_render_json_matches_get_es_query():
+    class RangeFilter(queryfilter.QueryFilter):
+        variables = {'ts': variable.Variable('ts')}
+
+        def apply(self, query, data):
+            query.setdefault('bool', {}).setdefault('must', []).append(
+                {'range': {'timestamp': {'gte': self.variables['ts']}}})
+            return query
+
+    class Q(query.BaseQuery):
+        size = value
+        query = {'bool': {'must': [{'term': {field: 'esqb'}}]}}
+        aggs = {'x': {'terms': {'field': field}}}
+        filters = [RangeFilter()]
+
+    for data in ({}, {'ts': 'now-1d', 'field': 'name', 'value': 10}):
+        assert json.loads(Q().render_json(data)) == Q().get_es_query(data)
+
+
+def test_json_backend_can_be_replaced():
+    calls = []
+
+    def dumps(obj):
+        calls.append(obj)
+        return json.dumps(obj).encode('utf-8')
+
+    encoding.set_backend(dumps)
+    try:
+        assert encoding.dumps({'a': 1}) == b'{"a": 1}'
+        assert calls == [{'a': 1}]
+    finally:
+        encoding.set_backend('json')
+    with pytest.raises(ValueError):
+        encoding.set_backend('unknown')
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_utils
+----------------------------------
+
+Tests for `esqb.utils` module.
+"""
+
+from esqb import utils, variable
+
+key = variable.Variable('key', default='k')
+value = variable.Variable('value', default=0)
+
+
+def doc():
+    return {
+        'constant': {'terms': {'field': 'name'}},
+        'dynamic': [{key: value}, {'size': 10}],
+    }
+
+
+def test_replace_copies_everything():
+    d = doc()
+    r = utils.replace_variables(d, {'key': 'x', 'value': 1})
+    assert r == {
+        'constant': {'terms': {'field': 'name'}},
+        'dynamic': [{'x': 1}, {'size': 10}],
+    }
+    assert r['constant'] is not d['constant']
+    assert r['dynamic'][1] is not d['dynamic'][1]
+
+
+def test_replace_shared_only_rebuilds_the_spine():
+    d = doc()
+    r = utils.replace_variables(d, {'key': 'x', 'value': 1}, share=True)
+    assert r == utils.replace_variables(d, {'key': 'x', 'value': 1})
+    assert r is not d
+    assert r['constant'] is d['constant']
+    assert r['dynamic'] is not d['dynamic']
+    assert r['dynamic'][1] is d['dynamic'][1]
+    assert d['dynamic'][0] == {key: value}
+
+
+def test_replace_shared_returns_constant_docs():
+    d = {'a': [1, {'b': 2}]}
+    assert utils.replace_variables(d, {}, share=True) is d
+
+
+def test_replace_shared_keeps_the_order_of_the_keys():
+    d = {'a': 1, 'b': {'c': 2}, key: 3, 'd': [4, value]}
+    r = utils.replace_variables(d, {'key': 'x', 'value': 5}, share=True)
+    assert list(r.items()) == [
+        ('a', 1), ('b', {'c': 2}), ('x', 3), ('d', [4, 5])]
+    assert r['b'] is d['b']
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_variable
+----------------------------------
+
+Tests for `esqb.variable` module.
+"""
+
+from datetime import datetime
+
+import pytest
+
+from esqb import cache, query, timeutils, variable
+
+NOW = timeutils.to_millis('2024-03-15T10:37:45.123Z')
+
+
+def timer():
+    return NOW / 1000
+
+
+def test_copy_keeps_the_class():
+    ts = variable.TimeVariable('ts', 'now-1h', round_to='5m', timer=timer)
+    copy = ts.copy(name='start')
+    assert type(copy) is variable.TimeVariable
+    assert copy.name == 'start' and copy.round_to == '5m'
+    assert type(variable.Variable('v').copy()) is variable.Variable
+
+
+def test_times_are_rounded_keeping_their_format():
+    ts = variable.TimeVariable('ts', round_to='1m')
+    assert ts.value_from_dict({'ts': '2024-03-15T10:37:45.123Z'}) == \
+        '2024-03-15T10:37:00.000Z'
+    assert ts.value_from_dict({'ts': NOW}) == \
+        timeutils.to_millis('2024-03-15T10:37:00Z')
+    assert ts.value_from_dict({'ts': datetime(2024, 3, 15, 10, 37, 45)}) \
+        == datetime(2024, 3, 15, 10, 37)
+    assert ts.value_from_dict({}) is None
+    assert ts.value_from_dict({'ts': 'yesterday'}) == 'yesterday'
+
+    te = variable.TimeVariable('te', round_to='1h', rounding='up')
+    assert te.value_from_dict({'te': '2024-03-15T10:37:45Z'}) == \
+        '2024-03-15T10:59:59.999Z'
+
+    # Weeks start on Mondays, as in Elasticsearch
+    week = variable.TimeVariable('ts', round_to='1w')
+    assert week.value_from_dict({'ts': '2024-03-15T10:37:45Z'}) == \
+        '2024-03-11T00:00:00.000Z'
+    week = variable.TimeVariable('ts', round_to='1w', rounding='up')
+    assert week.value_from_dict({'ts': '2024-03-11T00:00:00Z'}) == \
+        '2024-03-17T23:59:59.999Z'
+    assert variable.TimeVariable('ts', round_to='7d').value_from_dict(
+        {'ts': '2024-03-15T10:37:45Z'}) == '2024-03-14T00:00:00.000Z'
+
+
+def test_date_math_is_resolved_or_rounded_by_elasticsearch():
+    ts = variable.TimeVariable('ts', 'now-1h', timer=timer)
+    assert ts.value_from_dict({}) == '2024-03-15T09:37:00.000Z'
+    assert ts.value_from_dict({'ts': 'now/d'}) == '2024-03-15T00:00:00.000Z'
+
+    te = variable.TimeVariable('te', 'now', rounding='up', timer=timer)
+    assert te.value_from_dict({}) == '2024-03-15T10:37:59.999Z'
+    assert te.value_from_dict({'te': 'now/d'}) == '2024-03-15T23:59:59.999Z'
+    assert te.value_from_dict({'te': 'now-1d/d'}) == \
+        '2024-03-14T23:59:59.999Z'
+
+    ts = variable.TimeVariable('ts', 'now-1h', type=int, timer=timer)
+    assert ts.value_from_dict({}) == \
+        timeutils.to_millis('2024-03-15T09:37:00Z')
+
+    ts = variable.TimeVariable('ts', 'now-1h', round_to='5m', date_math=True)
+    assert ts.value_from_dict({}) == 'now-1h/m'
+    assert ts.value_from_dict({'ts': 'now/d'}) == 'now/d'
+    assert ts.value_from_dict({'ts': '2024-03-15||+1d'}) == \
+        '2024-03-15||+1d/m'
+    assert ts.value_from_dict({'ts': '2024-03-15T10:37:45Z'}) == \
+        '2024-03-15T10:35:00.000Z'
+
+
+def test_invalid_granularities():
+    with pytest.raises(ValueError):
+        variable.TimeVariable('ts', round_to='1M')
+    with pytest.raises(ValueError):
+        variable.TimeVariable('ts', rounding='nearest')
+
+
+def test_requests_within_a_period_share_cached_renders():
+    clock = [NOW / 1000]
+
+    class Range(query.BaseQuery):
+        render_cache = cache.LRUCache()
+        query = {'range': {'ts': {
+            'gte': variable.TimeVariable('ts', 'now-1h',
+                                         timer=lambda: clock[0]),
+            'lte': variable.TimeVariable('te', 'now', rounding='up',
+                                         timer=lambda: clock[0])}}}
+
+    q = Range()
+    first = q.get_es_query({'ts': NOW - 3600 * 1000})
+    clock[0] += 10
+    second = q.get_es_query({'ts': NOW - 3600 * 1000 + 10000})
+    assert first == second
+    assert Range.render_cache.info().hits == 1
+    assert second['query']['range']['ts'] == {
+        'gte': timeutils.to_millis('2024-03-15T09:37:00Z'),
+        'lte': '2024-03-15T10:37:59.999Z'}
+
+    # The default of te depends on the time
+    clock[0] += 60
+    third = q.get_es_query({'ts': NOW - 3600 * 1000})
+    assert third['query']['range']['ts']['lte'] == '2024-03-15T10:38:59.999Z'
+    assert Range.render_cache.info().misses == 2